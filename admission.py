@@ -0,0 +1,323 @@
+"""Admission control for Chrome-backed work.
+
+A fixed number of browser slots is shared by all users, one per live
+Chrome. A run (login, operations, speculative warmup) takes the user's slot
+and, when it ends, leaves it IDLE with the user's Chrome; the slot is freed
+when the session is closed or recovered. A user holds at most one slot, so
+a login that takes over a warmup, or a run on an existing Chrome, keeps it.
+When every slot is taken, runs queue, and idle Chromes are closed to make
+room for them (the longest idle first). The next free slot goes to the
+waiting user with the least recent run time (decayed slot-seconds), so one
+user's repeated runs do not push others back. Waiting runs are told their
+queue position and an ETA.
+
+BROWSER_SLOTS is a number, or 'auto' to size from the CPUs and the memory
+available to this process (cgroup limit included).
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from logger import session_logger
+import metrics
+
+# Slot count, or 'auto'; defaults to the readiness probe's session capacity
+BROWSER_SLOTS = os.getenv('BROWSER_SLOTS', os.getenv('MAX_BROWSER_SESSIONS', '10'))
+SLOTS_PER_CPU = float(os.getenv('SLOTS_PER_CPU', '1.5'))  # 'auto': concurrent runs per CPU
+CHROME_SLOT_MB = int(os.getenv('CHROME_SLOT_MB', '400'))  # 'auto': memory reserved per slot
+ADMISSION_TIMEOUT = float(os.getenv('ADMISSION_TIMEOUT', '600'))  # Max seconds a run waits in the queue
+FAIR_SHARE_HALF_LIFE = float(os.getenv('FAIR_SHARE_HALF_LIFE', '600'))  # Decay of per-user slot time
+POSITION_UPDATE_INTERVAL = 5  # Seconds between queue position checks for a waiting run
+DEFAULT_RUN_SECONDS = 60  # Run length assumed for the ETA until runs have been measured
+
+# acquire() results
+GRANTED, TIMED_OUT, CANCELLED = 'granted', 'timeout', 'cancelled'
+IDLE = 'idle'  # Holder kind of a slot kept by a live Chrome between runs
+
+wait_seconds = metrics.Histogram('dsts_admission_wait_seconds', 'Time runs waited for a browser slot',
+                                 ['kind'])
+results = metrics.Counter('dsts_admission_results_total', 'Browser slot requests by result',
+                          ['kind', 'result'])
+
+def _available_memory():
+    """Bytes of memory this process can still use: MemAvailable, capped by the cgroup."""
+    available = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            limit = f.read().strip()
+        with open('/sys/fs/cgroup/memory.current') as f:
+            current = int(f.read())
+        if limit != 'max':
+            headroom = int(limit) - current
+            available = headroom if available is None else min(available, headroom)
+    except (OSError, ValueError):
+        pass
+    return available
+
+def derive_slots():
+    """Slots the CPUs and available memory support, at least one."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    by_cpu = int(cpus * SLOTS_PER_CPU)
+    memory = _available_memory()
+    by_memory = memory // (CHROME_SLOT_MB * 1024 * 1024) if memory is not None else by_cpu
+    slots = max(1, min(by_cpu, by_memory))
+    session_logger.info("Browser slots: %s (%s CPUs, %s MB available)", slots, cpus,
+                        memory // (1024 * 1024) if memory is not None else 'unknown')
+    return slots
+
+class Ticket:
+    """One run's request for a slot."""
+
+    def __init__(self, user_id, kind):
+        self.user_id = user_id
+        self.kind = kind
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.result = None  # GRANTED, TIMED_OUT or CANCELLED once done
+        self.finished_at = None
+        self.done = threading.Event()
+        self._callbacks = []
+
+    def on_done(self, func):
+        """Call func() once the ticket is granted or abandoned."""
+        self._callbacks.append(func)
+        if self.done.is_set():
+            func()
+
+    def _finish(self, result):
+        self.granted = result == GRANTED
+        self.result = result
+        self.finished_at = time.monotonic()
+        self.done.set()
+        for func in self._callbacks:
+            func()
+
+class AdmissionController:
+    def __init__(self, slots):
+        self.slots = slots
+        self.holders = {}  # user_id -> (kind, monotonic start)
+        self.waiting = []
+        self.run_seconds = DEFAULT_RUN_SECONDS  # Moving average of run length
+        # evictor(user_id) -> bool closes an idle user's Chrome for a queued run; set
+        # by the session manager and called under the lock, so it must not block
+        self.evictor = None
+        self._usage = {}  # user_id -> (decayed slot-seconds, monotonic time of value)
+        self._lock = threading.Lock()
+
+    def _usage_at(self, user_id, now):
+        value, at = self._usage.get(user_id, (0.0, now))
+        return value * 0.5 ** ((now - at) / FAIR_SHARE_HALF_LIFE)
+
+    def _order(self, now):
+        return sorted(self.waiting, key=lambda t: (self._usage_at(t.user_id, now), t.enqueued_at))
+
+    def _settle(self, user_id, held, now):
+        """Account for the run that held user_id's slot since held[1]."""
+        if held[0] == IDLE:
+            return
+        used = now - held[1]
+        self._usage[user_id] = (self._usage_at(user_id, now) + used, now)
+        # Forget users whose slot time has decayed away
+        for other in [u for u, (value, at) in self._usage.items()
+                      if value * 0.5 ** ((now - at) / FAIR_SHARE_HALF_LIFE) < 1]:
+            if other != user_id:
+                del self._usage[other]
+        if held[0] != 'warmup':
+            self.run_seconds = 0.8 * self.run_seconds + 0.2 * used
+
+    def _take_over(self, user_id, kind, now):
+        """Re-stamp the user's slot for a new run (after a warmup or between runs)."""
+        self._settle(user_id, self.holders[user_id], now)
+        self.holders[user_id] = (kind, now)
+
+    def _evict_locked(self):
+        """Free the longest idle slot for the queue; False if none could be."""
+        idle = sorted((start, user_id) for user_id, (kind, start) in self.holders.items() if kind == IDLE)
+        for _, user_id in idle:
+            if self.evictor and self.evictor(user_id):
+                del self.holders[user_id]
+                return True
+        return False
+
+    def _grant_locked(self):
+        now = time.monotonic()
+        granted = []
+        while self.waiting and (len(self.holders) < self.slots or self._evict_locked()):
+            ticket = self._order(now)[0]
+            self.waiting.remove(ticket)
+            self.holders[ticket.user_id] = (ticket.kind, now)
+            granted.append(ticket)
+        return granted
+
+    def enqueue(self, user_id, kind):
+        """Ticket for a slot; granted at once if the user holds one or one is free."""
+        with self._lock:
+            for ticket in self.waiting:
+                if ticket.user_id == user_id:
+                    return ticket
+            ticket = Ticket(user_id, kind)
+            if user_id in self.holders:
+                self._take_over(user_id, kind, ticket.enqueued_at)
+                granted = []
+                ticket.granted = True
+                ticket.result = GRANTED
+                ticket.finished_at = ticket.enqueued_at
+                ticket.done.set()
+            else:
+                self.waiting.append(ticket)
+                granted = self._grant_locked()
+        for t in granted:
+            t._finish(GRANTED)
+        return ticket
+
+    def try_acquire(self, user_id, kind):
+        """Take a free slot without queueing; False if none is free."""
+        with self._lock:
+            if user_id in self.holders:
+                self._take_over(user_id, kind, time.monotonic())
+                return True
+            # A warmup is speculative: it takes a free slot but closes no one's idle Chrome
+            if self.waiting or (len(self.holders) >= self.slots
+                                and (kind == 'warmup' or not self._evict_locked())):
+                results.labels(kind, 'unavailable').inc()
+                return False
+            self.holders[user_id] = (kind, time.monotonic())
+        results.labels(kind, 'immediate').inc()
+        wait_seconds.labels(kind).observe(0)
+        return True
+
+    def position(self, ticket):
+        """1-based place in the queue, or 0 once the ticket has left it."""
+        with self._lock:
+            if ticket not in self.waiting:
+                return 0
+            return self._order(time.monotonic()).index(ticket) + 1
+
+    def eta(self, position):
+        """Estimated seconds until the run at `position` gets a slot."""
+        return math.ceil(position / self.slots) * self.run_seconds
+
+    def in_run(self, user_id):
+        """True while a run or warmup holds the user's slot (not just an idle Chrome)."""
+        held = self.holders.get(user_id)
+        return held is not None and held[0] != IDLE
+
+    def _abandon(self, ticket, result):
+        with self._lock:
+            if ticket not in self.waiting:
+                return False
+            self.waiting.remove(ticket)
+        results.labels(ticket.kind, result).inc()
+        ticket._finish(result)
+        return True
+
+    def _record(self, ticket):
+        if ticket.granted:
+            waited = ticket.finished_at - ticket.enqueued_at
+            wait_seconds.labels(ticket.kind).observe(waited)
+            results.labels(ticket.kind, 'queued' if waited > 0.01 else 'immediate').inc()
+        return ticket.result
+
+    def acquire(self, user_id, kind, on_wait=None, timeout=ADMISSION_TIMEOUT):
+        """Wait for a slot; on_wait(position, eta) is called when the position changes.
+
+        GRANTED, or TIMED_OUT or CANCELLED (by /cancel or /logout) without a slot.
+        """
+        ticket = self.enqueue(user_id, kind)
+        deadline = time.monotonic() + timeout
+        reported = None
+        while not ticket.done.is_set():
+            position = self.position(ticket)
+            if on_wait and position and position != reported:
+                on_wait(position, self.eta(position))
+                reported = position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._abandon(ticket, TIMED_OUT)
+                break
+            ticket.done.wait(min(remaining, POSITION_UPDATE_INTERVAL))
+        return self._record(ticket)
+
+    async def acquire_async(self, user_id, kind, on_wait=None, timeout=ADMISSION_TIMEOUT):
+        """acquire() for coroutines; on_wait is a coroutine function."""
+        loop = asyncio.get_running_loop()
+        ticket = self.enqueue(user_id, kind)
+        done = asyncio.Event()
+        ticket.on_done(lambda: loop.call_soon_threadsafe(done.set))
+        deadline = time.monotonic() + timeout
+        reported = None
+        while not ticket.done.is_set():
+            position = self.position(ticket)
+            if on_wait and position and position != reported:
+                await on_wait(position, self.eta(position))
+                reported = position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._abandon(ticket, TIMED_OUT)
+                break
+            try:
+                await asyncio.wait_for(done.wait(), min(remaining, POSITION_UPDATE_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+        return self._record(ticket)
+
+    def cancel(self, user_id):
+        """Drop the user's queued run, if any (/logout, cancel)."""
+        with self._lock:
+            tickets = [t for t in self.waiting if t.user_id == user_id]
+        for ticket in tickets:
+            self._abandon(ticket, CANCELLED)
+
+    def idle(self, user_id):
+        """End the user's run; the slot stays with their Chrome until it is closed.
+
+        Also claims a slot for a Chrome that has none (reattached after a
+        restart), even over the limit: it is running either way.
+        """
+        with self._lock:
+            now = time.monotonic()
+            held = self.holders.get(user_id)
+            if held is not None:
+                self._settle(user_id, held, now)
+            self.holders[user_id] = (IDLE, now)
+            # A queued run may take this Chrome's slot right away
+            granted = self._grant_locked()
+        for ticket in granted:
+            ticket._finish(GRANTED)
+
+    def release(self, user_id):
+        """Free the user's slot (their Chrome is gone) and hand it to the next run in the queue."""
+        with self._lock:
+            held = self.holders.pop(user_id, None)
+            if held is None:
+                return
+            self._settle(user_id, held, time.monotonic())
+            granted = self._grant_locked()
+        for ticket in granted:
+            ticket._finish(GRANTED)
+
+def format_eta(seconds):
+    if seconds < 90:
+        return f"{max(int(seconds), 1)} seconds"
+    return f"{round(seconds / 60)} minutes"
+
+controller = AdmissionController(derive_slots() if BROWSER_SLOTS == 'auto' else int(BROWSER_SLOTS))
+
+metrics.Gauge('dsts_browser_slots', 'Configured browser slots', lambda: controller.slots)
+metrics.Gauge('dsts_browser_slots_in_use', 'Browser slots held by runs and idle Chromes',
+              lambda: len(controller.holders))
+metrics.Gauge('dsts_browser_slot_utilisation', 'Share of browser slots in use',
+              lambda: len(controller.holders) / controller.slots)
+metrics.Gauge('dsts_admission_queue_length', 'Runs waiting for a browser slot',
+              lambda: len(controller.waiting))
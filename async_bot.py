@@ -0,0 +1,416 @@
+"""Asyncio runtime for the bot: python async_bot.py
+
+Serves the same commands as bot.py (/start, /login, /operations, /settings,
+/logout, /logs, /history, /import, /export) on AsyncTeleBot. Commands and
+menus are the blocking handlers.py functions, run with asyncio.to_thread
+and a SyncBot. This module keeps the login and operations runs, where
+Telegram calls, OCR requests and waits for a user's reply (CAPTCHA text,
+form value) are coroutines, so a user sitting on a prompt holds no thread.
+WebDriver steps still block: each Chrome runs one command at a time, so
+they go to a pool with a thread per browser slot (MAX_BROWSER_SESSIONS).
+Runs here are not tagged by tracing.run or profiling, which follow the
+calling thread; recorded_run writes their history documents instead,
+without per-stage durations.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+import admission
+import ds
+import handlers
+import health
+import history
+import locators
+import metrics
+import resilience
+import warmup
+from session_manager_headless import session_manager, MAX_BROWSER_SESSIONS
+from logger import bot_logger, login_logger
+from webserver import keep_alive
+
+API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+bot = AsyncTeleBot(API_TOKEN)
+
+# Alternate Bot API endpoint, e.g. a local stand-in: http://host:port/bot{0}/{1}
+if os.getenv('TELEGRAM_API_URL'):
+    asyncio_helper.API_URL = os.getenv('TELEGRAM_API_URL')
+
+POLL_STALE_SECONDS = int(os.getenv('POLL_STALE_SECONDS', '120'))  # Max gap between getUpdates calls
+INPUT_TIMEOUT = 60  # Seconds to wait for a reply to a prompt, as ds.bot_input
+
+# WebDriver calls block; one thread per browser slot
+browser_pool = ThreadPoolExecutor(MAX_BROWSER_SESSIONS, thread_name_prefix='browser')
+
+loop = None  # Event loop, set by main()
+http = None  # aiohttp session for OCR requests, set by main()
+waiting = {}  # user_id -> Future resolved with the user's next message
+run_notes = contextvars.ContextVar('run_notes', default=None)  # Fields for the current run's history
+
+last_poll_at = time.time()
+last_update_at = None
+
+# Count and time every Bot API call made through AsyncTeleBot
+_process_request = asyncio_helper._process_request
+
+async def _instrumented_process_request(token, url, *args, **kwargs):
+    global last_poll_at, last_update_at
+    metrics.telegram_calls.labels(url).inc()
+    start = time.perf_counter()
+    try:
+        result = await _process_request(token, url, *args, **kwargs)
+        if url == 'getUpdates':
+            last_poll_at = time.time()
+            if result:
+                last_update_at = last_poll_at
+        return result
+    except Exception:
+        metrics.telegram_errors.labels(url).inc()
+        raise
+    finally:
+        metrics.telegram_latency.labels(url).observe(time.perf_counter() - start)
+
+asyncio_helper._process_request = _instrumented_process_request
+
+def _telegram_probe():
+    since_poll = time.time() - last_poll_at
+    details = {'seconds_since_poll': round(since_poll, 1),
+               'seconds_since_update': round(time.time() - last_update_at, 1) if last_update_at else None}
+    return since_poll < POLL_STALE_SECONDS, details
+
+def _browser_queue_probe():
+    depth = browser_pool._work_queue.qsize()
+    return depth < MAX_BROWSER_SESSIONS, {'queue_depth': depth, 'max': MAX_BROWSER_SESSIONS}
+
+health.register_probe('telegram', _telegram_probe, liveness=True)
+health.register_probe('workers', _browser_queue_probe)
+
+metrics.Gauge('dsts_waiting_users', 'Users the bot is waiting on for a reply', lambda: len(waiting))
+
+class SyncBot:
+    """Blocking view of the async bot for ds code running on browser threads."""
+
+    def __getattr__(self, name):
+        method = getattr(bot, name)
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(method(*args, **kwargs), loop).result()
+        return call
+
+sync_bot = SyncBot()
+
+async def browser(func, *args, **kwargs):
+    """Run a blocking WebDriver step on the browser pool."""
+    return await loop.run_in_executor(browser_pool, functools.partial(func, *args, **kwargs))
+
+def annotate(**fields):
+    """tracing.annotate for the run recorded by recorded_run in this task."""
+    notes = run_notes.get()
+    if notes is not None:
+        notes.update(fields)
+
+@contextlib.asynccontextmanager
+async def recorded_run(kind, user_id):
+    """Write the run to history.py when it ends, as tracing.run does in bot.py."""
+    notes = {}
+    token = run_notes.set(notes)
+    started_at = time.time()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        run_notes.reset(token)
+        history.record(history.document(kind, user_id, started_at, time.time(), ok, **notes))
+
+def login_outcome(outcome):
+    metrics.login_outcomes.labels(outcome).inc()
+    annotate(outcome=outcome)
+
+async def status(message, user_id):
+    """ds.bot_log for coroutines: replace the user's status message."""
+    await clear_status(user_id)
+    try:
+        sent_message = await bot.send_message(user_id, str(message))
+        ds.last_message_id[user_id] = sent_message.message_id
+        bot_logger.debug("Message sent to user %s: %s", user_id, message, extra={'user_id': user_id})
+    except Exception as e:
+        bot_logger.error("Failed to send message to bot: %s", e)
+
+async def clear_status(user_id):
+    message_id = ds.last_message_id.pop(user_id, None)
+    if message_id is not None:
+        try:
+            await bot.delete_message(user_id, message_id)
+        except Exception:
+            pass  # Ignore if message already deleted
+
+async def ask(user_id, prompt, timeout=INPUT_TIMEOUT):
+    """Send a prompt and wait for the user's next message; None on timeout."""
+    await bot.send_message(user_id, prompt)
+    future = waiting[user_id] = loop.create_future()
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        await status("⚠️ Input timeout. Please try again.", user_id)
+        return None
+    finally:
+        if waiting.get(user_id) is future:
+            del waiting[user_id]
+
+# --------------------------
+# LOGIN AND OPERATIONS
+# --------------------------
+async def solve_captcha(driver, user_id):
+    """ds.process_captcha with the OCR request on aiohttp"""
+    try:
+        captcha_url = await browser(lambda: locators.find(driver, 'captcha_img').get_attribute("src"))
+        headers = {k: v for k, v in ds.RAPIDAPI_HEADERS.items() if v is not None}
+        try:
+            with metrics.ocr_latency.time():
+                async with http.get(ds.RAPIDAPI_OCR_URL, headers=headers,
+                                    params={"url": captcha_url}) as response:
+                    status_code = response.status
+                    data = await response.json(content_type=None) if status_code == 200 else None
+        except Exception as api_error:
+            metrics.ocr_results.labels('exception').inc()
+            await status(f"❌ OCR API request failed: {str(api_error)}", user_id)
+            return None
+        if status_code != 200:
+            metrics.ocr_results.labels('http_error').inc()
+            await status(f"❌ OCR API error: {status_code}", user_id)
+            return None
+
+        captcha_text = data.get("text", "").replace(" ", "").strip()
+        await status(f"🔍 Recognized Captcha: {captcha_text}", user_id)
+        if not captcha_text:
+            metrics.ocr_results.labels('empty').inc()
+            await status("❌ No text recognized from CAPTCHA", user_id)
+            return None
+        metrics.ocr_results.labels('recognized').inc()
+        await browser(ds.fill_captcha, driver, captcha_text)
+        return captcha_text
+    except Exception as e:
+        await status(f"❌ Captcha processing failed: {str(e)}", user_id)
+        return None
+
+async def automatic_login(driver, username, password, user_id, prepared):
+    """ds.automatic_login, waiting on the browser pool and OCR without a thread"""
+    await status("\n📝 Starting automatic login process...", user_id)
+
+    for attempt in range(ds.AUTO_LOGIN_ATTEMPTS):
+        await status(f"🔄 Automatic login attempt {attempt + 1}/{ds.AUTO_LOGIN_ATTEMPTS}", user_id)
+        metrics.login_attempts.labels('auto').inc()
+
+        if attempt == 0 and prepared and prepared.captcha_text:
+            if not await browser(ds.enter_credentials, driver, username, password, user_id):
+                return False
+            captcha_text = prepared.captcha_text
+            annotate(captcha='prepared')
+        else:
+            first_load = attempt == 0 and not prepared
+            if not await browser(ds.prepare_login_form, driver, username, password, user_id,
+                                 reload=first_load):
+                return False
+            captcha_text = await solve_captcha(driver, user_id)
+            if not captcha_text:
+                continue
+            annotate(captcha='ocr')
+
+        result = await browser(ds.finish_login, driver, user_id, "AUTOMATIC")
+        if result is not None:
+            return result
+
+    metrics.manual_captcha_fallbacks.inc()
+    await status("🔄 Switching to manual CAPTCHA entry", user_id)
+    return await manual_login(driver, username, password, user_id)
+
+async def manual_login(driver, username, password, user_id):
+    """ds.manual_login; the wait for the user's CAPTCHA text holds no thread"""
+    await status("\n📝 Starting manual login process...", user_id)
+    metrics.login_attempts.labels('manual').inc()
+    annotate(captcha='manual')
+
+    if not await browser(ds.prepare_login_form, driver, username, password, user_id):
+        return False
+
+    manual_captcha = resilience.policy('manual_captcha')
+    captcha_text = None
+    for attempt in range(manual_captcha.attempts):
+        if attempt:
+            await asyncio.sleep(manual_captcha.backoff(attempt - 1))
+        if not await browser(ds.send_manual_captcha, driver, user_id):
+            continue
+        captcha_text = await ask(user_id, "Type the captcha text:")
+        if captcha_text:
+            try:
+                await browser(ds.fill_captcha, driver, captcha_text)
+                break
+            except Exception as e:
+                await status(f"❌ Error in bot communication: {str(e)}", user_id)
+                captcha_text = None
+
+    if not captcha_text:
+        await status("❌ Failed to get captcha response from user", user_id)
+        return False
+
+    return bool(await browser(ds.finish_login, driver, user_id, "MANUAL"))
+
+async def login_attempt(user_id, username, password, prepared=None):
+    """ds.handle_login_attempt for the asyncio runtime"""
+    login_logger.info("Starting login attempt for user %s", user_id, extra={'user_id': user_id})
+    annotate(site_username=username)
+    await clear_status(user_id)
+
+    try:
+        session = await browser(session_manager.get_session, user_id)
+        driver = session['driver']
+    except Exception as e:
+        login_logger.error("Failed to get session/driver: %s", e)
+        login_outcome('browser_error')
+        await status("❌ Login failed: Could not initialize browser session", user_id)
+        return False
+
+    if not username or not password:
+        login_logger.warning("Invalid credentials for user %s", user_id, extra={'user_id': user_id})
+        login_outcome('invalid_input')
+        await status("❌ Login failed: Invalid credentials", user_id)
+        return False
+
+    await status("ATTEMPTING LOGIN".center(40), user_id)
+    try:
+        success = await automatic_login(driver, username, password, user_id, prepared)
+    except resilience.CircuitOpenError as e:
+        login_outcome('site_down')
+        await status(f"⏸️ {e}", user_id)
+        return False
+    if success:
+        landing_url = await browser(lambda: driver.current_url)
+        session_manager.update_session(user_id, username=username, landing_url=landing_url)
+    login_outcome('success' if success else 'failure')
+    login_logger.info("Login attempt result for user %s: %s", user_id, 'success' if success else 'failed', extra={'user_id': user_id})
+    return success
+
+async def post_login_operations(user_id):
+    """ds.post_login_operations; the wait for the form value holds no thread"""
+    annotate(site_username=session_manager.sessions.get(user_id, {}).get('username'))
+    form = await browser(ds.open_form, user_id)
+    if isinstance(form, bool):
+        result = form
+    else:
+        input_value = await asyncio.to_thread(ds.saved_form_value, user_id, form[3])
+        if input_value is None:
+            await status("📝 Please enter the value:", user_id)
+            input_value = await ask(user_id, "Enter value:")
+        result = await browser(ds.save_form_value, form, input_value, user_id)
+    annotate(outcome='success' if result else 'failure')
+    return result
+
+# --------------------------
+# HANDLERS
+# --------------------------
+def threaded(handler):
+    """Run a blocking handlers.py handler off the event loop, with the SyncBot."""
+    async def run(update):
+        await asyncio.to_thread(handler, update, sync_bot)
+    return run
+
+for command, handler in (('start', handlers.start), ('login', handlers.login),
+                         ('settings', handlers.settings), ('logout', handlers.logout),
+                         ('logs', handlers.logs), ('history', handlers.run_history),
+                         ('import', handlers.import_command), ('export', handlers.export_command)):
+    bot.register_message_handler(threaded(handler), commands=[command])
+bot.register_message_handler(threaded(handlers.import_document), content_types=['document'])
+
+async def admit(user_id, kind):
+    """Wait for a browser slot, keeping the user posted on their place in the queue."""
+    async def on_wait(position, eta):
+        await status(handlers.queue_position_text(position, eta), user_id)
+
+    result = await admission.controller.acquire_async(user_id, kind, on_wait)
+    if result == admission.GRANTED:
+        return True
+    # A cancelled wait was ended by /cancel or /logout, which answer the user themselves
+    if result == admission.TIMED_OUT:
+        await status(handlers.NOT_ADMITTED_TEXT, user_id)
+    return False
+
+@bot.message_handler(commands=['operations'])
+async def handle_operations(message):
+    if not await asyncio.to_thread(handlers.begin_operations, message, sync_bot):
+        return
+    user_id = message.chat.id
+    try:
+        if await admit(user_id, 'operations'):
+            async with recorded_run('operations', user_id):
+                await post_login_operations(user_id)
+    except Exception as e:
+        await asyncio.to_thread(handlers.operations_failed, sync_bot, user_id, e)
+    finally:
+        session_manager.finish_run(user_id)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("login:"))
+async def login_with(call):
+    """Log in with the tapped username, on a browser slot."""
+    credentials = await asyncio.to_thread(handlers.begin_login, call, sync_bot)
+    if credentials is None:
+        return
+    user_id = call.message.chat.id
+    username = credentials["username"]
+    if not await admit(user_id, 'login'):
+        session_manager.set_user_busy(user_id, False)
+        await asyncio.to_thread(warmup.cancel, user_id)
+        return
+    prepared = await asyncio.to_thread(warmup.claim, user_id)
+
+    try:
+        async with recorded_run('login', user_id):
+            success = await login_attempt(user_id, username, credentials["password"], prepared)
+        await browser(handlers.login_finished, sync_bot, user_id, username, success)
+    except Exception as e:
+        await browser(handlers.login_failed, sync_bot, user_id, e)
+    finally:
+        session_manager.finish_run(user_id)
+
+# Every other button
+bot.register_callback_query_handler(threaded(handlers.menu_callback), func=lambda call: True)
+
+def _resolve(future, text):
+    if not future.done():
+        future.set_result(text)
+
+def answer_prompt(user_id, text):
+    """Hand text to the prompt ask() waits on; False if none is. Called off the loop."""
+    future = waiting.get(user_id)
+    if future is None or future.done():
+        return False
+    loop.call_soon_threadsafe(_resolve, future, text)
+    return True
+
+@bot.message_handler(func=lambda message: True)
+async def handle_user_input(message):
+    await asyncio.to_thread(handlers.user_input, message, sync_bot, answer_prompt)
+
+async def main():
+    global loop, http
+    loop = asyncio.get_running_loop()
+    http = aiohttp.ClientSession()
+    try:
+        await bot.infinity_polling()
+    finally:
+        await http.close()
+        await bot.close_session()
+        browser_pool.shutdown(wait=False)
+
+if __name__ == '__main__':
+    keep_alive()
+    bot_logger.info('Starting bot (asyncio runtime)...')
+    asyncio.run(main())
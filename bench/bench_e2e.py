@@ -0,0 +1,156 @@
+"""End-to-end login + operations benchmark against the local stand-ins.
+
+Starts the fixture site and stub OCR, points ds at them and runs
+session start, ds.handle_login_attempt and ds.post_login_operations for
+N concurrent users. Reports per-stage and end-to-end latency, throughput
+and memory. Needs Chrome and chromedriver, like the bot itself, and
+MONGO_URI for the form snapshots (a local mongod is fine).
+
+    python bench/bench_e2e.py [levels] [ocr_fail_rate]
+    python bench/bench_e2e.py 1,5,20,50 0.1
+"""
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fixture_site
+import stub_ocr
+
+class FakeBot:
+    """Records the Telegram calls ds makes for each simulated chat."""
+
+    def __init__(self):
+        self.calls = 0
+        self.last_text = {}
+        self.lock = threading.Lock()
+        self._next_id = 0
+
+    def _message(self, chat_id, text=None):
+        with self.lock:
+            self.calls += 1
+            self._next_id += 1
+            if text is not None:
+                self.last_text[chat_id] = text
+            return SimpleNamespace(message_id=self._next_id)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._message(chat_id, text)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        return self._message(chat_id)
+
+    def delete_message(self, chat_id, message_id):
+        with self.lock:
+            self.calls += 1
+
+def answer_prompts(ds, session_manager, fake_bot, stop):
+    """Play the user: answer CAPTCHA prompts correctly and value prompts with 42."""
+    while not stop.is_set():
+        for user_id, value in list(ds.user_inputs.items()):
+            if value is not None:
+                continue
+            prompt = fake_bot.last_text.get(user_id, '')
+            if 'captcha' in prompt.lower():
+                try:
+                    driver = session_manager.sessions[user_id]['driver']
+                    src = ds.locators.find(driver, 'captcha_img').get_attribute('src')
+                    ds.user_inputs[user_id] = parse_qs(urlparse(src).query)['code'][0]
+                except Exception:
+                    pass
+            elif 'value' in prompt.lower():
+                ds.user_inputs[user_id] = '42'
+        time.sleep(0.1)
+
+def rss_bytes(pid='self'):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def run_level(users, ds, session_manager, tracing, metrics, fake_bot):
+    tracing.recent_spans.clear()
+    results = {}
+    peak = {'chrome': 0, 'python': 0}
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak['chrome'] = max(peak['chrome'], metrics.chrome_rss_bytes())
+            peak['python'] = max(peak['python'], rss_bytes())
+            time.sleep(0.5)
+
+    def user_flow(user_id):
+        ds.set_bot_instance(fake_bot, user_id)
+        try:
+            with tracing.run('bench', user_id):
+                with tracing.span('session_start'):
+                    session_manager.get_session(user_id)
+                ok = ds.handle_login_attempt(user_id, f"user{user_id}", 'secret')
+                ok = ok and ds.post_login_operations(user_id)
+            results[user_id] = ok
+        except Exception as e:
+            results[user_id] = False
+            print(f"user {user_id} failed: {e}")
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    calls_before = fake_bot.calls
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user_flow, args=(100000 + i,)) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    for user_id in list(session_manager.sessions):
+        session_manager.close_session(user_id)
+
+    ok = sum(1 for value in results.values() if value)
+    print(f"\n=== {users} concurrent users ===")
+    print(f"succeeded {ok}/{users}, wall {wall:.1f}s, throughput {ok / wall * 60:.1f} runs/min")
+    print(f"telegram calls per run {(fake_bot.calls - calls_before) / users:.1f}")
+    print(f"peak chrome RSS {peak['chrome'] / 2**20:.0f} MB, peak python RSS {peak['python'] / 2**20:.0f} MB")
+    print(tracing.format_percentiles(3600))
+
+def main():
+    levels = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '1,5,20,50').split(',')]
+    fail_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+
+    site, _ = fixture_site.start()
+    ocr, ocr_state = stub_ocr.start(fail_rate=fail_rate)
+    os.environ['URL'] = f"http://127.0.0.1:{site.server_address[1]}/"
+    os.environ['RAPIDAPI_OCR_URL'] = f"http://127.0.0.1:{ocr.server_address[1]}/ocr"
+    os.environ.setdefault('RAPIDAPI_KEY', 'bench')
+    os.environ.setdefault('BOT_OWNER_ID', '0')
+    os.chdir(os.environ.get('BENCH_WORKDIR', '/tmp'))
+
+    import ds
+    import metrics
+    import tracing
+    from session_manager_headless import session_manager
+
+    fake_bot = FakeBot()
+    stop = threading.Event()
+    threading.Thread(target=answer_prompts, args=(ds, session_manager, fake_bot, stop),
+                     daemon=True).start()
+    try:
+        for users in levels:
+            run_level(users, ds, session_manager, tracing, metrics, fake_bot)
+    finally:
+        stop.set()
+        session_manager.close_all_sessions()
+    print(f"\nOCR stub calls: {ocr_state.calls}")
+
+if __name__ == '__main__':
+    main()
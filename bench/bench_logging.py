@@ -0,0 +1,69 @@
+"""Per-call cost of logging on the request threads.
+
+Compares the old synchronous setup (RotatingFileHandler + console handler
+attached directly to the logger) with the queue-based pipeline in logger.py.
+
+    python bench/bench_logging.py [calls]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('BOT_OWNER_ID', '0')
+
+def sync_logger(log_path):
+    """Rebuild the pre-queue logger configuration."""
+    file_handler = RotatingFileHandler(log_path, maxBytes=1024 * 1024, backupCount=1, encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler = logging.StreamHandler(open(os.devnull, 'w'))
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    log = logging.getLogger('bench_sync')
+    log.setLevel(logging.DEBUG)
+    log.addHandler(file_handler)
+    log.addHandler(console_handler)
+    log.propagate = False
+    return log
+
+def measure(label, fn, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / calls * 1e6:8.2f} us/call")
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    workdir = tempfile.mkdtemp(prefix='bench_logging_')
+    os.chdir(workdir)
+
+    log = sync_logger(os.path.join(workdir, 'sync.txt'))
+    print(f"{calls} calls per case, logs in {workdir}")
+    measure("before: sync f-string debug",
+            lambda i: log.debug(f"Message sent to user {i}: status {i}"), calls)
+    measure("before: sync f-string info",
+            lambda i: log.info(f"User {i} sent /login: /login"), calls)
+
+    import logger
+    logger.console_handler.setStream(open(os.devnull, 'w'))
+    measure("after: queued lazy debug",
+            lambda i: logger.bot_logger.debug("Message sent to user %s: status %s", i, i), calls)
+    measure("after: queued lazy info (console+file)",
+            lambda i: logger.user_interaction_logger.info("User %s sent /login: %s", i, '/login'), calls)
+    measure("after: filtered lazy debug (INFO logger)",
+            lambda i: logger.user_interaction_logger.debug("User %s input: %s", i, 'x'), calls)
+
+    drain_start = time.perf_counter()
+    logger.log_listener.stop()
+    print(f"writer drain after run: {(time.perf_counter() - drain_start) * 1e3:.1f} ms")
+    print(f"pipeline stats: {logger.get_log_stats()}")
+
+if __name__ == '__main__':
+    main()
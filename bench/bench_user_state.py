@@ -0,0 +1,72 @@
+"""Memory and access cost of per-user state for 100k synthetic users.
+
+Compares the old layout (one module-level dict per field, never pruned)
+with user_state.UserStore, unbounded and with its default size bound.
+
+    python bench/bench_user_state.py [users]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_OWNER_ID', '0')
+os.chdir(tempfile.mkdtemp(prefix='bench_user_state_'))
+
+import user_state
+
+BOT = object()
+
+def legacy(users):
+    fields = {name: {} for name in ('bot_instances', 'chat_ids', 'user_inputs', 'last_message_id',
+                                    'status_logs', 'user_states', 'login_queue')}
+    for user_id in users:
+        fields['bot_instances'][user_id] = BOT
+        fields['chat_ids'][user_id] = user_id
+        fields['last_message_id'][user_id] = user_id + 1
+        fields['login_queue'][user_id] = time.time()
+        if user_id % 10 == 0:
+            fields['user_states'][user_id] = {'state': 'waiting_username'}
+    return fields
+
+def store(users, max_size):
+    user_store = user_state.UserStore(ttl=3600, max_size=max_size)
+    bot_instances = user_store.field('bot')
+    chat_ids = user_store.field('chat_id')
+    last_message_id = user_store.field('last_message_id')
+    login_queue = user_store.field('last_login_attempt')
+    user_states = user_store.field('state')
+    for user_id in users:
+        bot_instances[user_id] = BOT
+        chat_ids[user_id] = user_id
+        last_message_id[user_id] = user_id + 1
+        login_queue[user_id] = time.time()
+        if user_id % 10 == 0:
+            user_states[user_id] = {'state': 'waiting_username'}
+    return user_store
+
+def measure(label, build, users):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(users)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    kept = len(result) if isinstance(result, user_state.UserStore) else len(result['chat_ids'])
+    print(f"{label:<34} {current / 2**20:8.1f} MB  {kept:>8} users kept  "
+          f"{elapsed / len(users) * 1e6:6.2f} us/user")
+    return result
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    users = range(10**9, 10**9 + count)
+    print(f"{count} synthetic users")
+    measure("legacy dicts (unbounded)", legacy, users)
+    measure("UserStore, no size bound", lambda u: store(u, max_size=count * 2), users)
+    measure(f"UserStore, max_size={user_state.USER_STATE_MAX}",
+            lambda u: store(u, max_size=user_state.USER_STATE_MAX), users)
+
+if __name__ == '__main__':
+    main()
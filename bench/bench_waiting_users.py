@@ -0,0 +1,152 @@
+"""How many users can one process keep waiting on a prompt: threaded vs asyncio.
+
+A waiting user is one the bot has sent a prompt (manual CAPTCHA, form value)
+and is waiting on for a reply. The threaded runtime waits in ds.bot_input:
+a thread per user, polling every 0.5s. bot.py runs handlers on telebot's
+worker pool, so it keeps at most that many users waiting at once. The
+asyncio runtime waits in async_bot.ask on a future. Both send their prompts
+to bench/fake_telegram.py.
+
+Each mode runs in its own process for every user count. The run parks N
+users, holds them for a few seconds, then answers them all. It reports
+whether all N got a prompt, the process's threads and RSS, the CPU burned
+while they wait, and the time until every reply is taken.
+
+    python bench/bench_waiting_users.py [counts] [hold_seconds]
+    python bench/bench_waiting_users.py 100,1000,5000,10000 5
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+PROMPT = "Type the captcha text:"
+PROMPT_TIMEOUT = 120
+
+def rss_bytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def prompts_sent(api, chats, timeout):
+    """Wait until every chat got the prompt; returns how many did."""
+    deadline = time.time() + timeout
+    got = 0
+    for chat_id in chats:
+        found = api.wait_for(chat_id, 0, lambda m, p: p.get('text') == PROMPT,
+                             max(deadline - time.time(), 0))
+        got += found is not None
+    return got
+
+def run_threaded(count, hold):
+    import telebot
+    import ds
+    bot = telebot.TeleBot(os.environ['TELEGRAM_BOT_TOKEN'])
+    workers = bot.worker_pool.num_threads if getattr(bot, 'worker_pool', None) else None
+    chats = [700000 + i for i in range(count)]
+    baseline = rss_bytes()
+    threads, failed_start = [], None
+    for chat_id in chats:
+        ds.set_bot_instance(bot, chat_id)
+        thread = threading.Thread(target=ds.bot_input, args=(PROMPT, chat_id), daemon=True)
+        try:
+            thread.start()
+        except RuntimeError as e:
+            failed_start = str(e)
+            break
+        threads.append(thread)
+    parked = prompts_sent(api, chats[:len(threads)], PROMPT_TIMEOUT)
+
+    cpu, peak_threads, rss = hold_and_measure(hold)
+    start = time.perf_counter()
+    for chat_id in chats[:len(threads)]:
+        ds.user_inputs[chat_id] = 'abc123'
+    for thread in threads:
+        thread.join()
+    answered = time.perf_counter() - start
+    return {'parked': parked, 'threads': peak_threads, 'rss': rss - baseline, 'cpu': cpu,
+            'answered_s': answered, 'error': failed_start, 'telebot_workers': workers}
+
+def run_async(count, hold):
+    import aiohttp
+    import async_bot
+
+    async def main():
+        async_bot.loop = asyncio.get_running_loop()
+        async_bot.http = aiohttp.ClientSession()
+        chats = [700000 + i for i in range(count)]
+        baseline = rss_bytes()
+        tasks = [asyncio.create_task(async_bot.ask(chat_id, PROMPT)) for chat_id in chats]
+        parked = await asyncio.to_thread(prompts_sent, api, chats, PROMPT_TIMEOUT)
+        cpu, peak_threads, rss = await asyncio.to_thread(hold_and_measure, hold)
+        start = time.perf_counter()
+        for chat_id in chats:
+            future = async_bot.waiting.get(chat_id)
+            if future is not None and not future.done():
+                future.set_result('abc123')
+        await asyncio.gather(*tasks)
+        answered = time.perf_counter() - start
+        await async_bot.http.close()
+        await async_bot.bot.close_session()
+        return {'parked': parked, 'threads': peak_threads, 'rss': rss - baseline, 'cpu': cpu,
+                'answered_s': answered, 'error': None}
+
+    return asyncio.run(main())
+
+def hold_and_measure(hold):
+    """CPU seconds used by the process while users wait for `hold` seconds."""
+    cpu_start = time.process_time()
+    time.sleep(hold)
+    return time.process_time() - cpu_start, threading.active_count(), rss_bytes()
+
+def child(mode, count, hold):
+    global api
+    import fake_telegram
+    server, api = fake_telegram.start()
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:bench')
+    os.environ.setdefault('BOT_OWNER_ID', '0')
+    os.environ['TELEGRAM_API_URL'] = f"http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}"
+    from telebot import apihelper
+    apihelper.API_URL = os.environ['TELEGRAM_API_URL']
+    result = run_threaded(count, hold) if mode == 'threaded' else run_async(count, hold)
+    print(json.dumps(result))
+
+def main():
+    counts = [int(c) for c in (sys.argv[1] if len(sys.argv) > 1 else '100,1000,5000').split(',')]
+    hold = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    workdir = os.environ.get('BENCH_WORKDIR', '/tmp')
+    print(f"{'mode':<10}{'users':>7}{'parked':>8}{'threads':>9}{'RSS/user':>10}"
+          f"{'CPU/s held':>12}{'answer all':>12}")
+    workers = None
+    for count in counts:
+        for mode in ('threaded', 'async'):
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, str(count), str(hold)],
+                                  capture_output=True, text=True, cwd=workdir)
+            lines = proc.stdout.strip().splitlines()
+            if proc.returncode or not lines:
+                print(f"{mode:<10}{count:>7}  failed: {(proc.stderr.strip().splitlines() or ['?'])[-1]}")
+                continue
+            r = json.loads(lines[-1])
+            workers = r.get('telebot_workers') or workers
+            print(f"{mode:<10}{count:>7}{r['parked']:>8}{r['threads']:>9}"
+                  f"{r['rss'] / max(r['parked'], 1) / 1024:>8.0f}KB"
+                  f"{r['cpu'] / hold:>12.3f}{r['answered_s'] * 1000:>10.0f}ms"
+                  + (f"  ({r['error']})" if r['error'] else ''))
+    if workers:
+        print(f"\nbot.py runs handlers on {workers} telebot worker threads: that is how many users "
+              f"the threaded runtime keeps waiting at once; the rest queue behind them.")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        main()
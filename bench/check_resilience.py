@@ -0,0 +1,149 @@
+"""Exercise resilience.RetryPolicy and CircuitBreaker against a flaky fixture site.
+
+No Chrome needed: page loads are plain HTTP GETs against
+bench/fixture_site.py with a share of requests answered 503. Checks that
+retries lift the success rate, that the breaker opens while the site is
+down and rejects runs without touching it, and that it closes again after
+the cooldown once the site is back. With MONGO_URI set (and Chrome, like
+bench_e2e.py), also runs ds.load_page against the 503 mode, where
+driver.get itself succeeds on the error page.
+
+    python bench/check_resilience.py [fail_rate] [calls]
+"""
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+os.environ.setdefault('BOT_OWNER_ID', '0')
+os.chdir(tempfile.mkdtemp(prefix='check_resilience_'))
+
+import fixture_site
+import resilience
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read()
+
+def success_rate(policy, url, calls):
+    ok = 0
+    for _ in range(calls):
+        try:
+            policy.call(get, url)
+            ok += 1
+        except OSError:
+            pass
+    return ok / calls
+
+def check_load_page(url, state, check):
+    """ds.load_page must count a 503 page as a site failure, not a success."""
+    import ds
+    from session_manager_headless import session_manager
+
+    breaker = resilience.CircuitBreaker('check_page', failures=3, cooldown=60)
+    resilience.POLICIES['page_load'] = resilience.RetryPolicy(
+        'check_page_load', attempts=3, base_delay=0.01, max_delay=0.05, attempt_timeout=10,
+        breaker=breaker)
+    user_id = 1
+    try:
+        driver = session_manager.get_session(user_id)['driver']
+        state.down = True
+        try:
+            ds.load_page(driver, url)
+            outcome = "loaded"
+        except resilience.PageNotLoadedError:
+            outcome = "not loaded"
+        check("load_page on 503", outcome == "not loaded" and breaker.state == breaker.OPEN,
+              f"{outcome}, breaker {breaker.state} after 3 attempts")
+
+        state.down = False
+        resilience.POLICIES['page_load'].breaker = breaker = resilience.CircuitBreaker('check_page')
+        try:
+            ds.load_page(driver, url)
+            outcome = "loaded"
+        except resilience.PageNotLoadedError:
+            outcome = "not loaded"
+        check("load_page when up", outcome == "loaded" and breaker.state == breaker.CLOSED,
+              f"{outcome}, breaker {breaker.state}")
+    finally:
+        session_manager.close_session(user_id)
+
+def main():
+    fail_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 0.3
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    server, state = fixture_site.start(fail_rate=fail_rate)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    failed = []
+
+    def check(label, condition, detail):
+        print(f"{'ok  ' if condition else 'FAIL'} {label}: {detail}")
+        if not condition:
+            failed.append(label)
+
+    # Retries against random failures
+    single = resilience.RetryPolicy('check_single', attempts=1)
+    retried = resilience.RetryPolicy('check_retried', attempts=3, base_delay=0.01, max_delay=0.05)
+    without = success_rate(single, url, calls)
+    with_retries = success_rate(retried, url, calls)
+    expected = 1 - fail_rate ** 3
+    check("retries", with_retries > without and with_retries >= expected - 0.05,
+          f"{without:.0%} success with 1 attempt, {with_retries:.0%} with 3 (expected ~{expected:.0%})")
+
+    # Deadline bounds the time spent on one operation
+    state.down = True
+    slow = resilience.RetryPolicy('check_deadline', attempts=50, base_delay=0.2, max_delay=0.2, deadline=1.0)
+    start = time.monotonic()
+    try:
+        slow.call(get, url)
+    except OSError:
+        pass
+    elapsed = time.monotonic() - start
+    check("deadline", elapsed < 1.5, f"gave up after {elapsed:.2f}s with a 1s deadline")
+
+    # Breaker opens while the site is down and stops traffic to it
+    breaker = resilience.CircuitBreaker('check', failures=5, cooldown=1.0)
+    guarded = resilience.RetryPolicy('check_guarded', attempts=2, base_delay=0.01, max_delay=0.01,
+                                     breaker=breaker)
+    before = state.failures
+    rejected = 0
+    start = time.monotonic()
+    for _ in range(50):
+        try:
+            guarded.call(get, url)
+        except resilience.CircuitOpenError:
+            rejected += 1
+        except OSError:
+            pass
+    elapsed = time.monotonic() - start
+    hits = state.failures - before
+    check("breaker opens", breaker.state == breaker.OPEN and hits <= 6,
+          f"{hits} requests reached the site, {rejected}/50 runs rejected in {elapsed:.2f}s")
+
+    # Site back: after the cooldown one trial closes the breaker again
+    state.down = False
+    state.fail_rate = 0.0
+    try:
+        guarded.call(get, url)
+        early = "accepted"
+    except resilience.CircuitOpenError as e:
+        early = f"rejected ({e})"
+    time.sleep(1.1)
+    guarded.call(get, url)
+    check("breaker recovers", breaker.state == breaker.CLOSED,
+          f"during cooldown: {early}; after cooldown: {breaker.state}")
+
+    # ds.load_page on the real driver; ds needs MongoDB at import
+    if os.getenv('MONGO_URI'):
+        check_load_page(url, state, check)
+    else:
+        print("skip load_page: set MONGO_URI (and have Chrome) to run it")
+
+    print("FAILED: " + ", ".join(failed) if failed else "OK")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
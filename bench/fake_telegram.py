@@ -0,0 +1,204 @@
+"""Local stand-in for the Telegram Bot API.
+
+Serves getUpdates (long polling) from an injectable update queue and
+records every outbound call (sendMessage, deleteMessage, sendPhoto,
+editMessageText, ...). Point telebot at it with
+
+    apihelper.API_URL = f"http://127.0.0.1:{port}/bot{{0}}/{{1}}"
+
+Manual CAPTCHA photos from the fixture site carry their code in a PNG tEXt
+chunk, which is exposed per chat so scripted users can reply correctly.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import fixture_site
+
+# Outbound calls that count as the bot answering the user
+REPLY_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup'}
+
+class ChatLog:
+    __slots__ = ('calls', 'cond', 'last_markup_message', 'captcha_code')
+
+    def __init__(self):
+        self.calls = []  # (time, method, params)
+        self.cond = threading.Condition()
+        self.last_markup_message = None
+        self.captcha_code = None
+
+class FakeTelegram:
+    def __init__(self):
+        self.updates = []
+        self.updates_cond = threading.Condition()
+        self.chats = defaultdict(ChatLog)
+        self.method_counts = defaultdict(int)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._callback_chats = {}  # callback query id -> chat id, for answerCallbackQuery
+        self._lock = threading.Lock()
+
+    # ---- injection -------------------------------------------------------
+    def _push(self, update):
+        with self.updates_cond:
+            update['update_id'] = next(self._update_ids)
+            self.updates.append(update)
+            self.updates_cond.notify_all()
+
+    @staticmethod
+    def _user(chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': f"user{chat_id}"}
+
+    def inject_message(self, chat_id, text):
+        self._push({'message': {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'from': self._user(chat_id), 'chat': {'id': chat_id, 'type': 'private'},
+            'text': text}})
+
+    def inject_callback(self, chat_id, data):
+        message = self.chats[chat_id].last_markup_message or {
+            'message_id': 0, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        callback_id = str(next(self._callback_ids))
+        self._callback_chats[callback_id] = chat_id
+        self._push({'callback_query': {
+            'id': callback_id, 'from': self._user(chat_id),
+            'message': message, 'chat_instance': str(chat_id), 'data': data}})
+
+    # ---- observation -----------------------------------------------------
+    def call_count(self, chat_id):
+        return len(self.chats[chat_id].calls)
+
+    def wait_for(self, chat_id, after, predicate, timeout):
+        """Wait for an outbound call to chat_id, newer than index `after`, matching predicate.
+
+        Returns (index, time, method, params) or None on timeout.
+        """
+        chat = self.chats[chat_id]
+        deadline = time.time() + timeout
+        with chat.cond:
+            while True:
+                for index in range(after, len(chat.calls)):
+                    at, method, params = chat.calls[index]
+                    if predicate(method, params):
+                        return index, at, method, params
+                after = len(chat.calls)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                chat.cond.wait(remaining)
+
+    # ---- Bot API ---------------------------------------------------------
+    def _record(self, method, params):
+        chat_id = params.get('chat_id') or self._callback_chats.pop(params.get('callback_query_id'), None)
+        with self._lock:
+            self.method_counts[method] += 1
+        if chat_id is None:
+            return
+        chat = self.chats[int(chat_id)]
+        with chat.cond:
+            chat.calls.append((time.time(), method, params))
+            chat.cond.notify_all()
+
+    def _message(self, params, **extra):
+        chat_id = int(params['chat_id'])
+        # An edited message keeps its id
+        message_id = int(params['message_id']) if params.get('message_id') else next(self._message_ids)
+        message = {'message_id': message_id, 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}, **extra}
+        if 'text' in params:
+            message['text'] = params['text']
+        if params.get('reply_markup'):
+            message['reply_markup'] = json.loads(params['reply_markup'])
+            self.chats[chat_id].last_markup_message = message
+        return message
+
+    def get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        timeout = float(params.get('timeout', 0) or 0)
+        deadline = time.time() + timeout
+        with self.updates_cond:
+            # Acknowledged updates are dropped, as Telegram does
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            while not self.updates and time.time() < deadline:
+                self.updates_cond.wait(deadline - time.time())
+            return self.updates[:limit]
+
+    def handle(self, method, params, files):
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        self._record(method, params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            return self._message(params)
+        if method == 'sendPhoto':
+            photo = files.get('photo')
+            code = fixture_site.captcha_code(photo) if photo else None
+            if code:
+                self.chats[int(params['chat_id'])].captcha_code = code
+            return self._message(params, caption=params.get('caption', ''),
+                                 photo=[{'file_id': 'p', 'file_unique_id': 'p', 'width': 1, 'height': 1}])
+        if method == 'sendDocument':
+            return self._message(params, document={'file_id': 'd', 'file_unique_id': 'd'})
+        return True
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _params(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            files = {}
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            if length:
+                body = self.rfile.read(length)
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('multipart/form-data'):
+                    message = BytesParser(policy=policy.HTTP).parsebytes(
+                        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+                    for part in message.iter_parts():
+                        name = part.get_param('name', header='content-disposition')
+                        payload = part.get_payload(decode=True)
+                        if part.get_filename():
+                            files[name] = payload
+                        else:
+                            params[name] = payload.decode('utf-8')
+                elif content_type.startswith('application/json'):
+                    params.update(json.loads(body))
+                else:
+                    params.update({k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()})
+            return url.path.rsplit('/', 1)[-1], params, files
+
+        def _serve(self):
+            method, params, files = self._params()
+            body = json.dumps({'ok': True, 'result': api.handle(method, params, files)}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _serve
+        do_POST = _serve
+
+    return Handler
+
+def start(port=0):
+    """Start the fake API on a background thread; returns (server, api)."""
+    api = FakeTelegram()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api
@@ -0,0 +1,257 @@
+"""Local stand-in for the target site.
+
+Reproduces the page structure that the absolute ds.XPATHS and
+ds.POST_LOGIN_XPATHS expect, with the ids and names the other registered
+locators try first: the login form with CAPTCHA, the Page1/Page2/Page3
+postback buttons and the data entry form. Any username is accepted; the password "wrong" is
+rejected as invalid credentials. A wrong CAPTCHA shows the login form again
+with a new CAPTCHA and the username kept, as an ASP.NET postback would.
+With fail_rate set, that share of page requests gets a 503; setting
+state.down makes every page request fail, like the site being down.
+
+    python bench/fixture_site.py [port]
+"""
+import html
+import random
+import string
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 1x1 transparent PNG served as the CAPTCHA image
+CAPTCHA_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082')
+
+def captcha_png(code):
+    """The 1x1 PNG with the code in a tEXt chunk, so stand-ins can read it back."""
+    data = b'code\x00' + code.encode('ascii')
+    chunk = struct.pack('>I', len(data)) + b'tEXt' + data + struct.pack('>I', zlib.crc32(b'tEXt' + data))
+    return CAPTCHA_PNG[:33] + chunk + CAPTCHA_PNG[33:]
+
+def captcha_code(png):
+    """Read the code back out of a captcha_png() image, or None."""
+    marker = png.find(b'tEXtcode\x00')
+    if marker < 0:
+        return None
+    length = struct.unpack('>I', png[marker - 4:marker])[0]
+    return png[marker + 9:marker + 4 + length].decode('ascii')
+
+# Login form: username, password, CAPTCHA and button live under
+# /html/body/form/div[9]/div/div[2]/div/div/div[2]/div/div[2]
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Login</title></head><body>
+<form method="post" action="/">
+<div></div><div></div><div></div><div></div><div></div><div></div><div></div><div></div>
+<div><div><div></div><div><div><div><div></div><div><div><div></div><div>
+<div><input type="text" id="txtUserName" name="txtUserName" value="{username}"></div>
+<div><input type="password" id="txtPassword" name="txtPassword"></div>
+<div><div><img id="imgCaptcha" src="/captcha.png?code={code}" alt="captcha"></div></div>
+<div><input type="text" id="txtCaptcha" name="txtCaptcha"></div>
+<input type="submit" id="btnLogin" name="btnLogin" value="Login">
+</div></div></div></div></div></div></div></div>
+</form>
+{error}
+</body></html>"""
+
+FAILURE_PAGE = """<!DOCTYPE html>
+<html><head><title>Error</title></head><body>
+{banner}
+</body></html>"""
+
+# Error banner at /html/body/div[2]/h2, also appended after the login form
+FAILURE_BANNER = "<div></div><div><h2>{message}</h2></div>"
+
+# Logged-in header: success marker under nav/div/div/div/div/div/ul/li/a/span
+# and the Page3 link under nav/div/div/ul/li[2]/a
+HEADER = """<header><nav><div>
+<div><div><div><div><ul><li><a href="#"><span>Welcome {username}</span></a></li></ul></div></div></div></div>
+<div><ul><li><a href="#">Home</a></li><li><a href="#" onclick="postback('Page3');return false;">Data Entry</a></li></ul></div>
+</div></nav></header>"""
+
+POSTBACK_SCRIPT = """<input type="hidden" id="__EVENTTARGET" name="__EVENTTARGET" value="">
+<script>function postback(t){{document.getElementById('__EVENTTARGET').value=t;document.forms[0].submit();}}</script>"""
+
+# Page1 button under form/div[4]/div/div/div/div/div/div/input
+HOME_PAGE = """<!DOCTYPE html>
+<html><head><title>Home</title></head><body>
+<form method="post" action="/">{header}{script}
+<div></div><div></div><div></div>
+<div><div><div><div><div><div><div><input type="submit" name="btnPage1" value="Continue"></div></div></div></div></div></div></div>
+</form>
+</body></html>"""
+
+# Page2 verify span under form/div[4]/div/div/div/div/div/div/span and
+# button under .../div[2]/div[2]/div/div/div/div/ul/input
+SECTION_PAGE = """<!DOCTYPE html>
+<html><head><title>Section</title></head><body>
+<form method="post" action="/">{header}{script}
+<div></div><div></div><div></div>
+<div><div><div><div><div><div>
+<div><span>Monthly Returns</span></div>
+<div><div></div><div><div><div><div><div><ul><input type="submit" name="btnPage2" value="Open Section"></ul></div></div></div></div></div></div>
+</div></div></div></div></div></div>
+</form>
+</body></html>"""
+
+# Data entry: input at .../div[2]/div/div/div[15]/input, save at div[19]/input
+def form_page(header, script, saved_value):
+    fields = []
+    for i in range(1, 20):
+        if i == 15:
+            fields.append('<div><input type="text" id="HomeContentPlaceHolder_txtValue" '
+                          f'name="HomeContentPlaceHolder_txtValue" value="{html.escape(saved_value or "")}"></div>')
+        elif i == 19:
+            fields.append('<div><input type="submit" id="HomeContentPlaceHolder_btnSave" '
+                          'name="HomeContentPlaceHolder_btnSave" value="Save"></div>')
+        elif i <= 6:
+            fields.append(f'<div><label for="HomeContentPlaceHolder_txtField{i}">Field {i}</label>'
+                          f'<input type="text" id="HomeContentPlaceHolder_txtField{i}" '
+                          f'value="value {i}" readonly></div>')
+        else:
+            fields.append('<div></div>')
+    saved = f'<p id="saved">Saved: {saved_value}</p>' if saved_value else ''
+    return f"""<!DOCTYPE html>
+<html><head><title>Data Entry</title></head><body>
+<form method="post" action="/">{header}{script}
+<div></div><div></div><div></div>
+<div><div><div><div><div><div><div>
+<div></div><div><div><div>{''.join(fields)}</div></div></div>
+</div></div></div></div></div></div></div>
+{saved}
+</form>
+</body></html>"""
+
+class FixtureState:
+    def __init__(self, page_delay=0.0, fail_rate=0.0):
+        self.page_delay = page_delay
+        self.fail_rate = fail_rate
+        self.down = False
+        self.failures = 0
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def session(self, sid):
+        with self.lock:
+            self.requests += 1
+            return self.sessions.setdefault(sid, {'page': 'login', 'code': None, 'username': None,
+                                                  'saved': None})
+
+def _new_code():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _session(self):
+            cookie = SimpleCookie(self.headers.get('Cookie', ''))
+            sid = cookie['sid'].value if 'sid' in cookie else uuid.uuid4().hex
+            return sid, state.session(sid)
+
+        def _send(self, body, sid=None, content_type='text/html; charset=utf-8'):
+            if state.page_delay:
+                time.sleep(state.page_delay)
+            data = body if isinstance(body, bytes) else body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            if sid:
+                self.send_header('Set-Cookie', f'sid={sid}; Path=/')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _fail(self):
+            """Answer 503 if the site is down or this request is picked to fail."""
+            if not (state.down or random.random() < state.fail_rate):
+                return False
+            with state.lock:
+                state.failures += 1
+            body = b'Service Unavailable'
+            self.send_response(503)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+
+        def _render(self, sid, session, error=''):
+            header = HEADER.format(username=session['username'])
+            page = session['page']
+            if page == 'home':
+                return HOME_PAGE.format(header=header, script=POSTBACK_SCRIPT.format())
+            if page == 'section':
+                return SECTION_PAGE.format(header=header, script=POSTBACK_SCRIPT.format())
+            if page == 'form':
+                return form_page(header, POSTBACK_SCRIPT.format(), session['saved'])
+            session['code'] = _new_code()
+            username = html.escape(session['username'] or '') if error else ''
+            return LOGIN_PAGE.format(code=session['code'], username=username,
+                                     error=FAILURE_BANNER.format(message=error) if error else '')
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/captcha.png':
+                code = parse_qs(url.query).get('code', [''])[0]
+                self._send(captcha_png(code), content_type='image/png')
+                return
+            if self._fail():
+                return
+            sid, session = self._session()
+            if url.path == '/':
+                # Loading the site root always starts a fresh login
+                session['page'] = 'login'
+            self._send(self._render(sid, session), sid)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+            if self._fail():
+                return
+            sid, session = self._session()
+
+            if 'btnLogin' in form:
+                if form.get('txtPassword') == 'wrong':
+                    banner = FAILURE_BANNER.format(message='Invalid username or password')
+                    self._send(FAILURE_PAGE.format(banner=banner), sid)
+                    return
+                if form.get('txtCaptcha', '').upper() != (session['code'] or ''):
+                    session['username'] = form.get('txtUserName')
+                    self._send(self._render(sid, session, error='Captcha mismatch, please retry'), sid)
+                    return
+                session['username'] = form.get('txtUserName')
+                session['page'] = 'home'
+            elif 'btnPage1' in form:
+                session['page'] = 'section'
+            elif 'btnPage2' in form:
+                session['page'] = 'section'
+            elif form.get('__EVENTTARGET') == 'Page3':
+                session['page'] = 'form'
+            elif 'HomeContentPlaceHolder_btnSave' in form:
+                session['saved'] = form.get('HomeContentPlaceHolder_txtValue')
+            self._send(self._render(sid, session), sid)
+
+    return Handler
+
+def start(port=0, page_delay=0.0, fail_rate=0.0):
+    """Start the fixture site on a background thread; returns (server, state)."""
+    state = FixtureState(page_delay, fail_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == '__main__':
+    server, _ = start(int(sys.argv[1]) if len(sys.argv) > 1 else 8081)
+    print(f"Fixture site on http://127.0.0.1:{server.server_address[1]}/")
+    threading.Event().wait()
@@ -0,0 +1,214 @@
+"""Load driver for the bot.py handlers against the fake Telegram API.
+
+Imports bot.py with telebot pointed at bench/fake_telegram.py, then plays
+scripted conversations for many simulated chats at once. Reports handler
+latency and Bot API calls per step, outbound calls per flow and worker-pool
+saturation. The menu flow walks the settings menus, for comparing calls per
+tap between versions of the menu handlers. Needs MONGO_URI (a local mongod is fine). The login_full flow
+also needs Chrome; it starts the fixture site and stub OCR itself.
+
+    python bench/load_telegram.py [chats] [concurrency] [flow,flow,...]
+    python bench/load_telegram.py 2000 200 settings,login_menu
+"""
+import os
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_telegram
+import fixture_site
+import stub_ocr
+
+STEP_TIMEOUT = 30
+LOGIN_TIMEOUT = 180
+
+# Steps: ('send', text) and ('tap', callback data) measure time to the next
+# reply; ('wait', text) waits for a reply containing text; ('captcha',)
+# answers a manual CAPTCHA photo if one arrives before the login result.
+FLOWS = {
+    'settings': [
+        ('send', '/settings'),
+        ('tap', 'add_cred'),
+        ('send', 'user{chat}'),
+        ('send', 'secret'),
+        ('tap', 'view_creds'),
+        ('tap', 'remove_all'),
+        ('tap', 'cancel'),
+    ],
+    'login_menu': [
+        ('send', '/login'),
+        ('tap', 'cancel'),
+    ],
+    'menu': [
+        ('send', '/settings'),
+        ('tap', 'add_cred'),
+        ('send', 'user{chat}'),
+        ('send', 'secret'),
+        ('tap', 'view_creds'),
+        ('tap', 'cancel'),
+        ('send', '/settings'),
+        ('tap', 'remove_cred'),
+        ('tap', 'remove:user{chat}'),
+        ('tap', 'cancel'),
+    ],
+    'login_full': [
+        ('send', '/settings'),
+        ('tap', 'add_cred'),
+        ('send', 'user{chat}'),
+        ('send', 'secret'),
+        ('send', '/login'),
+        ('tap', 'login:user{chat}'),
+        ('captcha',),
+        ('wait', 'Successfully logged in'),
+        ('send', '/operations'),
+        ('wait', 'Enter value'),
+        ('send', '42'),
+        ('wait', 'Value saved'),
+        ('send', '/logout'),
+        ('send', '/settings'),
+        ('tap', 'remove_all'),
+    ],
+}
+
+def _text(params):
+    return params.get('text') or params.get('caption') or ''
+
+def _is_reply(method, params):
+    return method in fake_telegram.REPLY_METHODS
+
+def run_flow(api, chat_id, flow, latencies, failures, steps):
+    """Play one flow; appends (label, start time) per step to `steps`."""
+    for step in FLOWS[flow]:
+        kind = step[0]
+        label = f"{flow}:{kind}:{step[1] if len(step) > 1 else ''}".replace(str(chat_id), '{chat}')
+        before = api.call_count(chat_id)
+        start = time.time()
+        steps.append((label, start))
+        if kind == 'send':
+            api.inject_message(chat_id, step[1].format(chat=chat_id))
+            timeout = STEP_TIMEOUT
+            predicate = _is_reply
+        elif kind == 'tap':
+            api.inject_callback(chat_id, step[1].format(chat=chat_id))
+            timeout = STEP_TIMEOUT
+            predicate = _is_reply
+        elif kind == 'wait':
+            timeout = LOGIN_TIMEOUT
+            predicate = lambda method, params, text=step[1]: _is_reply(method, params) and text in _text(params)
+        else:
+            timeout = LOGIN_TIMEOUT
+            predicate = lambda method, params: method == 'sendPhoto' or 'logged in' in _text(params) or 'failed' in _text(params)
+
+        found = api.wait_for(chat_id, before, predicate, timeout)
+        if found is None:
+            failures[label] += 1
+            return False
+        latencies[label].append(found[1] - start)
+        if kind == 'captcha' and found[2] == 'sendPhoto':
+            # Wait for the text prompt after the photo, then answer it
+            api.wait_for(chat_id, found[0] + 1, lambda m, p: 'captcha' in _text(p).lower(), STEP_TIMEOUT)
+            api.inject_message(chat_id, api.chats[chat_id].captcha_code or '')
+    return True
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[max(int(len(values) * pct / 100 + 0.5) - 1, 0)] if values else 0
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    flows = (sys.argv[3] if len(sys.argv) > 3 else 'settings,login_menu').split(',')
+
+    server, api = fake_telegram.start()
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:bench')
+    os.environ.setdefault('BOT_OWNER_ID', '0')
+    if 'login_full' in flows:
+        site, _ = fixture_site.start()
+        ocr, _ = stub_ocr.start(fail_rate=float(os.getenv('OCR_FAIL_RATE', '0.5')))
+        os.environ['URL'] = f"http://127.0.0.1:{site.server_address[1]}/"
+        os.environ['RAPIDAPI_OCR_URL'] = f"http://127.0.0.1:{ocr.server_address[1]}/ocr"
+    os.chdir(os.environ.get('BENCH_WORKDIR', '/tmp'))
+
+    from telebot import apihelper
+    apihelper.API_URL = f"http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}"
+    import bot
+
+    threading.Thread(target=bot.bot.infinity_polling,
+                     kwargs={'timeout': 1, 'long_polling_timeout': 1}, daemon=True).start()
+
+    pool = getattr(bot.bot, 'worker_pool', None)
+    workers = getattr(pool, 'num_threads', None)
+    depth_samples = []
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            depth_samples.append(pool.tasks.qsize() if pool else 0)
+            time.sleep(0.2)
+
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+    completed = defaultdict(int)
+    calls_by_flow = defaultdict(lambda: defaultdict(int))
+    step_starts = {}  # chat_id -> [(label, start)]
+    work = queue.Queue()
+    for i in range(chats):
+        work.put((900000 + i, flows[i % len(flows)]))
+
+    def driver():
+        while True:
+            try:
+                chat_id, flow = work.get_nowait()
+            except queue.Empty:
+                return
+            steps = step_starts[chat_id] = []
+            if run_flow(api, chat_id, flow, latencies, failures, steps):
+                completed[flow] += 1
+            for _, method, _ in list(api.chats[chat_id].calls):
+                calls_by_flow[flow][method] += 1
+
+    threading.Thread(target=sample, daemon=True).start()
+    start = time.time()
+    threads = [threading.Thread(target=driver) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - start
+    time.sleep(1)  # Let handlers still running after their reply finish their calls
+    done.set()
+    bot.bot.stop_polling()
+
+    # A call belongs to the step that started last before it
+    step_calls = defaultdict(list)
+    for chat_id, steps in step_starts.items():
+        calls = [at for at, _, _ in api.chats[chat_id].calls]
+        for index, (label, step_start) in enumerate(steps):
+            step_end = steps[index + 1][1] if index + 1 < len(steps) else float('inf')
+            step_calls[label].append(sum(1 for at in calls if step_start <= at < step_end))
+
+    print(f"{chats} chats, {concurrency} concurrent, {wall:.1f}s, telebot workers: {workers}")
+    for flow in flows:
+        runs = completed[flow] or 1
+        per_run = {m: round(n / runs, 1) for m, n in sorted(calls_by_flow[flow].items())}
+        print(f"\n{flow}: {completed[flow]} completed, outbound calls per run {per_run}")
+    print(f"\n{'step':<44}{'n':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'fail':>6}{'calls':>7}")
+    for label in sorted(set(latencies) | set(failures)):
+        values = latencies[label]
+        calls = step_calls[label]
+        print(f"{label:<44}{len(values):>7}{percentile(values, 50) * 1000:>9.0f}"
+              f"{percentile(values, 95) * 1000:>9.0f}{percentile(values, 99) * 1000:>9.0f}{failures[label]:>6}"
+              f"{sum(calls) / max(len(calls), 1):>7.1f}")
+    if depth_samples:
+        print(f"\nworker queue depth: max {max(depth_samples)}, "
+              f"mean {sum(depth_samples) / len(depth_samples):.1f}, "
+              f"saturated {sum(1 for d in depth_samples if d > 0) / len(depth_samples):.0%} of samples")
+
+if __name__ == '__main__':
+    main()
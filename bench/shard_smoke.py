@@ -0,0 +1,95 @@
+"""Local multi-process check of sharded mode against the fake Telegram API.
+
+Starts the front (shard.py) with N worker processes pointed at
+bench/fake_telegram.py, sends /start from many chats and checks that every
+chat gets a reply, then kills one worker and checks that its chats are
+still answered while it restarts and rejoins the ring. Needs MONGO_URI
+(a local mongod is fine).
+
+    python bench/shard_smoke.py [workers] [chats]
+"""
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_telegram
+
+REPLY_TIMEOUT = 60
+
+def send_and_wait(api, chats, text):
+    """Inject text from every chat; return the chats that got no reply."""
+    before = {chat_id: api.call_count(chat_id) for chat_id in chats}
+    for chat_id in chats:
+        api.inject_message(chat_id, text)
+    missing = []
+    for chat_id in chats:
+        found = api.wait_for(chat_id, before[chat_id],
+                             lambda method, params: method in fake_telegram.REPLY_METHODS, REPLY_TIMEOUT)
+        if found is None:
+            missing.append(chat_id)
+    return missing
+
+def wait_until(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.2)
+    return False
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    chats = list(range(700000, 700000 + (int(sys.argv[2]) if len(sys.argv) > 2 else 200)))
+
+    server, api = fake_telegram.start()
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:bench')
+    os.environ.setdefault('BOT_OWNER_ID', '0')
+    os.environ['TELEGRAM_API_URL'] = f"http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}"
+    os.environ.setdefault('PORT', '18000')
+    os.environ.setdefault('WORKER_BASE_PORT', '18001')
+    os.chdir(tempfile.mkdtemp(prefix='shard_smoke_'))
+
+    import shard
+    front = shard.run_front(worker_count=workers)
+    failed = False
+    try:
+        if not wait_until(lambda: len(front.ring.nodes()) == workers, REPLY_TIMEOUT):
+            print(f"only {len(front.ring.nodes())}/{workers} workers became ready")
+            return 1
+
+        owners = Counter(front.ring.get(chat_id) for chat_id in chats)
+        print(f"{workers} workers ready, chats per worker: {dict(sorted(owners.items()))}")
+        start = time.time()
+        missing = send_and_wait(api, chats, '/start')
+        print(f"round 1: {len(chats) - len(missing)}/{len(chats)} chats answered in {time.time() - start:.1f}s")
+        failed |= bool(missing)
+
+        victim = front.workers[0]
+        victim_chats = [chat_id for chat_id in chats if front.ring.get(chat_id) == 0]
+        victim.process.kill()
+        victim.process.wait()
+        start = time.time()
+        missing = send_and_wait(api, victim_chats, '/start')
+        print(f"worker 0 killed: {len(victim_chats) - len(missing)}/{len(victim_chats)} "
+              f"of its chats answered in {time.time() - start:.1f}s")
+        failed |= bool(missing)
+
+        rejoined = wait_until(lambda: 0 in front.ring.nodes(), REPLY_TIMEOUT)
+        print(f"worker 0 restarted {victim.restarts} time(s), back on the ring: {rejoined}")
+        failed |= not rejoined
+        missing = send_and_wait(api, chats, '/start')
+        print(f"round 3: {len(chats) - len(missing)}/{len(chats)} chats answered")
+        failed |= bool(missing)
+    finally:
+        front.stop()
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
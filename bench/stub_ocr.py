@@ -0,0 +1,65 @@
+"""Stub for the RapidAPI OCR endpoint used by ds.process_captcha.
+
+Answers GET /ocr?url=<captcha url> with {"text": ...}. The fixture site puts
+the expected code in the CAPTCHA URL, so the stub reads it from there.
+Latency and failure rate are configurable to exercise the manual fallback.
+
+    python bench/stub_ocr.py [port] [delay_seconds] [fail_rate]
+"""
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class OcrState:
+    def __init__(self, delay=0.3, fail_rate=0.0):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.calls = 0
+        self.lock = threading.Lock()
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with state.lock:
+                state.calls += 1
+            if state.delay:
+                time.sleep(state.delay)
+            params = parse_qs(urlparse(self.path).query)
+            captcha_url = params.get('url', [''])[0]
+            code = parse_qs(urlparse(captcha_url).query).get('code', [''])[0]
+            if random.random() < state.fail_rate:
+                # Misread one character, as real OCR does
+                code = code[:-1] + ('0' if code[-1:] != '0' else '1')
+            body = json.dumps({'text': code}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def start(port=0, delay=0.3, fail_rate=0.0):
+    """Start the stub on a background thread; returns (server, state)."""
+    state = OcrState(delay, fail_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8082
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    fail_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    server, _ = start(port, delay, fail_rate)
+    print(f"Stub OCR on http://127.0.0.1:{server.server_address[1]}/ocr")
+    threading.Event().wait()
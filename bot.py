@@ -1,496 +1,181 @@
 import telebot
 import ds
-import logging
+import io
 import os
+import threading
+import time
+import tracing
+import metrics
+import health
+import profiling
+import warmup
+import admission
+import handlers
+from telebot import apihelper
 from session_manager_headless import session_manager
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from db import (
-    save_user_credentials,
-    get_user_usernames,
-    get_credential_by_username,
-    remove_user_credential,
-    remove_all_user_credentials
-)
-from logger import bot_logger, user_interaction_logger
+from logger import bot_logger, BOT_OWNER_ID
 from webserver import keep_alive
 
 # Initialize bot with your token
 API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 bot = telebot.TeleBot(API_TOKEN)
 
-# Configure logging
-from logger import (
-    bot_logger, user_interaction_logger, login_logger, session_logger,
-    BOT_OWNER_ID, MAX_LOG_LINES, trim_log_file, log_file
-)
-
-# Log bot startup
-bot_logger.info('Starting bot...')
-
-# Set up periodic log trimming
-import threading
-import time
-
-def trim_logs_periodically():
-    while True:
-        time.sleep(3600)  # Check every hour
-        trim_log_file(log_file, MAX_LOG_LINES)
-        bot_logger.info('Log file trimmed to keep latest lines')
+# Alternate Bot API endpoint, e.g. a local stand-in: http://host:port/bot{0}/{1}
+if os.getenv('TELEGRAM_API_URL'):
+    apihelper.API_URL = os.getenv('TELEGRAM_API_URL')
 
-# Start log trimming thread
-trim_thread = threading.Thread(target=trim_logs_periodically, daemon=True)
-trim_thread.start()
+# Health thresholds
+POLL_STALE_SECONDS = int(os.getenv('POLL_STALE_SECONDS', '120'))  # Max gap between getUpdates calls
+MAX_WORKER_QUEUE = int(os.getenv('MAX_WORKER_QUEUE', '50'))  # Pending handler tasks before not ready
 
-# User input handling
-ds.user_inputs = {}
+last_poll_at = time.time()
+last_update_at = None
 
-# User state tracking
-user_states = {}
+# Count and time every Bot API call made through telebot
+_make_request = apihelper._make_request
 
-def create_credentials_keyboard(user_id):
-    """Create inline keyboard with user's credentials."""
-    keyboard = InlineKeyboardMarkup()
-    usernames = get_user_usernames(str(user_id))
-    if not usernames:
-        return keyboard
-    for username in usernames:
-        keyboard.add(InlineKeyboardButton(username, callback_data=f"login_{username}"))
-    keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
-    return keyboard
-
-def create_remove_credentials_keyboard(user_id):
-    """Create inline keyboard for removing credentials."""
-    keyboard = InlineKeyboardMarkup()
-    usernames = get_user_usernames(str(user_id))
-    for username in usernames:
-        keyboard.add(InlineKeyboardButton(f"Remove {username}", callback_data=f"remove_{username}"))
-    keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
-    return keyboard
-
-def create_settings_keyboard():
-    """Create inline keyboard for settings."""
-    keyboard = InlineKeyboardMarkup()
-    keyboard.row(
-        InlineKeyboardButton("View Credentials", callback_data="view_creds"),
-        InlineKeyboardButton("Add Credential", callback_data="add_cred")
-    )
-    keyboard.row(
-        InlineKeyboardButton("Remove Credential", callback_data="remove_cred"),
-        InlineKeyboardButton("Remove All", callback_data="remove_all")
-    )
-    keyboard.row(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
-    return keyboard
-
-# Start command handler
-@bot.message_handler(commands=['start'])
-def send_welcome(message):
-    user_id = message.chat.id
-    user_interaction_logger.info(f"User {user_id} sent /start: {message.text}")
-    if session_manager.is_user_busy(user_id):
-        sent_msg = bot.send_message(user_id,
-                     "⚠️ Session is already active. Please wait for the current operation to complete or use /logout to reset.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Session is already active.")
-        return
-
-    ds.clear_status(user_id)  # Clear any existing status
-    ds.set_bot_instance(bot, user_id)
-    session_manager.get_session(user_id)
-    sent_msg = bot.send_message(user_id, '👋 Welcome! I\'m ready to help you. Use /login to begin or /settings to manage your credentials.')
-    ds.last_message_id[user_id] = sent_msg.message_id
-    user_interaction_logger.info(f"Bot to {user_id}: 👋 Welcome! I'm ready to help you. Use /login to begin or /settings to manage your credentials.")
-
-# Login command handler
-@bot.message_handler(commands=['login'])
-def handle_login(message):
-    user_id = message.chat.id
-    user_interaction_logger.info(f"User {user_id} sent /login: {message.text}")
-    
-    if session_manager.is_user_busy(user_id):
-        sent_msg = bot.send_message(user_id,
-                     "⚠️ Session is already active. Please wait for the current operation to complete or use /logout to reset.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Session is already active.")
-        return
+def _instrumented_make_request(token, method_name, *args, **kwargs):
+    global last_poll_at, last_update_at
+    metrics.telegram_calls.labels(method_name).inc()
+    start = time.perf_counter()
+    try:
+        result = _make_request(token, method_name, *args, **kwargs)
+        if method_name == 'getUpdates':
+            last_poll_at = time.time()
+            if result:
+                last_update_at = last_poll_at
+        return result
+    except Exception:
+        metrics.telegram_errors.labels(method_name).inc()
+        raise
+    finally:
+        metrics.telegram_latency.labels(method_name).observe(time.perf_counter() - start)
 
-    if not session_manager.can_attempt_login(user_id):
-        sent_msg = bot.send_message(user_id,
-                     "⚠️ Please wait 5 seconds before attempting to login again.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Login cooldown active.")
-        return
+apihelper._make_request = _instrumented_make_request
 
-    # Check for credentials before creating keyboard
-    usernames = get_user_usernames(str(user_id))
-    user_interaction_logger.info(f"Found {len(usernames)} credentials for user {user_id}")
-    
-    if not usernames:
-        keyboard = create_settings_keyboard()
-        sent_msg = bot.send_message(user_id, "❌ No saved credentials found. Use the menu below to add your credentials:", reply_markup=keyboard)
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: No saved credentials, showing settings menu.")
-        return
+def _telegram_probe():
+    since_poll = time.time() - last_poll_at
+    details = {'seconds_since_poll': round(since_poll, 1),
+               'seconds_since_update': round(time.time() - last_update_at, 1) if last_update_at else None}
+    return since_poll < POLL_STALE_SECONDS, details
 
-    keyboard = create_credentials_keyboard(user_id)
-    sent_msg = bot.send_message(user_id, "Select a username to login:", reply_markup=keyboard)
-    ds.last_message_id[user_id] = sent_msg.message_id
-    user_interaction_logger.info(f"Bot to {user_id}: Showing credential selection keyboard with {len(usernames)} options.")
+def _worker_probe():
+    depth = bot.worker_pool.tasks.qsize() if getattr(bot, 'worker_pool', None) else 0
+    return depth < MAX_WORKER_QUEUE, {'queue_depth': depth, 'max': MAX_WORKER_QUEUE}
 
-# Settings command handler
-@bot.message_handler(commands=['settings'])
-def handle_settings(message):
-    user_id = message.chat.id
-    user_interaction_logger.info(f"User {user_id} sent /settings: {message.text}")
-    keyboard = create_settings_keyboard()
-    sent_msg = bot.send_message(user_id, "Credential Management Settings:", reply_markup=keyboard)
-    ds.last_message_id[user_id] = sent_msg.message_id
-    user_interaction_logger.info(f"Bot to {user_id}: Credential Management Settings:")
+health.register_probe('telegram', _telegram_probe, liveness=True)
+health.register_probe('workers', _worker_probe)
 
-# Logout command handler
-@bot.message_handler(commands=['logout'])
-def handle_logout(message):
-    user_id = message.chat.id
-    user_interaction_logger.info(f"User {user_id} sent /logout: {message.text}")
-    ds.clear_status(user_id)  # Clear any existing status
-    session_manager.close_session(user_id)
-    sent_msg = bot.send_message(user_id, '👋 Logged out successfully.')
-    ds.last_message_id[user_id] = sent_msg.message_id
-    user_interaction_logger.info(f"Bot to {user_id}: 👋 Logged out successfully.")
+# Log bot startup
+bot_logger.info('Starting bot...')
 
-# Logs command handler
-@bot.message_handler(commands=['logs'])
-def handle_logs(message):
-    user_id = message.chat.id
-    user_interaction_logger.info(f"User {user_id} sent /logs: {message.text}")
-    
-    if user_id != BOT_OWNER_ID:
-        sent_msg = bot.send_message(user_id, "⚠️ This command is only available to the bot owner.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Command not available - not owner")
-        return
-    
-    try:
-        # Trim logs before sending
-        trim_log_file(log_file, MAX_LOG_LINES)
-        
-        # Send the log file
-        with open(log_file, 'rb') as f:
-            sent_msg = bot.send_document(user_id, f, caption="📋 Here are the latest logs.")
-            ds.last_message_id[user_id] = sent_msg.message_id
-            user_interaction_logger.info(f"Bot to {user_id}: Sent log file")
-    except Exception as e:
-        sent_msg = bot.send_message(user_id, f"❌ Error sending logs: {str(e)}")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.error(f"Error sending logs to owner: {str(e)}")
+def send_profile_report(filename, text):
+    """Deliver a finished profile to the bot owner as a document."""
+    document = io.BytesIO(text.encode('utf-8'))
+    document.name = filename
+    bot.send_document(BOT_OWNER_ID, document, caption="🔬 Profile report")
+
+profiling.set_report_sink(send_profile_report)
+
+# Commands and menus live in handlers.py; this module adds the threaded runs
+for command, handler in (('start', handlers.start), ('login', handlers.login),
+                         ('settings', handlers.settings), ('logout', handlers.logout),
+                         ('logs', handlers.logs), ('traces', handlers.traces),
+                         ('history', handlers.run_history), ('profile', handlers.profile),
+                         ('import', handlers.import_command), ('export', handlers.export_command)):
+    bot.register_message_handler(handler, commands=[command], pass_bot=True)
+bot.register_message_handler(handlers.import_document, content_types=['document'], pass_bot=True)
+
+def admit(user_id, kind):
+    """Wait for a browser slot, keeping the user posted on their place in the queue."""
+    def on_wait(position, eta):
+        ds.bot_log(handlers.queue_position_text(position, eta), user_id)
+
+    result = admission.controller.acquire(user_id, kind, on_wait)
+    if result == admission.GRANTED:
+        return True
+    # A cancelled wait was ended by /cancel or /logout, which answer the user themselves
+    if result == admission.TIMED_OUT:
+        ds.bot_log(handlers.NOT_ADMITTED_TEXT, user_id)
+    return False
+
+def run_admitted(user_id, kind, run, on_rejected=None):
+    """Run now on a free browser slot, or queue for one on a thread of its own.
+
+    A queued run must not hold a telebot worker: replies from other users,
+    CAPTCHA answers included, need those. When the run ends the busy flag
+    is cleared and the slot stays with the user's Chrome, if there is one.
+    """
+    def wrapped(queued):
+        admitted = not queued or admit(user_id, kind)
+        try:
+            if admitted:
+                run()
+        finally:
+            session_manager.finish_run(user_id)
+        if not admitted and on_rejected:
+            on_rejected()
+
+    if admission.controller.try_acquire(user_id, kind):
+        wrapped(False)
+    else:
+        threading.Thread(target=wrapped, args=(True,), name=f"queued-{kind}-{user_id}", daemon=True).start()
 
 # Operations command handler
 @bot.message_handler(commands=['operations'])
 def handle_operations(message):
-    user_id = message.chat.id
-    user_interaction_logger.info(f"User {user_id} sent /operations: {message.text}")
-    
-    # Check if user has an active session
-    if user_id not in session_manager.sessions or not session_manager.sessions[user_id].get('driver'):
-        usernames = get_user_usernames(str(user_id))
-        if not usernames:
-            keyboard = create_settings_keyboard()
-            sent_msg = bot.send_message(user_id, "❌ No saved credentials found. Use the menu below to add your credentials:", reply_markup=keyboard)
-        else:
-            keyboard = create_credentials_keyboard(user_id)
-            sent_msg = bot.send_message(user_id, "⚠️ Please login first to perform operations.", reply_markup=keyboard)
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Please login first to perform operations.")
-        return
-
-    if session_manager.is_user_busy(user_id):
-        sent_msg = bot.send_message(user_id,
-                     "⚠️ Session is already active. Please wait for the current operation to complete or use /logout to reset.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Session is already active.")
+    if not handlers.begin_operations(message, bot):
         return
+    user_id = message.chat.id
 
-    ds.clear_status(user_id)  # Clear any existing status
-    ds.set_bot_instance(bot, user_id)
-    session_manager.set_user_busy(user_id, True)
-    try:
-        ds.post_login_operations(user_id)
-    except Exception as e:
-        sent_msg = bot.send_message(user_id, "⚠️ Please login first to perform operations.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Please login first to perform operations.")
-    finally:
-        session_manager.set_user_busy(user_id, False)
+    def run():
+        try:
+            with profiling.maybe_profile('operations', user_id), tracing.run('operations', user_id):
+                ds.post_login_operations(user_id)
+        except Exception as e:
+            handlers.operations_failed(bot, user_id, e)
 
-# Callback query handler
-@bot.callback_query_handler(func=lambda call: True)
-def handle_callback(call):
-    user_id = call.message.chat.id
-    data = call.data
-    user_interaction_logger.info(f"User {user_id} callback: {data}")
+    run_admitted(user_id, 'operations', run)
 
-    if data == "cancel":
-        bot.answer_callback_query(call.id, "Operation cancelled")
-        # Delete the message containing the cancel button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
-        ds.clear_status(user_id)  # Clear any existing status message
-        sent_msg = bot.send_message(user_id, "Operation cancelled.")
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Operation cancelled.")
-        if user_id in user_states:
-            del user_states[user_id]
+@bot.callback_query_handler(func=lambda call: call.data.startswith("login:"))
+def login_with(call):
+    """Log in with the tapped username, on a browser slot."""
+    credentials = handlers.begin_login(call, bot)
+    if credentials is None:
         return
+    user_id = call.message.chat.id
+    username = credentials["username"]
 
-    if data.startswith("login_"):
-        # Get the full username by removing just the 'login_' prefix
-        username = data[6:]
-        bot_logger.info(f"Login button clicked for user {user_id} with username {username}")
-        bot.answer_callback_query(call.id, f"Attempting to login with {username}...")
-        user_interaction_logger.info(f"Bot to {user_id}: Attempting to login with {username}...")
-        
-        # Delete the message containing the username button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
-
+    def run():
+        prepared = warmup.claim(user_id)
         try:
-            credentials = get_credential_by_username(str(user_id), username)
-            if not credentials:
-                bot_logger.warning(f"No credentials found for user {user_id} with username {username}")
-                ds.clear_status(user_id)  # Clear any existing status message
-                sent_msg = bot.send_message(user_id, f"❌ Credentials not found for {username}")
-                ds.last_message_id[user_id] = sent_msg.message_id
-                user_interaction_logger.info(f"Bot to {user_id}: ❌ Credentials not found for {username}")
-                return
-                
-            bot_logger.debug(f"Credentials found for user {user_id}")
-            ds.clear_status(user_id)
-            ds.set_bot_instance(bot, user_id)
-            
-            try:
-                # Initialize session first
-                bot_logger.debug(f"Initializing session for user {user_id}")
-                session = session_manager.get_session(user_id)
-                if not session:
-                    bot_logger.error(f"Failed to initialize session for user {user_id}")
-                    sent_msg = bot.send_message(user_id, f"❌ Failed to initialize session")
-                    ds.last_message_id[user_id] = sent_msg.message_id
-                    user_interaction_logger.info(f"Bot to {user_id}: ❌ Failed to initialize session")
+            with profiling.maybe_profile('login', user_id), tracing.run('login', user_id):
+                bot_logger.debug("Initializing session for user %s", user_id, extra={'user_id': user_id})
+                if not session_manager.get_session(user_id):
+                    bot_logger.error("Failed to initialize session for user %s", user_id, extra={'user_id': user_id})
+                    handlers.reply(bot, user_id, "❌ Failed to initialize session")
                     return
-                
-                bot_logger.debug(f"Session initialized successfully for user {user_id}")
-                session_manager.set_user_busy(user_id, True)
-                
-                success = ds.handle_login_attempt(user_id, credentials["username"], credentials["password"])
-                if not success:
-                    bot_logger.warning(f"Login failed for user {user_id} with username {username}")
-                    session_manager.close_session(user_id)
-                    sent_msg = bot.send_message(user_id, f"❌ Login failed for {username}")
-                    ds.last_message_id[user_id] = sent_msg.message_id
-                    user_interaction_logger.info(f"Bot to {user_id}: ❌ Login failed for {username}")
-                else:
-                    bot_logger.info(f"Login successful for user {user_id} with username {username}")
-                    sent_msg = bot.send_message(user_id, f"✅ Successfully logged in as {username}")
-                    ds.last_message_id[user_id] = sent_msg.message_id
-                    user_interaction_logger.info(f"Bot to {user_id}: ✅ Successfully logged in as {username}")
-            except Exception as e:
-                bot_logger.error(f"Error during login for user {user_id}: {str(e)}")
-                sent_msg = bot.send_message(user_id, f"❌ Error during login: {str(e)}")
-                ds.last_message_id[user_id] = sent_msg.message_id
-                user_interaction_logger.info(f"Bot to {user_id}: ❌ Error during login: {str(e)}")
-                session_manager.close_session(user_id)
-            finally:
-                session_manager.set_user_busy(user_id, False)
+                success = ds.handle_login_attempt(user_id, username, credentials["password"],
+                                                  prepared=prepared)
+            handlers.login_finished(bot, user_id, username, success)
         except Exception as e:
-            bot_logger.error(f"Error handling login callback for user {user_id}: {str(e)}")
-            sent_msg = bot.send_message(user_id, f"❌ Internal error occurred")
-            ds.last_message_id[user_id] = sent_msg.message_id
-            user_interaction_logger.info(f"Bot to {user_id}: ❌ Internal error occurred")
+            handlers.login_failed(bot, user_id, e)
 
-    elif data == "view_creds":
-        # Delete the message containing the view credentials button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
-
-        usernames = get_user_usernames(str(user_id))
-        if usernames:
-            keyboard = InlineKeyboardMarkup()
-            creds_list = "Your saved credentials:\n" + "\n".join([f"- {username}" for username in usernames])
-            keyboard.add(InlineKeyboardButton("❌ Close", callback_data="cancel"))
-            bot.answer_callback_query(call.id)
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, creds_list, reply_markup=keyboard)
-            ds.last_message_id[user_id] = sent_msg.message_id
-            user_interaction_logger.info(f"Bot to {user_id}: {creds_list}")
-        else:
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, "No credentials found.")
-            ds.last_message_id[user_id] = sent_msg.message_id
-            bot.answer_callback_query(call.id)
-            user_interaction_logger.info(f"Bot to {user_id}: No credentials found.")
-
-    elif data == "add_cred":
-        # Delete the message containing the add credential button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
+    run_admitted(user_id, 'login', run, on_rejected=lambda: warmup.cancel(user_id))
 
-        user_states[user_id] = {"state": "waiting_username"}
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
-        bot.answer_callback_query(call.id)
-        ds.clear_status(user_id)  # Clear any existing status message
-        sent_msg = bot.send_message(user_id, "Please enter your username:", reply_markup=keyboard)
-        ds.last_message_id[user_id] = sent_msg.message_id
-        user_interaction_logger.info(f"Bot to {user_id}: Please enter your username:")
+# Every other button
+bot.register_callback_query_handler(handlers.menu_callback, func=lambda call: True, pass_bot=True)
 
-    elif data == "remove_cred":
-        # Delete the message containing the remove credential button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
-
-        keyboard = create_remove_credentials_keyboard(user_id)
-        if keyboard.keyboard:  # Check if there are any credentials
-            bot.answer_callback_query(call.id)
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, "Select credential to remove:", reply_markup=keyboard)
-            ds.last_message_id[user_id] = sent_msg.message_id
-            user_interaction_logger.info(f"Bot to {user_id}: Select credential to remove:")
-        else:
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, "No credentials found to remove.")
-            ds.last_message_id[user_id] = sent_msg.message_id
-            bot.answer_callback_query(call.id)
-            user_interaction_logger.info(f"Bot to {user_id}: No credentials found to remove.")
-
-    elif data.startswith("remove_"):
-        # Delete the message containing the remove username button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
-
-        username = data[7:]  # Get username after 'remove_'
-        bot_logger.info(f"Attempting to remove credentials for user {user_id} with username {username}")
-        
-        if remove_user_credential(str(user_id), username):
-            bot.answer_callback_query(call.id, f"Removed credentials for {username}")
-            keyboard = create_settings_keyboard()
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, f"✅ Removed credentials for {username}", reply_markup=keyboard)
-            ds.last_message_id[user_id] = sent_msg.message_id
-            user_interaction_logger.info(f"Bot to {user_id}: ✅ Removed credentials for {username}")
-        else:
-            bot_logger.warning(f"Failed to remove credentials for user {user_id} with username {username}")
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, f"❌ Failed to remove credentials for {username}")
-            ds.last_message_id[user_id] = sent_msg.message_id
-            bot.answer_callback_query(call.id)
-            user_interaction_logger.info(f"Bot to {user_id}: ❌ Failed to remove credentials for {username}")
-
-    elif data == "remove_all":
-        # Delete the message containing the remove all button
-        try:
-            bot.delete_message(user_id, call.message.message_id)
-        except:
-            pass
-
-        if remove_all_user_credentials(str(user_id)):
-            bot.answer_callback_query(call.id, "All credentials removed")
-            keyboard = create_settings_keyboard()
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, "✅ All credentials have been removed.", reply_markup=keyboard)
-            ds.last_message_id[user_id] = sent_msg.message_id
-            user_interaction_logger.info(f"Bot to {user_id}: ✅ All credentials have been removed.")
-        else:
-            ds.clear_status(user_id)  # Clear any existing status message
-            sent_msg = bot.send_message(user_id, "Failed to remove credentials")
-            ds.last_message_id[user_id] = sent_msg.message_id
-            bot.answer_callback_query(call.id)
-            user_interaction_logger.info(f"Bot to {user_id}: Failed to remove credentials")
-
-# Update the input handler
-@bot.message_handler(func=lambda message: True)
-def handle_user_input(message):
-    user_id = message.chat.id
-    text = message.text
-    user_interaction_logger.info(f"User {user_id} input: {text}")
-
-    # Delete user's message for security
-    try:
-        bot.delete_message(user_id, message.message_id)
-    except:
-        pass
-
-    # Handle CAPTCHA input
+def answer_prompt(user_id, text):
+    """Hand text to a run waiting in ds.bot_input; False if none is."""
     if user_id in ds.user_inputs and ds.user_inputs[user_id] is None:
         ds.user_inputs[user_id] = text
-        # Delete previous bot message if exists
-        if hasattr(message, 'reply_to_message') and message.reply_to_message:
-            try:
-                bot.delete_message(user_id, message.reply_to_message.message_id)
-            except:
-                pass
-        sent_msg = bot.send_message(user_id, '✅ CAPTCHA received!')
-        user_interaction_logger.info(f"Bot to {user_id}: ✅ CAPTCHA received!")
-        # Store message ID for later deletion
-        ds.last_message_id[user_id] = sent_msg.message_id
-        return
+        return True
+    return False
 
-    # Handle credential input
-    if user_id in user_states:
-        state = user_states[user_id].get('state')
-        if state == 'waiting_username':
-            user_states[user_id] = {'state': 'waiting_password', 'username': text}
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
-            # Delete previous bot message if exists
-            if hasattr(message, 'reply_to_message') and message.reply_to_message:
-                try:
-                    bot.delete_message(user_id, message.reply_to_message.message_id)
-                except:
-                    pass
-            sent_msg = bot.send_message(user_id, "Please enter your password:", reply_markup=keyboard)
-            user_interaction_logger.info(f"Bot to {user_id}: Please enter your password:")
-            # Store message ID for later deletion
-            ds.last_message_id[user_id] = sent_msg.message_id
-
-        elif state == 'waiting_password':
-            username = user_states[user_id].get('username')
-            if save_user_credentials(str(user_id), username, text):
-                keyboard = create_settings_keyboard()
-                # Delete previous bot message if exists
-                if hasattr(message, 'reply_to_message') and message.reply_to_message:
-                    try:
-                        bot.delete_message(user_id, message.reply_to_message.message_id)
-                    except:
-                        pass
-                sent_msg = bot.send_message(user_id, f"✅ Credentials saved for {username}", reply_markup=keyboard)
-                user_interaction_logger.info(f"Bot to {user_id}: ✅ Credentials saved for {username}")
-                # Store message ID for later deletion
-                ds.last_message_id[user_id] = sent_msg.message_id
-            else:
-                keyboard = create_settings_keyboard()
-                # Delete previous bot message if exists
-                if hasattr(message, 'reply_to_message') and message.reply_to_message:
-                    try:
-                        bot.delete_message(user_id, message.reply_to_message.message_id)
-                    except:
-                        pass
-                sent_msg = bot.send_message(user_id, "❌ Failed to save credentials", reply_markup=keyboard)
-                user_interaction_logger.info(f"Bot to {user_id}: ❌ Failed to save credentials")
-                # Store message ID for later deletion
-                ds.last_message_id[user_id] = sent_msg.message_id
-
-            del user_states[user_id]  # Clear the state
+@bot.message_handler(func=lambda message: True)
+def handle_user_input(message):
+    handlers.user_input(message, bot, answer_prompt)
 
 keep_alive()
 # Start the bot
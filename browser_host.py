@@ -0,0 +1,174 @@
+"""Browser host: owns the Chrome processes so they outlive bot restarts.
+
+Run next to the bot and set BROWSER_HOST_URL for the bot:
+
+    python browser_host.py                      # listens on 127.0.0.1:9300
+    BROWSER_HOST_URL=http://127.0.0.1:9300 python bot.py
+
+Each Chrome is started with a remote debugging port; the bot attaches
+chromedriver to it by debugger address. Small JSON API:
+
+    GET    /browsers        {key: {"address", "pid", "started_at"}}
+    POST   /browsers/<key>  start (or return the running) browser for key
+    DELETE /browsers/<key>  stop it and remove its profile
+"""
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Plain logger: the host runs without the bot's environment, which logger.py needs
+host_logger = logging.getLogger('browser_host')
+
+BROWSER_HOST_PORT = int(os.getenv('BROWSER_HOST_PORT', '9300'))
+CHROME_BINARY = os.getenv('CHROME_BINARY', '/usr/bin/google-chrome')
+PROFILE_ROOT = os.getenv('CHROME_PROFILE_ROOT', '/tmp/dsts-profiles')
+CHROME_START_TIMEOUT = 15  # Seconds to wait for the debugging endpoint
+
+# Chrome flags shared with the chromedriver-launched sessions
+CHROME_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--window-size=1920,1080',
+    '--headless=new',
+    '--disable-gpu',
+    '--disable-software-rasterizer',
+    '--single-process',
+    '--disable-extensions',
+    '--disable-blink-features=AutomationControlled',
+]
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class BrowserHost:
+    def __init__(self):
+        self.browsers = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, browser):
+        return browser['process'].poll() is None
+
+    def launch(self, key):
+        with self._lock:
+            browser = self.browsers.get(key)
+            if browser and self._alive(browser):
+                return browser
+        port = _free_port()
+        profile = os.path.join(PROFILE_ROOT, key)
+        shutil.rmtree(profile, ignore_errors=True)
+        process = subprocess.Popen(
+            [CHROME_BINARY, *CHROME_ARGS, f'--remote-debugging-port={port}',
+             f'--user-data-dir={profile}', 'about:blank'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        deadline = time.time() + CHROME_START_TIMEOUT
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/json/version', timeout=1).read()
+                break
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    process.kill()
+                    raise RuntimeError(f"Chrome for {key} did not start")
+                time.sleep(0.1)
+        browser = {'process': process, 'address': f'127.0.0.1:{port}', 'profile': profile,
+                   'started_at': time.time()}
+        with self._lock:
+            self.browsers[key] = browser
+        host_logger.info("Started Chrome for %s on %s (pid %s)", key, browser['address'], process.pid)
+        return browser
+
+    def close(self, key):
+        with self._lock:
+            browser = self.browsers.pop(key, None)
+        if browser is None:
+            return False
+        browser['process'].terminate()
+        try:
+            browser['process'].wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            browser['process'].kill()
+            browser['process'].wait()
+        shutil.rmtree(browser['profile'], ignore_errors=True)
+        host_logger.info("Stopped Chrome for %s", key)
+        return True
+
+    def listing(self):
+        with self._lock:
+            for key in [k for k, b in self.browsers.items() if not self._alive(b)]:
+                host_logger.warning("Chrome for %s exited", key)
+                self.browsers.pop(key)
+            return {key: {'address': b['address'], 'pid': b['process'].pid, 'started_at': b['started_at']}
+                    for key, b in self.browsers.items()}
+
+    def close_all(self):
+        for key in list(self.browsers):
+            self.close(key)
+
+def make_handler(host):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _key(self):
+            parts = self.path.strip('/').split('/')
+            return parts[1] if len(parts) == 2 and parts[0] == 'browsers' else None
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/browsers':
+                self._reply(200, host.listing())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            key = self._key()
+            if key is None:
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                browser = host.launch(key)
+            except Exception as e:
+                host_logger.error("Failed to start Chrome for %s: %s", key, e)
+                self._reply(500, {'error': str(e)})
+                return
+            self._reply(200, {'address': browser['address'], 'pid': browser['process'].pid,
+                              'started_at': browser['started_at']})
+
+        def do_DELETE(self):
+            key = self._key()
+            self._reply(200 if key and host.close(key) else 404, {})
+
+    return Handler
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    host = BrowserHost()
+    server = ThreadingHTTPServer(('127.0.0.1', BROWSER_HOST_PORT), make_handler(host))
+    server.daemon_threads = True
+    host_logger.info("Browser host listening on 127.0.0.1:%s", BROWSER_HOST_PORT)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.close_all()
+
+if __name__ == '__main__':
+    sys.exit(main())
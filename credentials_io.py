@@ -0,0 +1,79 @@
+"""Credential import and export as CSV, for both bot runtimes.
+
+One credential per line: username,password[,form value]. Fields are
+separated by commas, semicolons or tabs, whichever the first line uses. A
+header row starting with "username" and blank lines are skipped, as are
+lines starting with # at the top of the file. After that a leading # is
+part of the username. The whole file is parsed and checked
+before anything is written, then saved with one database write.
+"""
+import csv
+import io
+import ds
+
+MAX_IMPORT_BYTES = 64 * 1024  # Larger uploads are refused before download
+EXPORT_FILENAME = 'credentials.csv'
+IMPORT_PROMPT = ("📥 Send a CSV or text file with one credential per line: username,password[,form value]. "
+                 "Credentials already saved are left unchanged.")
+EXPORT_CAPTION = "📤 Your saved credentials. The file holds your passwords: delete it once stored safely."
+
+def parse_credentials(text):
+    """Credentials and line errors from an uploaded file: ([{username, password, ...}], [str])."""
+    lines = [(number, line) for number, line in enumerate(text.splitlines(), 1) if line.strip()]
+    # Comments only at the top: a username may start with #
+    while lines and lines[0][1].lstrip().startswith('#'):
+        lines.pop(0)
+    # The file's separator is the first of comma, semicolon, tab found on its first line
+    first = lines[0][1] if lines else ''
+    delimiter = next((d for d in ',;\t' if d in first), ',')
+    credentials, errors, seen = [], [], set()
+    for index, (number, line) in enumerate(lines):
+        row = [cell.strip() for cell in next(csv.reader([line], delimiter=delimiter))]
+        if index == 0 and row[0].lower() == 'username':
+            continue
+        if len(row) < 2 or not row[0] or not row[1]:
+            errors.append(f"line {number}: needs a username and a password")
+            continue
+        if len(row) > 3:
+            errors.append(f"line {number}: too many fields")
+            continue
+        username, password = row[0], row[1]
+        if username in seen:
+            errors.append(f"line {number}: {username} appears twice")
+            continue
+        credential = {'username': username, 'password': password}
+        if len(row) == 3 and row[2]:
+            try:
+                ds.render_form_value(row[2], username)
+            except ValueError as e:
+                errors.append(f"line {number}: {e}")
+                continue
+            credential['form_value'] = row[2]
+        seen.add(username)
+        credentials.append(credential)
+    return credentials, errors
+
+def format_import_summary(added, existing, over_limit, errors, limit):
+    """One reply describing the result of an import."""
+    lines = [f"📥 Imported {len(added)} credential{'s' if len(added) != 1 else ''}"
+             + (f": {', '.join(added)}" if added else '')]
+    if existing:
+        lines.append(f"↩️ Already saved, left unchanged: {', '.join(existing)}")
+    if over_limit:
+        lines.append(f"⚠️ Over the limit of {limit} per user, not saved: {', '.join(over_limit)}")
+    if errors:
+        lines.append("❌ Skipped lines:\n" + "\n".join(f"- {error}" for error in errors[:20]))
+        if len(errors) > 20:
+            lines.append(f"... and {len(errors) - 20} more")
+    return "\n".join(lines)
+
+def export_credentials(credentials):
+    """A user's credentials as a CSV document ready for send_document."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['username', 'password', 'form_value'])
+    for cred in credentials:
+        writer.writerow([cred['username'], cred['password'], cred.get('form_value', '')])
+    document = io.BytesIO(buffer.getvalue().encode('utf-8'))
+    document.name = EXPORT_FILENAME
+    return document
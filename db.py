@@ -1,31 +1,89 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+import functools
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from logger import db_logger
+import metrics
+import health
+import time
 
 # MongoDB connection
 MONGO_URI = os.getenv('MONGO_URI')
+MAX_CREDENTIALS = 4  # Saved credentials per user
+MONGO_PROBE_TIMEOUT_MS = int(os.getenv('MONGO_PROBE_TIMEOUT_MS', '2000'))  # Health ping server selection timeout
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Record MongoDB command latency and failures from driver events."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.mongo_latency.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        metrics.mongo_latency.labels(event.command_name).observe(event.duration_micros / 1e6)
+        metrics.mongo_failures.labels(event.command_name).inc()
 
 try:
     db_logger.info("Attempting to connect to MongoDB...")
-    client = MongoClient(MONGO_URI)
+    client = MongoClient(MONGO_URI, event_listeners=[CommandMetricsListener()])
     # Verify connection
     client.admin.command('ping')
     db_logger.info("Successfully connected to MongoDB")
     
     db = client['dsts_bot']
     credentials_collection = db['credentials']
+    # Learned shortcut to the data entry form per site username
+    form_routes_collection = db['form_routes']
+    form_routes_collection.create_index('site_username', unique=True)
+    # Last extracted data entry form per site username, for change detection
+    form_snapshots_collection = db['form_snapshots']
+    form_snapshots_collection.create_index('site_username', unique=True)
+    # One document per login/operations run, written in batches by history.py
+    runs_collection = db['runs']
+    runs_collection.create_index([('user_id', 1), ('started_at', -1)])
+    runs_collection.create_index([('started_at', -1), ('kind', 1)])
     
     # Log collection info
-    db_logger.info(f"Using database: {db.name}")
-    db_logger.info(f"Using collection: {credentials_collection.name}")
+    db_logger.info("Using database: %s", db.name)
+    db_logger.info("Using collection: %s", credentials_collection.name)
     
 except Exception as e:
-    db_logger.error(f"Failed to connect to MongoDB: {str(e)}")
+    db_logger.error("Failed to connect to MongoDB: %s", e)
     raise
 
+# Separate client for the health ping, so an unreachable server fails the
+# probe quickly instead of after the driver's 30s server selection timeout
+_probe_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_PROBE_TIMEOUT_MS,
+                            connectTimeoutMS=MONGO_PROBE_TIMEOUT_MS, maxPoolSize=1)
+
+def _ping_probe():
+    start = time.perf_counter()
+    _probe_client.admin.command('ping')
+    return True, {'ping_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+health.register_probe('mongodb', _ping_probe)
+
+_credential_listeners = []
+
+def on_credentials_changed(func):
+    """Call func(user_id) after any write to a user's credentials (e.g. to drop cached keyboards)."""
+    _credential_listeners.append(func)
+
+def _changes_credentials(write):
+    @functools.wraps(write)
+    def wrapper(user_id, *args, **kwargs):
+        try:
+            return write(user_id, *args, **kwargs)
+        finally:
+            for listener in _credential_listeners:
+                listener(str(user_id))
+    return wrapper
+
+@_changes_credentials
 def save_user_credentials(user_id: str, username: str, password: str) -> bool:
-    """Save user credentials to MongoDB with a limit of 4 per user."""
+    """Save user credentials to MongoDB with a limit of MAX_CREDENTIALS per user."""
     user_credentials = credentials_collection.find_one({'user_id': str(user_id)})
     
     if user_credentials:
@@ -36,7 +94,7 @@ def save_user_credentials(user_id: str, username: str, password: str) -> bool:
             if cred['username'] == username:
                 return False
         # Add new credentials if limit not reached
-        if len(credentials) < 4:
+        if len(credentials) < MAX_CREDENTIALS:
             credentials.append({'username': username, 'password': password})
             credentials_collection.update_one(
                 {'user_id': str(user_id)},
@@ -52,6 +110,36 @@ def save_user_credentials(user_id: str, username: str, password: str) -> bool:
         })
         return True
 
+@_changes_credentials
+def add_user_credentials(user_id: str, credentials: List[Dict[str, str]]) -> Tuple[List[str], List[str], List[str]]:
+    """Save several credentials with one write, keeping the per-user limit.
+
+    Returns the usernames added, those already saved and those over the limit.
+    """
+    for _ in range(3):
+        user_credentials = credentials_collection.find_one({'user_id': str(user_id)}, {'credentials.username': 1})
+        saved = {cred['username'] for cred in user_credentials.get('credentials', [])} if user_credentials else set()
+        existing = [cred['username'] for cred in credentials if cred['username'] in saved]
+        new = [cred for cred in credentials if cred['username'] not in saved]
+        room = max(MAX_CREDENTIALS - len(saved), 0)
+        add, over_limit = new[:room], [cred['username'] for cred in new[room:]]
+        if not add:
+            return [], existing, over_limit
+        if user_credentials is None:
+            credentials_collection.insert_one({'user_id': str(user_id), 'credentials': add})
+            return [cred['username'] for cred in add], existing, over_limit
+        # Only applies if nobody added credentials since the read above
+        result = credentials_collection.update_one(
+            {'user_id': str(user_id),
+             f'credentials.{MAX_CREDENTIALS - len(add)}': {'$exists': False},
+             'credentials.username': {'$nin': [cred['username'] for cred in add]}},
+            {'$push': {'credentials': {'$each': add}}}
+        )
+        if result.modified_count:
+            return [cred['username'] for cred in add], existing, over_limit
+        db_logger.info("Credentials of user %s changed during import, retrying", user_id, extra={'user_id': user_id})
+    raise RuntimeError("Credentials kept changing during import, please try again")
+
 def get_user_credentials(user_id: str) -> List[Dict[str, str]]:
     """Get all credentials for a user."""
     user_credentials = credentials_collection.find_one({'user_id': str(user_id)})
@@ -69,44 +157,45 @@ def get_user_usernames(user_id: str) -> List[str]:
 def get_credential_by_username(user_id: str, username: str) -> Optional[Dict[str, str]]:
     """Get specific credentials by username."""
     try:
-        db_logger.debug(f"Searching credentials for user {user_id} with username {username}")
+        db_logger.debug("Searching credentials for user %s with username %s", user_id, username, extra={'user_id': user_id})
         user_credentials = credentials_collection.find_one({'user_id': str(user_id)})
         
         if user_credentials:
-            db_logger.debug(f"Found user document for {user_id}")
+            db_logger.debug("Found user document for %s", user_id, extra={'user_id': user_id})
             credentials = user_credentials.get('credentials', [])
-            db_logger.debug(f"User has {len(credentials)} saved credentials")
+            db_logger.debug("User has %s saved credentials", len(credentials))
             
             for cred in credentials:
                 if cred['username'] == username:
-                    db_logger.info(f"Found matching credentials for username {username}")
+                    db_logger.info("Found matching credentials for username %s", username)
                     return cred
             
-            db_logger.warning(f"No matching credentials found for username {username}")
+            db_logger.warning("No matching credentials found for username %s", username)
         else:
-            db_logger.warning(f"No user document found for user {user_id}")
+            db_logger.warning("No user document found for user %s", user_id, extra={'user_id': user_id})
         
         return None
     except Exception as e:
-        db_logger.error(f"Error retrieving credentials: {str(e)}")
+        db_logger.error("Error retrieving credentials: %s", e)
         raise
 
+@_changes_credentials
 def remove_user_credential(user_id: str, username: str) -> bool:
     """Remove a specific credential for a user."""
     try:
         # First check if the credential exists
         user_credentials = credentials_collection.find_one({'user_id': str(user_id)})
         if not user_credentials:
-            db_logger.warning(f"No credentials found for user {user_id}")
+            db_logger.warning("No credentials found for user %s", user_id, extra={'user_id': user_id})
             return False
 
         # Check if the specific username exists
         credentials = user_credentials.get('credentials', [])
-        db_logger.info(f"Current credentials for user {user_id}: {[cred['username'] for cred in credentials]}")
+        db_logger.info("Current credentials for user %s: %s", user_id, [cred['username'] for cred in credentials], extra={'user_id': user_id})
         
         username_exists = any(cred['username'] == username for cred in credentials)
         if not username_exists:
-            db_logger.warning(f"Username {username} not found for user {user_id}")
+            db_logger.warning("Username %s not found for user %s", username, user_id, extra={'user_id': user_id})
             return False
 
         # Remove the credential
@@ -118,19 +207,122 @@ def remove_user_credential(user_id: str, username: str) -> bool:
         # Verify removal
         updated_credentials = credentials_collection.find_one({'user_id': str(user_id)})
         updated_usernames = [cred['username'] for cred in updated_credentials.get('credentials', [])]
-        db_logger.info(f"Updated credentials for user {user_id}: {updated_usernames}")
+        db_logger.info("Updated credentials for user %s: %s", user_id, updated_usernames, extra={'user_id': user_id})
         
         if result.modified_count > 0 and username not in updated_usernames:
-            db_logger.info(f"Successfully removed credentials for username {username} from user {user_id}")
+            db_logger.info("Successfully removed credentials for username %s from user %s", username, user_id, extra={'user_id': user_id})
             return True
         else:
-            db_logger.error(f"Failed to remove credentials for username {username} from user {user_id}")
+            db_logger.error("Failed to remove credentials for username %s from user %s", username, user_id, extra={'user_id': user_id})
             return False
     except Exception as e:
-        db_logger.error(f"Error removing credentials for user {user_id}: {str(e)}")
+        db_logger.error("Error removing credentials for user %s: %s", user_id, e, extra={'user_id': user_id})
         return False
 
+@_changes_credentials
 def remove_all_user_credentials(user_id: str) -> bool:
     """Remove all credentials for a user."""
     result = credentials_collection.delete_one({'user_id': str(user_id)})
-    return result.deleted_count > 0
\ No newline at end of file
+    return result.deleted_count > 0
+
+@_changes_credentials
+def set_form_value(user_id: str, username: str, value: Optional[str]) -> bool:
+    """Save the value /operations enters for a credential; None removes it."""
+    if value:
+        update = {'$set': {'credentials.$.form_value': value}}
+    else:
+        update = {'$unset': {'credentials.$.form_value': ''}}
+    result = credentials_collection.update_one(
+        {'user_id': str(user_id), 'credentials.username': username}, update)
+    return result.matched_count > 0
+
+def get_form_route(site_username: str) -> Optional[Dict[str, str]]:
+    """The learned shortcut to the form for a site username, if any."""
+    document = form_routes_collection.find_one({'site_username': site_username}, {'route': 1})
+    if document:
+        return document['route']
+    return None
+
+def save_form_route(site_username: str, route: Optional[Dict[str, str]]) -> None:
+    """Store the shortcut to the form for a site username; None forgets it."""
+    if route:
+        form_routes_collection.update_one(
+            {'site_username': site_username},
+            {'$set': {'route': route, 'updated_at': time.time()}},
+            upsert=True
+        )
+    else:
+        form_routes_collection.delete_one({'site_username': site_username})
+
+def get_form_snapshot(site_username: str) -> Optional[Dict[str, str]]:
+    """Field id -> value of the form as last seen for a site username."""
+    snapshot = form_snapshots_collection.find_one({'site_username': site_username}, {'fields': 1})
+    if snapshot:
+        return dict(snapshot['fields'])
+    return None
+
+def save_form_snapshot(site_username: str, fields: Dict[str, str]) -> None:
+    """Store the form's fields for a site username (as pairs: ids may contain dots)."""
+    form_snapshots_collection.update_one(
+        {'site_username': site_username},
+        {'$set': {'fields': [[field_id, value] for field_id, value in fields.items()],
+                  'updated_at': time.time()}},
+        upsert=True
+    )
+
+def insert_runs(runs: List[Dict]) -> None:
+    """Insert a batch of run documents in one round trip."""
+    runs_collection.insert_many(runs, ordered=False)
+
+def get_recent_runs(user_id: str, limit: int = 10) -> List[Dict]:
+    """A user's latest runs, newest first."""
+    return list(runs_collection.find({'user_id': str(user_id)}, {'_id': 0, 'stages': 0})
+                .sort('started_at', -1).limit(limit))
+
+_server_version = None
+
+def _supports_median() -> bool:
+    """True if the server has the $median accumulator (MongoDB 7.0+)."""
+    global _server_version
+    if _server_version is None:
+        _server_version = tuple(client.server_info()['versionArray'][:2])
+    return _server_version >= (7, 0)
+
+def aggregate_runs(since: float) -> List[Dict]:
+    """Per kind since `since` (epoch seconds): runs, successes, median duration, CAPTCHA sources.
+
+    The window is matched on the started_at index; the rest runs in MongoDB.
+    The median is an approximate $median (MongoDB 7.0+), which skips runs
+    without a duration and keeps no per-run state. Older servers sort the
+    window by duration, push each kind's durations in order and take the
+    middle one, so only the durations reach the group.
+    """
+    group = {
+        '_id': '$kind',
+        'runs': {'$sum': 1},
+        'successes': {'$sum': {'$cond': [{'$eq': ['$outcome', 'success']}, 1, 0]}},
+        'captcha_runs': {'$sum': {'$cond': [{'$ifNull': ['$captcha', False]}, 1, 0]}},
+        # Logged in with a machine-read CAPTCHA, no manual entry needed
+        'ocr_hits': {'$sum': {'$cond': [{'$and': [
+            {'$in': ['$captcha', ['ocr', 'prepared']]},
+            {'$eq': ['$outcome', 'success']}]}, 1, 0]}},
+    }
+    pipeline = [{'$match': {'started_at': {'$gte': since}}}]
+    if _supports_median():
+        group['median_ms'] = {'$median': {'input': '$duration_ms', 'method': 'approximate'}}
+        pipeline.append({'$group': group})
+    else:
+        # Runs without a duration push null, sorted first and filtered out below
+        group['durations'] = {'$push': {'$ifNull': ['$duration_ms', None]}}
+        durations = {'$filter': {'input': '$durations', 'cond': {'$ne': ['$$this', None]}}}
+        pipeline += [
+            {'$sort': {'duration_ms': 1}},
+            {'$group': group},
+            {'$addFields': {'durations': durations}},
+            # Upper middle for an even count; no median_ms when no run has a duration
+            {'$addFields': {'median_ms': {'$arrayElemAt': [
+                '$durations', {'$floor': {'$divide': [{'$size': '$durations'}, 2]}}]}}},
+            {'$project': {'durations': 0}},
+        ]
+    pipeline.append({'$sort': {'_id': 1}})
+    return list(runs_collection.aggregate(pipeline, allowDiskUse=True))
@@ -1,23 +1,35 @@
 import requests
 import os
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException
+from urllib.parse import urlparse
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import (NoSuchElementException, ElementNotInteractableException,
+                                        ElementClickInterceptedException)
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 import time
+from datetime import date
 from session_manager_headless import session_manager
+from db import get_credential_by_username, get_form_route, get_form_snapshot, save_form_route, save_form_snapshot
 from logger import login_logger, bot_logger
+from tracing import annotate, span, traced
+import locators
+import metrics
+import resilience
 
-# Bot instance handling
-bot_instances = {}
-chat_ids = {}
-user_inputs = {}
-last_message_id = {}
-status_logs = {}
+from user_state import user_store
+
+# Bot instance handling: views over the per-user contexts in user_store
+bot_instances = user_store.field('bot')
+chat_ids = user_store.field('chat_id')
+user_inputs = user_store.field('pending_input')
+last_message_id = user_store.field('last_message_id')
 
 def set_bot_instance(bot, chat_id):
     global bot_instances, chat_ids
     bot_instances[chat_id] = bot
     chat_ids[chat_id] = chat_id
 
+@traced('telegram.status')
 def bot_log(message, user_id=None):
     if user_id in bot_instances and user_id in chat_ids:
         try:
@@ -33,10 +45,10 @@ def bot_log(message, user_id=None):
             sent_message = bot_instances[user_id].send_message(
                 chat_ids[user_id], str(message))
             last_message_id[user_id] = sent_message.message_id
-            bot_logger.debug(f"Message sent to user {user_id}: {message}")
+            bot_logger.debug("Message sent to user %s: %s", user_id, message, extra={'user_id': user_id})
         except Exception as e:
-            bot_logger.error(f"Failed to send message to bot: {e}")
-            bot_logger.debug(f"Failed message content: {message}")
+            bot_logger.error("Failed to send message to bot: %s", e)
+            bot_logger.debug("Failed message content: %s", message)
     else:
         bot_logger.debug(message)
 
@@ -72,11 +84,12 @@ def bot_input(prompt, user_id=None):
         start_time = time.time()
         while user_inputs[user_id] is None:
             if time.time() - start_time > timeout:
+                # Stop waiting so later messages are not taken as this reply
+                del user_inputs[user_id]
                 bot_log("⚠️ Input timeout. Please try again.", user_id)
                 return None
             time.sleep(0.5)
-        response = user_inputs[user_id]
-        user_inputs[user_id] = None
+        response = user_inputs.pop(user_id)
         return response
     return input(prompt)
 
@@ -85,6 +98,7 @@ def bot_input(prompt, user_id=None):
 # --------------------------
 website_url = os.getenv('URL')
 max_retries = 3
+AUTO_LOGIN_ATTEMPTS = int(os.getenv('AUTO_LOGIN_ATTEMPTS', '3'))  # OCR attempts before manual entry
 
 # XPaths (Pre-Login)
 XPATHS = {
@@ -112,12 +126,61 @@ POST_LOGIN_XPATHS = {
     "Page2_verify_path": "/html/body/form/div[4]/div/div/div/div/div/div/span",
     "Page2_btn_path":
     "/html/body/form/div[4]/div/div/div/div/div/div[2]/div[2]/div/div/div/div/ul/input",
-    "Page3_btn_path": "/html/body/form/header/nav/div/div/ul/li[2]/a"
+    "Page3_btn_path": "/html/body/form/header/nav/div/div/ul/li[2]/a",
+    "Form_input_path":
+    "/html/body/form/div[4]/div/div/div/div/div/div/div[2]/div/div/div[15]/input",
+    "Form_save_path":
+    "/html/body/form/div[4]/div/div/div/div/div/div/div[2]/div/div/div[19]/input"
 }
 
+# Candidate locators per logical element, best first: id, name, relative
+# XPath, CSS, then the absolute XPath above as the last resort
+CAPTCHA_IMG_XPATH = "//img[contains(translate(@src, 'CAPTCHA', 'captcha'), 'captcha')]"
+locators.register('username', ('id', 'txtUserName'), ('name', 'txtUserName'),
+                  ('xpath', "//form//input[@type='text'][following::input[@type='password']]"),
+                  ('css', "form input[type='text']"), ('xpath', XPATHS["username"]))
+locators.register('password', ('id', 'txtPassword'), ('name', 'txtPassword'),
+                  ('xpath', "//form//input[@type='password']"),
+                  ('css', "form input[type='password']"), ('xpath', XPATHS["password"]))
+locators.register('captcha_img', ('id', 'imgCaptcha'), ('xpath', CAPTCHA_IMG_XPATH),
+                  ('css', "form img[src*='aptcha']"), ('xpath', XPATHS["captcha_img"]))
+locators.register('captcha_input', ('id', 'txtCaptcha'), ('name', 'txtCaptcha'),
+                  ('xpath', CAPTCHA_IMG_XPATH + "/following::input[@type='text'][1]"),
+                  ('xpath', XPATHS["captcha_input"]))
+locators.register('login_button', ('id', 'btnLogin'), ('name', 'btnLogin'),
+                  ('xpath', "//form//input[@type='password']/following::input[@type='submit'][1]"),
+                  ('xpath', XPATHS["login_button"]))
+locators.register('login_failure', ('xpath', XPATHS["login_failure"]),
+                  ('css', "body > div > h2"))
+locators.register('login_success', *[('xpath', path) for path in XPATHS["login_success"]],
+                  ('css', "header nav ul li a span"))
+locators.register('Page1_btn', ('name', 'btnPage1'),
+                  ('xpath', POST_LOGIN_XPATHS["Page1_btn_path"]))
+locators.register('Page2_verify', ('xpath', POST_LOGIN_XPATHS["Page2_verify_path"]),
+                  ('xpath', "//form/div[4]//span"))
+locators.register('Page2_btn', ('name', 'btnPage2'),
+                  ('xpath', "//form/div[4]//ul/input[@type='submit']"),
+                  ('xpath', POST_LOGIN_XPATHS["Page2_btn_path"]))
+locators.register('Page3_btn', ('xpath', "//header//nav//ul/li[2]/a"),
+                  ('css', "header nav ul > li:nth-child(2) > a"),
+                  ('xpath', POST_LOGIN_XPATHS["Page3_btn_path"]))
+locators.register('Form_input', ('id', 'HomeContentPlaceHolder_txtValue'),
+                  ('name', 'HomeContentPlaceHolder_txtValue'),
+                  ('xpath', POST_LOGIN_XPATHS["Form_input_path"]))
+locators.register('Form_save', ('id', 'HomeContentPlaceHolder_btnSave'),
+                  ('name', 'HomeContentPlaceHolder_btnSave'),
+                  ('xpath', POST_LOGIN_XPATHS["Form_save_path"]))
+
+# Errors from clicking the login button that mean the click was never sent
+LOGIN_CLICK_NOT_SENT = (NoSuchElementException, ElementNotInteractableException,
+                        ElementClickInterceptedException)
+
+# Learned routes to the data entry form are stored per site username in db.py
+DEEP_LINK_TIMEOUT = 10  # Seconds to wait for the form after taking a shortcut
+
 # RapidAPI OCR configuration
 RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY')
-RAPIDAPI_OCR_URL = "https://ocr-extract-text.p.rapidapi.com/ocr"
+RAPIDAPI_OCR_URL = os.getenv('RAPIDAPI_OCR_URL', "https://ocr-extract-text.p.rapidapi.com/ocr")
 RAPIDAPI_HEADERS = {
     "x-rapidapi-key": RAPIDAPI_KEY,
     "x-rapidapi-host": "ocr-extract-text.p.rapidapi.com"
@@ -126,9 +189,17 @@ RAPIDAPI_HEADERS = {
 # --------------------------
 # LOGIN FUNCTIONS
 # --------------------------
-def handle_login_attempt(user_id, username, password):
-    """Main login handler with automatic retries and manual fallback"""
-    login_logger.info(f"Starting login attempt for user {user_id}")
+def _login_outcome(outcome):
+    metrics.login_outcomes.labels(outcome).inc()
+    annotate(outcome=outcome)
+
+def handle_login_attempt(user_id, username, password, prepared=None):
+    """Main login handler with automatic retries and manual fallback
+
+    `prepared` is a warmup.Warmup whose page load and CAPTCHA are reused.
+    """
+    login_logger.info("Starting login attempt for user %s", user_id, extra={'user_id': user_id})
+    annotate(site_username=username)
     clear_status(user_id)  # Clear previous status
 
     try:
@@ -136,13 +207,15 @@ def handle_login_attempt(user_id, username, password):
         driver = session['driver']
         login_logger.debug("Session and driver obtained successfully")
     except Exception as e:
-        login_logger.error(f"Failed to get session/driver: {str(e)}")
+        login_logger.error("Failed to get session/driver: %s", e)
+        _login_outcome('browser_error')
         bot_log("❌ Login failed: Could not initialize browser session",
                 user_id)
         return False
 
     if not username or not password:
-        login_logger.warning(f"Invalid credentials for user {user_id}")
+        login_logger.warning("Invalid credentials for user %s", user_id, extra={'user_id': user_id})
+        _login_outcome('invalid_input')
         bot_log("❌ Login failed: Invalid credentials", user_id)
         return False
 
@@ -151,85 +224,87 @@ def handle_login_attempt(user_id, username, password):
     bot_log("=" * 40, user_id)
 
     # Try automatic login first
-    success = automatic_login(driver, username, password, user_id)
-    login_logger.info(
-        f"Login attempt result for user {user_id}: {'success' if success else 'failed'}"
-    )
+    try:
+        success = automatic_login(driver, username, password, user_id, prepared)
+    except resilience.CircuitOpenError as e:
+        _login_outcome('site_down')
+        bot_log(f"⏸️ {e}", user_id)
+        return False
+    if success:
+        # Key the learned route to the form, and remember where login landed
+        session_manager.update_session(user_id, username=username, landing_url=driver.current_url)
+    _login_outcome('success' if success else 'failure')
+    login_logger.info("Login attempt result for user %s: %s", user_id, 'success' if success else 'failed', extra={'user_id': user_id})
     return success
 
-def automatic_login(driver, username, password, user_id=None):
+def automatic_login(driver, username, password, user_id=None, prepared=None):
     """Attempt automatic login with OCR-based CAPTCHA solving"""
     bot_log("\n📝 Starting automatic login process...", user_id)
 
     # Try automatic CAPTCHA solving first
-    for attempt in range(1):  # Limited to 1 automatic attempts
-        bot_log(f"🔄 Automatic login attempt {attempt + 1}/1", user_id)
-
-        # Refresh page for each attempt
-        driver.get(website_url)
-        time.sleep(2)
+    for attempt in range(AUTO_LOGIN_ATTEMPTS):
+        bot_log(f"🔄 Automatic login attempt {attempt + 1}/{AUTO_LOGIN_ATTEMPTS}", user_id)
+        metrics.login_attempts.labels('auto').inc()
 
-        if not enter_credentials(driver, username, password, user_id):
-            return False
-
-        captcha_text = process_captcha(driver, user_id)
-        if not captcha_text:
-            continue
+        if attempt == 0 and prepared and prepared.captcha_text:
+            # Page loaded and CAPTCHA solved while the keyboard was shown
+            if not enter_credentials(driver, username, password, user_id):
+                return False
+            captcha_text = prepared.captcha_text
+            annotate(captcha='prepared')
+        else:
+            # Load the page once, then only refresh the CAPTCHA between attempts
+            first_load = attempt == 0 and not prepared
+            if not prepare_login_form(driver, username, password, user_id, reload=first_load):
+                return False
 
-        submit_login(driver, user_id)
+            captcha_text = process_captcha(driver, user_id)
+            if not captcha_text:
+                continue
+            annotate(captcha='ocr')
 
-        # Check for invalid credentials before proceeding
-        try:
-            error_element = driver.find_elements(By.XPATH,
-                                                 XPATHS["login_failure"])
-            if error_element:
-                error_text = error_element[0].text.strip()
-                if "invalid" in error_text.lower() or "incorrect" in error_text.lower():
-                    bot_log(
-                        "❌ Login Failed: Invalid credentials. Please try again with correct username and password.",
-                        user_id)
-                    return False
-        except Exception:
-            pass
-
-        if check_login_result(driver, user_id):
-            bot_log("🎉 AUTOMATIC LOGIN SUCCESSFUL!, now try /operations",
-                    user_id)
-            return True
+        result = finish_login(driver, user_id, "AUTOMATIC")
+        if result is not None:
+            return result
 
     # If automatic attempts fail, switch to manual entry
+    metrics.manual_captcha_fallbacks.inc()
     bot_log("🔄 Switching to manual CAPTCHA entry", user_id)
     return manual_login(driver, username, password, user_id)
 
 def manual_login(driver, username, password, user_id):
     """Manual login handler"""
     bot_log("\n📝 Starting manual login process...", user_id)
+    metrics.login_attempts.labels('manual').inc()
+    annotate(captcha='manual')
 
-    # Refresh page for clean start
-    driver.get(website_url)
-    time.sleep(2)
-
-    if not enter_credentials(driver, username, password, user_id):
+    # Reuse the login page from the automatic attempts with a new CAPTCHA
+    if not prepare_login_form(driver, username, password, user_id):
         return False
 
     # Try to get captcha multiple times if needed
-    for attempt in range(3):
-        captcha_text = process_captcha_manual(driver, user_id)
-        if captcha_text:
-            break
-        time.sleep(1)
+    captcha_text = resilience.policy('manual_captcha').call(
+        process_captcha_manual, driver, user_id, until=bool)
 
     if not captcha_text:
         bot_log("❌ Failed to get captcha response from user", user_id)
         return False
 
+    return bool(finish_login(driver, user_id, "MANUAL"))
+
+def finish_login(driver, user_id, mode):
+    """Submit the filled form and check the result.
+
+    True on success, False when the site rejected the credentials, None when
+    the attempt failed otherwise (e.g. a wrong CAPTCHA) and may be retried.
+    """
     submit_login(driver, user_id)
 
     # Check for invalid credentials before proceeding
     try:
-        error_element = driver.find_elements(By.XPATH, XPATHS["login_failure"])
+        error_element = locators.locate(driver, 'login_failure')['login_failure']
         if error_element:
-            error_text = error_element[0].text.strip()
+            error_text = error_element.text.strip()
             if "invalid" in error_text.lower() or "incorrect" in error_text.lower():
                 bot_log(
                     "❌ Login Failed: Invalid credentials. Please try again with correct username and password.",
@@ -239,20 +314,96 @@ def manual_login(driver, username, password, user_id):
         pass
 
     if check_login_result(driver, user_id):
-        bot_log("🎉 MANUAL LOGIN SUCCESSFUL!, now try /operations", user_id)
+        bot_log(f"🎉 {mode} LOGIN SUCCESSFUL!, now try /operations", user_id)
         return True
-
-    return False
+    return None
 
 # --------------------------
 # LOGIN HELPER FUNCTIONS
 # --------------------------
+
+# Reloads only the CAPTCHA image of the login form and clears the CAPTCHA
+# field. Returns what is left in the credential fields after the failed attempt.
+REFRESH_CAPTCHA_JS = """
+var done = arguments[arguments.length - 1];
+var img = arguments[0], captcha = arguments[1], user = arguments[2], pass = arguments[3];
+captcha.value = '';
+var state = {username: user.value, password: pass.value !== ''};
+var base = img.getAttribute('data-base-src') || img.src;
+img.setAttribute('data-base-src', base);
+img.onload = img.onerror = function () { done(state); };
+img.src = base + (base.indexOf('?') < 0 ? '?' : '&') + '_r=' + Date.now();
+"""
+
+def prepare_login_form(driver, username, password, user_id, reload=False):
+    """Get the login form ready for an attempt.
+
+    Retries keep the loaded page and fetch a new CAPTCHA image only, entering
+    credentials again just if the site cleared them. The whole page is loaded
+    on the first attempt, or when the form is no longer there.
+    """
+    start = time.perf_counter()
+    state = None
+    if not reload:
+        try:
+            with span('captcha.refresh'):
+                form = locators.locate(driver, 'captcha_img', 'captcha_input', 'username', 'password')
+                if all(form.values()):
+                    state = driver.execute_async_script(
+                        REFRESH_CAPTCHA_JS, form['captcha_img'], form['captcha_input'],
+                        form['username'], form['password'])
+        except Exception as e:
+            login_logger.debug("CAPTCHA-only refresh failed: %s", e)
+
+    if state is None:
+        path = 'page_reload'
+        load_page(driver, website_url)
+        time.sleep(2)
+        ready = enter_credentials(driver, username, password, user_id)
+    else:
+        path = 'captcha_refresh'
+        ready = True
+        if state['username'] != username or not state['password']:
+            ready = enter_credentials(driver, username, password, user_id)
+
+    if not reload:
+        metrics.login_retry_latency.labels(path).observe(time.perf_counter() - start)
+        login_logger.debug("Login form ready for retry via %s in %.0f ms",
+                           path, (time.perf_counter() - start) * 1000)
+    return ready
+
+def page_shows(driver, expect):
+    """True if any of the registered elements in `expect` is on the page"""
+    try:
+        return any(locators.locate(driver, *expect).values())
+    except Exception as e:
+        bot_logger.debug("Page check for %s failed: %s", expect, e)
+        return False
+
+def load_page(driver, url, expect=('username',)):
+    """driver.get under the page_load retry policy and the site breaker.
+
+    driver.get does not fail on an error page (a 503, a proxy error), so the
+    load only counts as a success once one of the `expect` elements is on
+    the page: the login form by default. Raises PageNotLoadedError if none
+    shows up after the last attempt.
+    """
+    page_load = resilience.policy('page_load')
+    driver.set_page_load_timeout(page_load.attempt_timeout)
+    with span('page_load'):
+        page_load.call(driver.get, url, until=lambda _: page_shows(driver, expect))
+    if not page_shows(driver, expect):
+        raise resilience.PageNotLoadedError(f"{url} loaded without {', '.join(expect)}")
+
+@traced('enter_credentials')
 def enter_credentials(driver, username, password, user_id):
     """Enter username and password"""
     try:
         # Clear existing fields first
-        username_field = driver.find_element(By.XPATH, XPATHS["username"])
-        password_field = driver.find_element(By.XPATH, XPATHS["password"])
+        fields = locators.locate(driver, 'username', 'password')
+        username_field, password_field = fields['username'], fields['password']
+        if username_field is None or password_field is None:
+            raise NoSuchElementException("Login form not found")
         username_field.clear()
         password_field.clear()
 
@@ -265,32 +416,36 @@ def enter_credentials(driver, username, password, user_id):
         bot_log(f"❌ Error entering credentials: {str(e)}", user_id)
         return False
 
+@traced('captcha.auto')
 def process_captcha(driver, user_id):
     """Automatic captcha processing using RapidAPI OCR with direct URL"""
     try:
-        captcha_element = driver.find_element(By.XPATH, XPATHS["captcha_img"])
+        captcha_element = locators.find(driver, 'captcha_img')
         captcha_url = captcha_element.get_attribute("src")
         
         # Use the CAPTCHA URL directly in the RapidAPI request
         querystring = {"url": captcha_url}
         
         try:
-            ocr_response = requests.get(RAPIDAPI_OCR_URL, headers=RAPIDAPI_HEADERS, params=querystring)
+            with span('ocr'), metrics.ocr_latency.time():
+                ocr_response = requests.get(RAPIDAPI_OCR_URL, headers=RAPIDAPI_HEADERS, params=querystring)
             if ocr_response.status_code == 200:
                 data = ocr_response.json()
                 captcha_text = data.get("text", "").replace(" ", "").strip()
                 bot_log(f"🔍 Recognized Captcha: {captcha_text}", user_id)
                 
                 if captcha_text:
-                    captcha_input = driver.find_element(By.XPATH, XPATHS["captcha_input"])
-                    captcha_input.clear()
-                    captcha_input.send_keys(captcha_text)
+                    metrics.ocr_results.labels('recognized').inc()
+                    fill_captcha(driver, captcha_text)
                     return captcha_text
                 else:
+                    metrics.ocr_results.labels('empty').inc()
                     bot_log("❌ No text recognized from CAPTCHA", user_id)
             else:
+                metrics.ocr_results.labels('http_error').inc()
                 bot_log(f"❌ OCR API error: {ocr_response.status_code}", user_id)
         except Exception as api_error:
+            metrics.ocr_results.labels('exception').inc()
             bot_log(f"❌ OCR API request failed: {str(api_error)}", user_id)
         
         return None
@@ -298,11 +453,16 @@ def process_captcha(driver, user_id):
         bot_log(f"❌ Captcha processing failed: {str(e)}", user_id)
         return None
 
-def process_captcha_manual(driver, user_id):
-    """Manual captcha handling"""
+def fill_captcha(driver, captcha_text):
+    captcha_input = locators.find(driver, 'captcha_input')
+    captcha_input.clear()
+    captcha_input.send_keys(captcha_text)
+
+def send_manual_captcha(driver, user_id):
+    """Download the CAPTCHA image and send it to the user; False on failure"""
     try:
         # Get and save captcha
-        captcha_element = driver.find_element(By.XPATH, XPATHS["captcha_img"])
+        captcha_element = locators.find(driver, 'captcha_img')
         captcha_url = captcha_element.get_attribute("src")
         response = requests.get(captcha_url)
         captcha_path = "captcha_manual.png"
@@ -313,55 +473,69 @@ def process_captcha_manual(driver, user_id):
 
         if not os.path.exists(captcha_path):
             bot_log("❌ Failed to save captcha image", user_id)
-            return None
-
-        # Send captcha image to bot and wait for response
-        try:
-            bot_send_image(
-                captcha_path,
-                "📝 Please enter the captcha text shown in the image:", user_id)
-            captcha_text = bot_input("Type the captcha text:", user_id)
-
-            if captcha_text:
-                captcha_input = driver.find_element(By.XPATH,
-                                                    XPATHS["captcha_input"])
-                captcha_input.clear()
-                captcha_input.send_keys(captcha_text)
-                return captcha_text
-        except Exception as e:
-            bot_log(f"❌ Error in bot communication: {str(e)}", user_id)
+            return False
 
-        return None
+        bot_send_image(
+            captcha_path,
+            "📝 Please enter the captcha text shown in the image:", user_id)
+        return True
     except Exception as e:
         bot_log(f"❌ Manual captcha failed: {str(e)}", user_id)
+        return False
+
+@traced('captcha.manual')
+def process_captcha_manual(driver, user_id):
+    """Manual captcha handling"""
+    if not send_manual_captcha(driver, user_id):
         return None
 
+    # Wait for the user's response
+    try:
+        captcha_text = bot_input("Type the captcha text:", user_id)
+
+        if captcha_text:
+            fill_captcha(driver, captcha_text)
+            return captcha_text
+    except Exception as e:
+        bot_log(f"❌ Error in bot communication: {str(e)}", user_id)
+
+    return None
+
+@traced('submit_login')
 def submit_login(driver, user_id):
     """Click login button"""
     try:
-        driver.find_element(By.XPATH, XPATHS["login_button"]).click()
+        # Only retry errors that show the click never happened: a second click
+        # after one that went through would submit the login twice. A missing
+        # or covered button is not the site being down either.
+        resilience.policy('submit_login').call(
+            lambda: locators.find(driver, 'login_button').click(),
+            retry_on=LOGIN_CLICK_NOT_SENT, local_errors=LOGIN_CLICK_NOT_SENT)
         bot_log("🔄 Submitting login...", user_id)
         time.sleep(5)
-    except Exception as e:
+    except resilience.CircuitOpenError:
+        raise
+    except LOGIN_CLICK_NOT_SENT as e:
         bot_log(f"❌ Login submission failed: {str(e)}", user_id)
+    except Exception as e:
+        # The click may have been sent (e.g. the next page timed out): check_login_result decides
+        login_logger.warning("Login submission for user %s ended with an error: %s", user_id, e,
+                             extra={'user_id': user_id})
 
+@traced('check_login_result')
 def check_login_result(driver, user_id):
     """Check login success/failure with simple text content logging"""
     try:
-        error_element = driver.find_elements(By.XPATH, XPATHS["login_failure"])
-        if error_element:
-            error_text = error_element[0].text.strip()
+        # Failure banner and success marker in one lookup
+        found = locators.locate(driver, 'login_failure', 'login_success')
+        if found['login_failure']:
+            error_text = found['login_failure'].text.strip()
             bot_log(f"❌ Login Failed: {error_text}", user_id)
             return False
 
-        bot_log("\nChecking success elements:", user_id)
-        for path in XPATHS["login_success"]:
-            elements = driver.find_elements(By.XPATH, path)
-            if elements:
-                bot_log(f"✅ Found: {elements[0].text.strip()}", user_id)
-                return True
-            else:
-                bot_log(f"❌ Element not found", user_id)
+        if found['login_success']:
+            bot_log(f"✅ Found: {found['login_success'].text.strip()}", user_id)
+            return True
 
         bot_log("⚠️ Unknown login status - no success elements found", user_id)
         return False
@@ -372,84 +546,267 @@ def check_login_result(driver, user_id):
 # --------------------------
 # POST-LOGIN OPERATIONS
 # --------------------------
-def post_login_click_button(driver, button_element, user_id):
-    """Attempts to click a button using multiple methods"""
+def _click_javascript(driver, button_element):
+    driver.execute_script("arguments[0].click();", button_element)
+
+def _click_action_chains(driver, button_element):
+    ActionChains(driver).move_to_element(button_element).click().perform()
+
+def _click_forced_visibility(driver, button_element):
+    driver.execute_script(
+        """
+        arguments[0].style.opacity = '1'; 
+        arguments[0].style.display = 'block';
+        arguments[0].style.visibility = 'visible';
+    """, button_element)
+    button_element.click()
+
+# Click strategies in default order, with the wording used in status messages
+CLICK_STRATEGIES = {
+    'javascript': (_click_javascript, "using JavaScript", "JavaScript click"),
+    'action_chains': (_click_action_chains, "using Action Chains", "Action Chains click"),
+    'forced_visibility': (_click_forced_visibility, "after forcing visibility", "Forced visibility click"),
+}
+
+# Strategy that last worked per (page path, button locator)
+click_strategy_cache = {}
+
+def post_login_click_button(driver, button_element, user_id, locator=None):
+    """Attempts to click a button using multiple methods.
+
+    The method that worked last time for this button on this page is tried
+    first, so a known button normally takes a single WebDriver round trip.
+    `locator` is the registered name the button was found by.
+    """
     button_text = button_element.text.strip() or button_element.get_attribute(
         'value')
+    key = (urlparse(driver.current_url).path, locator or button_text)
+    remembered = click_strategy_cache.get(key)
+    order = sorted(CLICK_STRATEGIES, key=lambda name: name != remembered)
 
-    try:
-        driver.execute_script("arguments[0].click();", button_element)
-        bot_log(f"✅ hit '{button_text}' using JavaScript", user_id)
+    for name in order:
+        click, success_text, failure_text = CLICK_STRATEGIES[name]
+        start = time.perf_counter()
+        try:
+            click(driver, button_element)
+        except Exception as e:
+            metrics.click_latency.labels(name).observe(time.perf_counter() - start)
+            metrics.click_results.labels(name, 'failure').inc()
+            bot_log(f"❌ {failure_text} failed for '{button_text}': {str(e)}",
+                    user_id)
+            continue
+        metrics.click_latency.labels(name).observe(time.perf_counter() - start)
+        metrics.click_results.labels(name, 'success').inc()
+        click_strategy_cache[key] = name
+        bot_log(f"✅ hit '{button_text}' {success_text}", user_id)
         return True
-    except Exception as e:
-        bot_log(f"❌ JavaScript click failed for '{button_text}': {str(e)}",
-                user_id)
 
+    click_strategy_cache.pop(key, None)
+    return False
+
+def click_step(driver, name, user_id, verify=None):
+    """Find a registered button (and the section it must be on) and click it"""
+    names = (verify, name) if verify else (name,)
+    found = locators.locate(driver, *names)
+    if verify:
+        if found[verify] is None:
+            raise NoSuchElementException(f"{verify} not found")
+        bot_log(f"📋 Found section: {found[verify].text.strip()}", user_id)
+    button = found[name]
+    if button is None:
+        raise NoSuchElementException(f"{name} not found")
+    button_text = button.text.strip() or button.get_attribute('value')
+    bot_log(f"🖱️ Found button: {button_text}", user_id)
+    if not post_login_click_button(driver, button, user_id, name):
+        raise Exception(f"Failed to click '{button_text}' button")
+
+# Every input on the page as [id, value, readonly, label text], in one round trip
+EXTRACT_FORM_JS = """
+var inputs = document.getElementsByTagName('input'), out = [];
+for (var i = 0; i < inputs.length; i++) {
+    var el = inputs[i], id = el.id || '', label = null;
+    if (id) {
+        var labels = document.getElementsByTagName('label');
+        for (var j = 0; j < labels.length; j++) {
+            if (labels[j].htmlFor === id) { label = labels[j].innerText; break; }
+        }
+    }
+    out.push([id, el.value, el.readOnly, label]);
+}
+return out;
+"""
+
+# Inputs that are page plumbing rather than form data
+SKIPPED_FIELD_PARTS = ("event", "viewstate", "scroll", "validation",
+                       "clientstate", "hidden", "logout", "pwchange")
+
+@traced('ops.extract_form')
+def extract_form_data(driver, user_id, site_username=None):
+    """Report the data entry form in one message.
+
+    The first time for a site username the whole form is sent; after that
+    only the fields that changed since the stored snapshot.
+    """
     try:
-        from selenium.webdriver.common.action_chains import ActionChains
-        actions = ActionChains(driver)
-        actions.move_to_element(button_element).click().perform()
-        bot_log(f"✅ hit '{button_text}' using Action Chains", user_id)
-        return True
+        fields = {}
+        lines = {}
+        for field_id, value, readonly, label in driver.execute_script(EXTRACT_FORM_JS):
+            if any(part in field_id.lower() for part in SKIPPED_FIELD_PARTS):
+                continue
+            label = (label or field_id).replace("HomeContentPlaceHolder_txt", "")
+            fields[field_id] = value
+            lines[field_id] = ("🔒" if readonly else "✏️", label)
+
+        previous = None
+        if site_username:
+            try:
+                previous = get_form_snapshot(site_username)
+            except Exception as e:
+                bot_logger.debug("Failed to load form snapshot for %s: %s", site_username, e)
+
+        if previous is None:
+            report = "\n".join(f"{icon} {label}: {fields[field_id]}"
+                                for field_id, (icon, label) in lines.items())
+            bot_log(f"{'FORM INFORMATION'.center(40)}\n\n📝 Form Data:\n{report}", user_id)
+        else:
+            changes = [f"{icon} {label}: {previous.get(field_id, '—')} → {fields[field_id]}"
+                       for field_id, (icon, label) in lines.items()
+                       if previous.get(field_id) != fields[field_id]]
+            changes += [f"🗑️ {field_id}: removed" for field_id in previous if field_id not in fields]
+            if changes:
+                bot_log("📝 Form changes since the last run:\n" + "\n".join(changes), user_id)
+            else:
+                bot_log(f"📝 Form unchanged since the last run ({len(fields)} fields)", user_id)
+
+        if site_username and fields != previous:
+            try:
+                save_form_snapshot(site_username, fields)
+            except Exception as e:
+                bot_logger.debug("Failed to store form snapshot for %s: %s", site_username, e)
+
     except Exception as e:
-        bot_log(f"❌ Action Chains click failed for '{button_text}': {str(e)}",
-                user_id)
+        bot_log(f"❌ Error extracting form information: {str(e)}", user_id)
 
+def form_ready(driver):
+    """True if the data entry form's input and save button are on the page"""
+    return all(locators.locate(driver, 'Form_input', 'Form_save').values())
+
+def learn_form_route(driver, site_username, landing_url):
+    """Remember how the click path reached the form, for this site username.
+
+    A form with its own URL is opened directly next time. When the form is
+    reached by postback on the same URL, the route replays only the last
+    postback (the Data Entry link in the header, present on every page).
+    """
+    if not site_username or not form_ready(driver):
+        return
+    form_url = driver.current_url
+    if form_url != landing_url:
+        route = {'url': form_url}
+    else:
+        route = {'postback': 'Page3_btn'}
     try:
-        driver.execute_script(
-            """
-            arguments[0].style.opacity = '1'; 
-            arguments[0].style.display = 'block';
-            arguments[0].style.visibility = 'visible';
-        """, button_element)
-        button_element.click()
-        bot_log(f"✅ hit '{button_text}' after forcing visibility", user_id)
-        return True
+        save_form_route(site_username, route)
     except Exception as e:
-        bot_log(
-            f"❌ Forced visibility click failed for '{button_text}': {str(e)}",
-            user_id)
+        bot_logger.debug("Failed to save route to the form for %s: %s", site_username, e)
+        return
+    bot_logger.debug("Learned route to the form for %s: %s", site_username, route)
 
-    return False
-
-def extract_form_data(driver, user_id):
-    """Extracts and prints relevant information from the data entry form dynamically."""
+def load_form_route(site_username):
+    """The stored route to the form for a site username; None if unknown or unreadable"""
+    if not site_username:
+        return None
     try:
-        bot_log("\n" + "=" * 40, user_id)
-        bot_log("FORM INFORMATION".center(40), user_id)
-        bot_log("=" * 40, user_id)
-
-        bot_log("\n📝 Form Data:", user_id)
-
-        input_elements = driver.find_elements(By.TAG_NAME, "input")
-
-        for element in input_elements:
-            field_id = element.get_attribute('id')
-            value = element.get_attribute('value')
-            readonly = element.get_attribute('readonly')
-            label_elements = driver.find_elements(
-                By.XPATH, f"//label[@for='{field_id}']")
-            label = label_elements[0].text if label_elements else field_id
-
-            if any(substring in field_id.lower() for substring in [
-                    "event", "viewstate", "scroll", "validation",
-                    "clientstate", "hidden", "logout", "pwchange"
-            ]):
-                continue
-
-            label = label.replace("HomeContentPlaceHolder_txt", "")
+        return get_form_route(site_username)
+    except Exception as e:
+        bot_logger.debug("Failed to load route to the form for %s: %s", site_username, e)
+        return None
 
-            status = "🔒" if readonly else "✏️"
-            bot_log(f"{status} {label}: {value}", user_id)
+def forget_form_route(site_username):
+    try:
+        save_form_route(site_username, None)
+    except Exception as e:
+        bot_logger.debug("Failed to forget route to the form for %s: %s", site_username, e)
 
+@traced('ops.deep_link')
+def follow_form_route(driver, route, user_id):
+    """Go straight to the form along a learned route; False if it is not there"""
+    try:
+        if 'url' in route:
+            load_page(driver, route['url'], expect=('Form_save',))
+        else:
+            link = locators.find(driver, route['postback'])
+            if not post_login_click_button(driver, link, user_id, route['postback']):
+                return False
+            # Wait for the postback to replace the page before looking for the form
+            WebDriverWait(driver, DEEP_LINK_TIMEOUT).until(EC.staleness_of(link))
+        locators.wait_for(driver, 'Form_save', DEEP_LINK_TIMEOUT)
+        return form_ready(driver)
+    except resilience.CircuitOpenError:
+        raise
     except Exception as e:
-        bot_log(f"❌ Error extracting form information: {str(e)}", user_id)
+        bot_logger.debug("Learned route to the form failed: %s", e)
+        return False
 
 def post_login_operations(user_id):
     """Execute actions after successful login"""
+    form = open_form(user_id)
+    if isinstance(form, bool):
+        result = form
+    else:
+        input_value = saved_form_value(user_id, form[3])
+        if input_value is None:
+            bot_log("📝 Please enter the value:", user_id)
+            with span('ops.wait_input'):
+                input_value = bot_input("Enter value:", user_id)
+        result = save_form_value(form, input_value, user_id)
+    annotate(outcome='success' if result else 'failure')
+    return result
+
+FORM_VALUE_HELP = ("It can use {date} (dd/mm/yyyy), {day}, {month}, {year} and {username}. "
+                   "Send - to be asked on every run instead.")
+
+def render_form_value(template, site_username=None):
+    """Fill a saved form value's placeholders: {date} (dd/mm/yyyy), {day}, {month}, {year}, {username}.
+
+    Raises ValueError for an unknown placeholder or unbalanced braces.
+    """
+    today = date.today()
+    fields = {'date': today.strftime('%d/%m/%Y'), 'day': f"{today.day:02d}",
+              'month': f"{today.month:02d}", 'year': str(today.year), 'username': site_username or ''}
+    try:
+        return template.format_map(fields)
+    except KeyError as e:
+        raise ValueError(f"Unknown placeholder {e} in {template!r}") from e
+    except (AttributeError, IndexError, ValueError) as e:
+        raise ValueError(f"Invalid value template {template!r}: {e}") from e
+
+def saved_form_value(user_id, site_username):
+    """The credential's saved form value, filled in; None when the user should be asked."""
+    if not site_username:
+        return None
+    credential = get_credential_by_username(str(user_id), site_username)
+    template = credential.get('form_value') if credential else None
+    if not template:
+        return None
+    try:
+        value = render_form_value(template, site_username)
+    except ValueError as e:
+        bot_log(f"⚠️ {e}, asking for the value instead", user_id)
+        return None
+    bot_log(f"📝 Using the saved value: {value}", user_id)
+    return value
+
+def open_form(user_id):
+    """Navigate to the data entry form and show its contents.
+
+    Returns (driver, input_field, save_button, site_username) when the form wants a value,
+    otherwise the result of the run (True or False).
+    """
     clear_status(user_id)  # Clear previous status
     session = session_manager.get_session(user_id)
     driver = session['driver']
+    annotate(site_username=session.get('username'))
     bot_log("\n" + "=" * 40, user_id)
     bot_log("POST-LOGIN OPERATIONS".center(40), user_id)
     bot_log("=" * 40, user_id)
@@ -460,74 +817,50 @@ def post_login_operations(user_id):
             if os.path.exists(file):
                 os.remove(file)
 
-        # Page 1: Initial button
-        Page1_btn = driver.find_element(By.XPATH,
-                                        POST_LOGIN_XPATHS["Page1_btn_path"])
-        button_text = Page1_btn.text.strip() or Page1_btn.get_attribute(
-            'value')
-        bot_log(f"🖱️ Found button: {button_text}", user_id)
-        if not post_login_click_button(driver, Page1_btn, user_id):
-            raise Exception(f"Failed to click '{button_text}' button")
-        time.sleep(2)
-
-        # Page 2: Verification and next button
-        Page2_verify = driver.find_element(
-            By.XPATH, POST_LOGIN_XPATHS["Page2_verify_path"])
-        verify_text = Page2_verify.text.strip()
-        bot_log(f"📋 Found section: {verify_text}", user_id)
-
-        Page2_btn = driver.find_element(By.XPATH,
-                                        POST_LOGIN_XPATHS["Page2_btn_path"])
-        button_text = Page2_btn.text.strip() or Page2_btn.get_attribute(
-            'value')
-        bot_log(f"🖱️ Found button: {button_text}", user_id)
-        if not post_login_click_button(driver, Page2_btn, user_id):
-            raise Exception(f"Failed to click '{button_text}' button")
-        time.sleep(2)
-
-        # Page 3: Final button
-        Page3_btn = driver.find_element(By.XPATH,
-                                        POST_LOGIN_XPATHS["Page3_btn_path"])
-        button_text = Page3_btn.text.strip() or Page3_btn.get_attribute(
-            'value')
-        bot_log(f"🖱️ Found button: {button_text}", user_id)
-        if not post_login_click_button(driver, Page3_btn, user_id):
-            raise Exception(f"Failed to click '{button_text}' button")
-        time.sleep(2)
+        route = load_form_route(session.get('username'))
+        if route and not follow_form_route(driver, route, user_id):
+            bot_log("↩️ Shortcut to the form failed, using full navigation", user_id)
+            forget_form_route(session.get('username'))
+            if locators.locate(driver, 'Page1_btn')['Page1_btn'] is None:
+                # Landing page, or the login form if the site session expired
+                load_page(driver, session.get('landing_url') or website_url,
+                          expect=('Page1_btn', 'username'))
+            route = None
+        if not route:
+            landing_url = driver.current_url
+            # Page 1: Initial button
+            with span('ops.page1'):
+                resilience.policy('click').call(click_step, driver, 'Page1_btn', user_id)
+                time.sleep(2)
+
+            # Page 2: Verification and next button
+            with span('ops.page2'):
+                resilience.policy('click').call(click_step, driver, 'Page2_btn', user_id,
+                                                verify='Page2_verify')
+                time.sleep(2)
+
+            # Page 3: Final button
+            with span('ops.page3'):
+                resilience.policy('click').call(click_step, driver, 'Page3_btn', user_id)
+                time.sleep(2)
+            learn_form_route(driver, session.get('username'), landing_url)
 
         # Extract and display form data
-        extract_form_data(driver, user_id)
+        extract_form_data(driver, user_id, session.get('username'))
 
-        # Handle input field and save
+        # Find the input field and save button
         try:
-            input_field = driver.find_element(
-                By.XPATH,
-                "/html/body/form/div[4]/div/div/div/div/div/div/div[2]/div/div/div[15]/input"
-            )
-            save_button = driver.find_element(
-                By.XPATH,
-                "/html/body/form/div[4]/div/div/div/div/div/div/div[2]/div/div/div[19]/input"
-            )
+            fields = locators.locate(driver, 'Form_input', 'Form_save')
+            input_field, save_button = fields['Form_input'], fields['Form_save']
+            if input_field is None or save_button is None:
+                raise NoSuchElementException("Data entry form not found")
 
             if input_field.is_displayed() and save_button.is_displayed():
-                bot_log("📝 Please enter the value:", user_id)
-                input_value = bot_input("Enter value:", user_id)
-                if input_value:
-                    input_field.clear()
-                    input_field.send_keys(input_value)
-                    if not post_login_click_button(driver, save_button,
-                                                   user_id):
-                        raise Exception("Failed to click save button")
-                    bot_log("✅ Value saved successfully!", user_id)
-                    return True
-                else:
-                    bot_log("⚠️ No value entered", user_id)
-                    return False
-            else:
-                bot_log(
-                    "ℹ️ Form elements not visible. Data might have been saved already.",
-                    user_id)
-                return True
+                return driver, input_field, save_button, session.get('username')
+            bot_log(
+                "ℹ️ Form elements not visible. Data might have been saved already.",
+                user_id)
+            return True
 
         except NoSuchElementException:
             bot_log(
@@ -538,6 +871,47 @@ def post_login_operations(user_id):
             bot_log(f"❌ Error handling form: {str(e)}", user_id)
             return False
 
+    except resilience.CircuitOpenError as e:
+        bot_log(f"⏸️ {e}", user_id)
+        return False
     except Exception as e:
         bot_log(f"❌ Error during post-login operations: {str(e)}", user_id)
         return False
+
+def save_form_value(form, input_value, user_id):
+    """Enter the user's value into the form from open_form and save it.
+
+    The save postback is skipped when the field already holds the value.
+    """
+    driver, input_field, save_button, site_username = form
+    if not input_value:
+        bot_log("⚠️ No value entered", user_id)
+        return False
+    try:
+        with span('ops.save'):
+            input_id, current = driver.execute_script(
+                "return [arguments[0].id, arguments[0].value];", input_field)
+            if current == input_value:
+                metrics.form_saves.labels('unchanged').inc()
+                bot_log("✅ Value saved already, nothing to change.", user_id)
+                return True
+            input_field.clear()
+            input_field.send_keys(input_value)
+            if not post_login_click_button(driver, save_button, user_id, 'Form_save'):
+                raise Exception("Failed to click save button")
+        metrics.form_saves.labels('saved').inc()
+        bot_log("✅ Value saved successfully!", user_id)
+    except Exception as e:
+        bot_log(f"❌ Error handling form: {str(e)}", user_id)
+        return False
+
+    # Keep the snapshot in step, so the next run does not report our own save
+    if site_username:
+        try:
+            snapshot = get_form_snapshot(site_username)
+            if snapshot is not None and input_id in snapshot:
+                snapshot[input_id] = input_value
+                save_form_snapshot(site_username, snapshot)
+        except Exception as e:
+            bot_logger.debug("Failed to update form snapshot for %s: %s", site_username, e)
+    return True
@@ -0,0 +1,541 @@
+"""Commands, menus and flows shared by the threaded (bot.py) and asyncio (async_bot.py) runtimes.
+
+Everything here blocks. Handlers take the update and the bot, the way
+telebot's pass_bot=True calls them: bot.py registers them as they are and
+they run on telebot's worker threads, async_bot.py runs them with
+asyncio.to_thread and its SyncBot. Each runtime keeps only its own glue:
+handing a reply to a waiting prompt, waiting for a browser slot and
+driving the login and operations runs.
+"""
+import io
+import time
+import ds
+import admission
+import credentials_io
+import history
+import profiling
+import resilience
+import tracing
+import warmup
+from session_manager_headless import session_manager
+from user_state import user_store
+from keyboards import (
+    create_credentials_keyboard,
+    create_remove_credentials_keyboard,
+    create_form_value_keyboard,
+    create_settings_keyboard,
+    create_cancel_keyboard
+)
+from db import (
+    save_user_credentials,
+    add_user_credentials,
+    get_user_credentials,
+    get_user_usernames,
+    get_credential_by_username,
+    remove_user_credential,
+    remove_all_user_credentials,
+    set_form_value,
+    get_recent_runs,
+    aggregate_runs,
+    MAX_CREDENTIALS
+)
+from logger import (
+    bot_logger, user_interaction_logger,
+    BOT_OWNER_ID, MAX_LOG_LINES, tail_log, query_logs, parse_log_filters
+)
+
+BUSY_TEXT = "⚠️ Session is already active. Please wait for the current operation to complete or use /logout to reset."
+NO_CREDENTIALS_TEXT = "❌ No saved credentials found. Use the menu below to add your credentials:"
+LOGIN_FIRST_TEXT = "⚠️ Please login first to perform operations."
+OWNER_ONLY_TEXT = "⚠️ This command is only available to the bot owner."
+INPUT_RECEIVED_TEXT = "✅ CAPTCHA received!"
+NOT_ADMITTED_TEXT = "⌛ No browser became free in time. Please try again later."
+
+# User state tracking (credential entry flow), stored in the per-user context
+user_states = user_store.field('state')
+
+# --------------------------
+# MESSAGES
+# --------------------------
+def reply(bot, user_id, text, **kwargs):
+    """Send a message and remember it as the user's last bot message."""
+    sent_msg = bot.send_message(user_id, text, **kwargs)
+    ds.last_message_id[user_id] = sent_msg.message_id
+    user_interaction_logger.info("Bot to %s: %s", user_id, text, extra={'user_id': user_id})
+    return sent_msg
+
+def delete_message(bot, user_id, message_id):
+    try:
+        bot.delete_message(user_id, message_id)
+    except Exception:
+        pass  # Ignore if message already deleted
+
+def clear_status(bot, user_id):
+    """Delete the user's last bot message, as ds.clear_status does."""
+    message_id = ds.last_message_id.pop(user_id, None)
+    if message_id is not None:
+        delete_message(bot, user_id, message_id)
+
+def show_menu(bot, user_id, text, reply_markup=None, message_id=None):
+    """Show a menu step by editing a bot message in place instead of resending it.
+
+    message_id is the message to edit (for a tap, the tapped one) and defaults
+    to the user's last bot message. A new message is sent only when there is
+    none or it cannot be edited. Another status message left over is cleared,
+    as ds.clear_status does.
+    """
+    previous = ds.last_message_id.get(user_id)
+    message_id = message_id or previous
+    try:
+        if message_id is None:
+            raise LookupError("No message to edit")
+        bot.edit_message_text(text, user_id, message_id, reply_markup=reply_markup)
+    except Exception as e:
+        if 'message is not modified' not in str(e):
+            bot_logger.debug("Menu message for %s not edited, sending a new one: %s", user_id, e, extra={'user_id': user_id})
+            if message_id is not None:
+                delete_message(bot, user_id, message_id)
+            message_id = bot.send_message(user_id, text, reply_markup=reply_markup).message_id
+    if previous is not None and previous != message_id:
+        delete_message(bot, user_id, previous)
+    ds.last_message_id[user_id] = message_id
+    user_interaction_logger.info("Bot to %s: %s", user_id, text, extra={'user_id': user_id})
+
+def _command(message):
+    """Log a command and return the chat it came from."""
+    user_id = message.chat.id
+    user_interaction_logger.info("User %s sent %s", user_id, message.text, extra={'user_id': user_id})
+    return user_id
+
+def _owner_only(bot, user_id):
+    """True for the bot owner; anyone else is told the command is not theirs."""
+    if user_id == BOT_OWNER_ID:
+        return True
+    reply(bot, user_id, OWNER_ONLY_TEXT)
+    return False
+
+# --------------------------
+# COMMANDS
+# --------------------------
+def start(message, bot):
+    user_id = _command(message)
+    if session_manager.is_user_busy(user_id):
+        reply(bot, user_id, BUSY_TEXT)
+        return
+
+    clear_status(bot, user_id)
+    ds.set_bot_instance(bot, user_id)
+    session_manager.get_session(user_id)
+    reply(bot, user_id, '👋 Welcome! I\'m ready to help you. Use /login to begin or /settings to manage your credentials.')
+
+def login(message, bot):
+    user_id = _command(message)
+    if session_manager.is_user_busy(user_id):
+        reply(bot, user_id, BUSY_TEXT)
+        return
+
+    if not session_manager.can_attempt_login(user_id):
+        reply(bot, user_id, "⚠️ Please wait 5 seconds before attempting to login again.")
+        return
+
+    # The keyboard is empty when there are no credentials (memoized, no database read)
+    keyboard = create_credentials_keyboard(user_id)
+    usernames = keyboard.keyboard[:-1]  # A row per username, then Cancel
+    user_interaction_logger.info("Found %s credentials for user %s", len(usernames), user_id, extra={'user_id': user_id})
+    if not usernames:
+        reply(bot, user_id, NO_CREDENTIALS_TEXT, reply_markup=create_settings_keyboard())
+        return
+
+    reply(bot, user_id, "Select a username to login:", reply_markup=keyboard)
+    # Start Chrome, load the page and solve the CAPTCHA while the user picks
+    warmup.start(user_id)
+
+def settings(message, bot):
+    user_id = _command(message)
+    reply(bot, user_id, "Credential Management Settings:", reply_markup=create_settings_keyboard())
+
+def logout(message, bot):
+    user_id = _command(message)
+    clear_status(bot, user_id)
+    admission.controller.cancel(user_id)
+    warmup.cancel(user_id)
+    session_manager.close_session(user_id)
+    reply(bot, user_id, '👋 Logged out successfully.')
+
+def logs(message, bot):
+    user_id = _command(message)
+    if not _owner_only(bot, user_id):
+        return
+
+    try:
+        # Optional filters: /logs user=<id> logger=<name> level=<LEVEL> since=<30m|2h|1d> lines=<n>
+        filters = parse_log_filters(message.text or '')
+        if filters:
+            content = query_logs(**filters)
+            caption = "📋 Here are the matching logs."
+        else:
+            content = tail_log(MAX_LOG_LINES)
+            caption = "📋 Here are the latest logs."
+
+        if not content:
+            reply(bot, user_id, "ℹ️ No log lines match these filters.")
+            return
+
+        # Send the log excerpt as a document
+        document = io.BytesIO(content.encode('utf-8'))
+        document.name = 'debug.txt'
+        sent_msg = bot.send_document(user_id, document, caption=caption)
+        ds.last_message_id[user_id] = sent_msg.message_id
+        user_interaction_logger.info("Bot to %s: Sent log file", user_id, extra={'user_id': user_id})
+    except Exception as e:
+        user_interaction_logger.error("Error sending logs to owner: %s", e)
+        reply(bot, user_id, f"❌ Error sending logs: {str(e)}")
+
+def traces(message, bot):
+    user_id = _command(message)
+    if not _owner_only(bot, user_id):
+        return
+
+    # Optional window in minutes: /traces 30
+    args = (message.text or '').split()
+    minutes = int(args[1]) if len(args) > 1 and args[1].isdigit() else 60
+    report = tracing.format_percentiles(minutes * 60)
+    sent_msg = bot.send_message(user_id, f"<pre>{report}</pre>", parse_mode='HTML')
+    ds.last_message_id[user_id] = sent_msg.message_id
+    user_interaction_logger.info("Bot to %s: Sent stage latency report", user_id, extra={'user_id': user_id})
+
+def run_history(message, bot):
+    user_id = _command(message)
+    # Owner only: /history stats [hours] for success rate, median and OCR hit rate per kind
+    args = (message.text or '').split()[1:]
+    try:
+        if args[:1] == ['stats'] and user_id == BOT_OWNER_ID:
+            hours = int(args[1]) if len(args) > 1 and args[1].isdigit() else 24
+            report = history.format_stats(aggregate_runs(time.time() - hours * 3600), hours)
+            sent_msg = bot.send_message(user_id, f"<pre>{report}</pre>", parse_mode='HTML')
+        else:
+            sent_msg = bot.send_message(user_id, history.format_recent(get_recent_runs(str(user_id))))
+        ds.last_message_id[user_id] = sent_msg.message_id
+        user_interaction_logger.info("Bot to %s: Sent run history", user_id, extra={'user_id': user_id})
+    except Exception as e:
+        bot_logger.error("Error reading run history for user %s: %s", user_id, e, extra={'user_id': user_id})
+        reply(bot, user_id, f"❌ Error reading run history: {str(e)}")
+
+def profile(message, bot):
+    user_id = _command(message)
+    if not _owner_only(bot, user_id):
+        return
+
+    # /profile [runs] [user=<id>] [mode=cpu|sample], /profile off, or /profile for status
+    args = (message.text or '').split()[1:]
+    try:
+        if args == ['off']:
+            profiling.disarm()
+        elif args:
+            runs, target, mode = 1, None, 'cpu'
+            for arg in args:
+                key, sep, value = arg.partition('=')
+                if not sep and key.isdigit():
+                    runs = int(key)
+                elif key == 'user' and value:
+                    target = value
+                elif key == 'mode' and value:
+                    mode = value
+                else:
+                    raise ValueError(f"Invalid argument: {arg}")
+            profiling.arm(runs, target, mode)
+        text = f"🔬 {profiling.status()}"
+    except ValueError as e:
+        text = f"❌ {e}"
+    reply(bot, user_id, text)
+
+# --------------------------
+# LOGIN AND OPERATIONS
+# --------------------------
+def site_available(bot, user_id):
+    """Turn a run away before it starts Chrome while the site breaker is open."""
+    try:
+        resilience.site_breaker.check(claim=False)
+        return True
+    except resilience.CircuitOpenError as e:
+        clear_status(bot, user_id)
+        reply(bot, user_id, f"⏸️ {e}")
+        return False
+
+def queue_position_text(position, eta):
+    return (f"⏳ All browsers are busy. You are number {position} in the queue, "
+            f"about {admission.format_eta(eta)} to go.")
+
+def begin_operations(message, bot):
+    """Checks for /operations. True once the user is marked busy and the run may queue for a slot."""
+    user_id = _command(message)
+
+    # Check if user has a live session (a speculative login page is not one)
+    if (user_id not in session_manager.sessions or not session_manager.sessions[user_id].get('driver')
+            or warmup.active(user_id) or not session_manager.validate(user_id)):
+        keyboard = create_credentials_keyboard(user_id)
+        if not keyboard.keyboard:
+            reply(bot, user_id, NO_CREDENTIALS_TEXT, reply_markup=create_settings_keyboard())
+        else:
+            reply(bot, user_id, LOGIN_FIRST_TEXT, reply_markup=keyboard)
+        return False
+
+    if session_manager.is_user_busy(user_id):
+        reply(bot, user_id, BUSY_TEXT)
+        return False
+
+    if not site_available(bot, user_id):
+        return False
+
+    clear_status(bot, user_id)
+    ds.set_bot_instance(bot, user_id)
+    session_manager.set_user_busy(user_id, True)
+    return True
+
+def operations_failed(bot, user_id, error):
+    bot_logger.error("Error during operations for user %s: %s", user_id, error, extra={'user_id': user_id})
+    reply(bot, user_id, LOGIN_FIRST_TEXT)
+
+def begin_login(call, bot):
+    """Checks for a tapped username. Its credentials once the user is marked busy, else None."""
+    user_id = call.message.chat.id
+    username = call.data[6:]  # After the 'login:' prefix
+    user_interaction_logger.info("User %s callback: %s", user_id, call.data, extra={'user_id': user_id})
+    bot_logger.info("Login button clicked for user %s with username %s", user_id, username, extra={'user_id': user_id})
+    bot.answer_callback_query(call.id, f"Attempting to login with {username}...")
+    user_interaction_logger.info("Bot to %s: Attempting to login with %s...", user_id, username, extra={'user_id': user_id})
+    # Delete the message containing the username button
+    delete_message(bot, user_id, call.message.message_id)
+
+    try:
+        credentials = get_credential_by_username(str(user_id), username)
+        if not credentials:
+            bot_logger.warning("No credentials found for user %s with username %s", user_id, username, extra={'user_id': user_id})
+            warmup.cancel(user_id)
+            clear_status(bot, user_id)
+            reply(bot, user_id, f"❌ Credentials not found for {username}")
+            return None
+
+        bot_logger.debug("Credentials found for user %s", user_id, extra={'user_id': user_id})
+        if not site_available(bot, user_id):
+            warmup.cancel(user_id)
+            return None
+    except Exception as e:
+        bot_logger.error("Error handling login callback for user %s: %s", user_id, e, extra={'user_id': user_id})
+        reply(bot, user_id, "❌ Internal error occurred")
+        return None
+
+    clear_status(bot, user_id)
+    ds.set_bot_instance(bot, user_id)
+    session_manager.set_user_busy(user_id, True)
+    return credentials
+
+def login_finished(bot, user_id, username, success):
+    """Report a login run; a failed one also closes its Chrome."""
+    if success:
+        bot_logger.info("Login successful for user %s with username %s", user_id, username, extra={'user_id': user_id})
+        reply(bot, user_id, f"✅ Successfully logged in as {username}")
+    else:
+        bot_logger.warning("Login failed for user %s with username %s", user_id, username, extra={'user_id': user_id})
+        session_manager.close_session(user_id)
+        reply(bot, user_id, f"❌ Login failed for {username}")
+
+def login_failed(bot, user_id, error):
+    bot_logger.error("Error during login for user %s: %s", user_id, error, extra={'user_id': user_id})
+    reply(bot, user_id, f"❌ Error during login: {str(error)}")
+    session_manager.close_session(user_id)
+
+# --------------------------
+# MENUS
+# --------------------------
+def menu_callback(call, bot):
+    """Every inline button except a username on the login keyboard.
+
+    Menu actions are matched on their exact callback data; only the
+    per-credential buttons carry a username after "remove:" or "value:".
+    """
+    user_id = call.message.chat.id
+    data = call.data
+    user_interaction_logger.info("User %s callback: %s", user_id, data, extra={'user_id': user_id})
+    # Menu steps replace the tapped message
+    message_id = call.message.message_id
+
+    if data == "cancel":
+        admission.controller.cancel(user_id)
+        warmup.cancel(user_id)
+        bot.answer_callback_query(call.id, "Operation cancelled")
+        show_menu(bot, user_id, "Operation cancelled.", message_id=message_id)
+        user_states.pop(user_id, None)
+
+    elif data == "view_creds":
+        bot.answer_callback_query(call.id)
+        usernames = get_user_usernames(str(user_id))
+        if usernames:
+            creds_list = "Your saved credentials:\n" + "\n".join([f"- {username}" for username in usernames])
+            show_menu(bot, user_id, creds_list, create_cancel_keyboard("❌ Close"), message_id)
+        else:
+            show_menu(bot, user_id, "No credentials found.", message_id=message_id)
+
+    elif data == "add_cred":
+        user_states[user_id] = {"state": "waiting_username"}
+        bot.answer_callback_query(call.id)
+        show_menu(bot, user_id, "Please enter your username:", create_cancel_keyboard(), message_id)
+
+    elif data == "remove_cred":
+        bot.answer_callback_query(call.id)
+        keyboard = create_remove_credentials_keyboard(user_id)
+        if len(keyboard.keyboard) > 1:  # Any credentials besides the cancel button
+            show_menu(bot, user_id, "Select credential to remove:", keyboard, message_id)
+        else:
+            show_menu(bot, user_id, "No credentials found to remove.", message_id=message_id)
+
+    elif data == "remove_all":
+        if remove_all_user_credentials(str(user_id)):
+            bot.answer_callback_query(call.id, "All credentials removed")
+            show_menu(bot, user_id, "✅ All credentials have been removed.", create_settings_keyboard(), message_id)
+        else:
+            bot.answer_callback_query(call.id)
+            show_menu(bot, user_id, "Failed to remove credentials", message_id=message_id)
+
+    elif data.startswith("remove:"):
+        username = data[7:]  # Get username after 'remove:'
+        bot_logger.info("Attempting to remove credentials for user %s with username %s", user_id, username, extra={'user_id': user_id})
+        if remove_user_credential(str(user_id), username):
+            bot.answer_callback_query(call.id, f"Removed credentials for {username}")
+            show_menu(bot, user_id, f"✅ Removed credentials for {username}", create_settings_keyboard(), message_id)
+        else:
+            bot_logger.warning("Failed to remove credentials for user %s with username %s", user_id, username, extra={'user_id': user_id})
+            bot.answer_callback_query(call.id)
+            show_menu(bot, user_id, f"❌ Failed to remove credentials for {username}", message_id=message_id)
+
+    elif data == "import_creds":
+        bot.answer_callback_query(call.id)
+        start_import(bot, user_id, message_id)
+
+    elif data == "export_creds":
+        # A document cannot replace the menu; send it as a new message
+        delete_message(bot, user_id, message_id)
+        bot.answer_callback_query(call.id)
+        send_export(bot, user_id)
+
+    elif data == "value_cred":
+        bot.answer_callback_query(call.id)
+        keyboard = create_form_value_keyboard(user_id)
+        if len(keyboard.keyboard) > 1:  # Any credentials besides the cancel button
+            show_menu(bot, user_id, "Select the credential whose form value /operations should enter:", keyboard,
+                      message_id)
+        else:
+            show_menu(bot, user_id, "No credentials found.", message_id=message_id)
+
+    elif data.startswith("value:"):
+        username = data[6:]  # Get username after 'value:'
+        user_states[user_id] = {"state": "waiting_form_value", "username": username}
+        bot.answer_callback_query(call.id)
+        show_menu(bot, user_id, f"Enter the value /operations should save for {username}.\n{ds.FORM_VALUE_HELP}",
+                  create_cancel_keyboard(), message_id)
+
+# --------------------------
+# IMPORT AND EXPORT
+# --------------------------
+def import_command(message, bot):
+    start_import(bot, _command(message))
+
+def export_command(message, bot):
+    send_export(bot, _command(message))
+
+def start_import(bot, user_id, message_id=None):
+    user_states[user_id] = {"state": "waiting_import"}
+    show_menu(bot, user_id, credentials_io.IMPORT_PROMPT, create_cancel_keyboard(), message_id)
+
+def send_export(bot, user_id):
+    credentials = get_user_credentials(str(user_id))
+    clear_status(bot, user_id)  # Clear any existing status message
+    if not credentials:
+        reply(bot, user_id, "No credentials found.")
+        return
+    sent_msg = bot.send_document(user_id, credentials_io.export_credentials(credentials),
+                                 caption=credentials_io.EXPORT_CAPTION)
+    ds.last_message_id[user_id] = sent_msg.message_id
+    user_interaction_logger.info("Bot to %s: Sent %s credentials as a file", user_id, len(credentials), extra={'user_id': user_id})
+
+def import_document(message, bot):
+    user_id = message.chat.id
+    user_interaction_logger.info("User %s sent a document: %s", user_id, message.document.file_name, extra={'user_id': user_id})
+    if (user_states.get(user_id) or {}).get('state') != 'waiting_import':
+        reply(bot, user_id, "ℹ️ Use /import before sending a credentials file.")
+        return
+    del user_states[user_id]  # Clear the state
+
+    # Delete the upload for security, it holds passwords
+    delete_message(bot, user_id, message.message_id)
+    try:
+        if (message.document.file_size or 0) > credentials_io.MAX_IMPORT_BYTES:
+            raise ValueError(f"The file is too large, the limit is {credentials_io.MAX_IMPORT_BYTES // 1024} KB")
+        data = bot.download_file(bot.get_file(message.document.file_id).file_path)
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValueError("The file is not UTF-8 text")
+        credentials, errors = credentials_io.parse_credentials(text)
+        added, existing, over_limit = add_user_credentials(str(user_id), credentials) if credentials else ([], [], [])
+        text = credentials_io.format_import_summary(added, existing, over_limit, errors, MAX_CREDENTIALS)
+    except ValueError as e:
+        text = f"❌ {e}"
+    except Exception as e:
+        bot_logger.error("Error importing credentials for user %s: %s", user_id, e, extra={'user_id': user_id})
+        text = f"❌ Import failed: {str(e)}"
+    show_menu(bot, user_id, text, create_settings_keyboard())  # In place of the import prompt
+
+# --------------------------
+# TEXT INPUT
+# --------------------------
+def user_input(message, bot, answer_prompt):
+    """Any other text: a reply to a run's prompt, or the next step of a credential flow.
+
+    answer_prompt(user_id, text) is the runtime's way of handing text to a
+    run waiting on a prompt (CAPTCHA text, form value); False if none waits.
+    """
+    user_id = message.chat.id
+    text = message.text
+    user_interaction_logger.info("User %s input: %s", user_id, text, extra={'user_id': user_id})
+
+    # Delete user's message for security
+    delete_message(bot, user_id, message.message_id)
+
+    if answer_prompt(user_id, text):
+        if getattr(message, 'reply_to_message', None):
+            delete_message(bot, user_id, message.reply_to_message.message_id)
+        reply(bot, user_id, INPUT_RECEIVED_TEXT)
+        return
+
+    state = user_states.get(user_id)
+    if not state:
+        return
+    # Each step edits the prompt in place
+    if state.get('state') == 'waiting_username':
+        user_states[user_id] = {'state': 'waiting_password', 'username': text}
+        show_menu(bot, user_id, "Please enter your password:", create_cancel_keyboard())
+
+    elif state.get('state') == 'waiting_password':
+        username = state.get('username')
+        del user_states[user_id]  # Clear the state
+        if save_user_credentials(str(user_id), username, text):
+            show_menu(bot, user_id, f"✅ Credentials saved for {username}", create_settings_keyboard())
+        else:
+            show_menu(bot, user_id, "❌ Failed to save credentials", create_settings_keyboard())
+
+    elif state.get('state') == 'waiting_form_value':
+        username = state.get('username')
+        del user_states[user_id]  # Clear the state
+        value = None if text.strip() == '-' else text.strip()
+        try:
+            if value:
+                ds.render_form_value(value, username)  # Reject bad templates now, not at run time
+            if set_form_value(str(user_id), username, value):
+                text = (f"✅ /operations will enter {value} for {username}" if value
+                        else f"✅ /operations will ask for the value for {username}")
+            else:
+                text = f"❌ Credentials not found for {username}"
+        except ValueError as e:
+            text = f"❌ {e}"
+        show_menu(bot, user_id, text, create_settings_keyboard())
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from logger import bot_logger
+
+# Probe refresh configuration
+HEALTH_INTERVAL = float(os.getenv('HEALTH_INTERVAL', '15'))  # Seconds between probe rounds
+HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', '5'))  # Slow probe warning threshold
+
+_probes = {}
+_results = {}
+_lock = threading.Lock()
+_last_refresh = 0.0
+_thread = None
+
+def register_probe(name, func, liveness=False):
+    """Register a probe. func() returns (ok, details) and may be slow.
+
+    Probes run only on the refresher thread. Liveness probes also fail
+    /healthz; every probe counts towards /readyz.
+    """
+    _probes[name] = (func, liveness)
+
+def _run_probe(name, func):
+    start = time.perf_counter()
+    try:
+        ok, details = func()
+    except Exception as e:
+        ok, details = False, {'error': str(e)}
+    elapsed = time.perf_counter() - start
+    if elapsed > HEALTH_PROBE_TIMEOUT:
+        bot_logger.warning("Health probe %s took %.1fs", name, elapsed)
+    return {'ok': bool(ok), 'details': details, 'checked_at': time.time(),
+            'duration_ms': round(elapsed * 1000, 1)}
+
+def refresh():
+    """Run every probe once and publish the results."""
+    global _last_refresh
+    for name, (func, _) in list(_probes.items()):
+        result = _run_probe(name, func)
+        with _lock:
+            _results[name] = result
+    _last_refresh = time.time()
+
+def _refresh_loop():
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            bot_logger.error("Health refresh failed: %s", e)
+        time.sleep(HEALTH_INTERVAL)
+
+def start():
+    """Start the background refresher once."""
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_refresh_loop, name='health', daemon=True)
+        _thread.start()
+
+def _report(include, fail_stale):
+    with _lock:
+        results = {name: dict(result) for name, result in _results.items()}
+    stale = time.time() - _last_refresh > HEALTH_INTERVAL * 3
+    checks = {name: result for name, result in results.items() if include(name)}
+    ok = not (stale and fail_stale) and all(result['ok'] for result in checks.values())
+    return ok, {'status': 'ok' if ok else 'fail', 'stale': stale,
+                'refreshed_at': _last_refresh, 'checks': checks}
+
+def liveness():
+    """Cached /healthz result: liveness probes passing.
+
+    Staleness is reported but does not fail liveness: a slow readiness probe
+    must not get an otherwise healthy bot restarted.
+    """
+    return _report(lambda name: _probes.get(name, (None, False))[1], fail_stale=False)
+
+def readiness():
+    """Cached /readyz result: refresher running and every probe passing."""
+    return _report(lambda name: True, fail_stale=True)
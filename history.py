@@ -0,0 +1,121 @@
+"""Run history: one document per login/operations run in MongoDB.
+
+tracing.run hands each finished run to record(), which only appends it to an
+in-memory buffer. A background thread inserts the buffer in batches of up to
+HISTORY_BATCH_SIZE, every HISTORY_FLUSH_INTERVAL seconds or as soon as a
+batch is full, so a run never waits on the database. A failed insert is
+retried on the next flush; when the database stays down the buffer keeps
+the newest HISTORY_BUFFER_MAX runs and drops the oldest.
+
+Document: run_id, user_id, kind, site_username, started_at, ended_at
+(epoch seconds), duration_ms, stages ({stage: ms}), captcha ('prepared',
+'ocr' or 'manual', login runs only), outcome, ok.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from logger import db_logger
+import db
+import metrics
+import tracing
+
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '5'))  # Max seconds a run waits to be written
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '200'))  # Runs per insert
+HISTORY_BUFFER_MAX = int(os.getenv('HISTORY_BUFFER_MAX', '10000'))  # Runs kept while MongoDB is unreachable
+RECORDED_KINDS = ('login', 'operations')
+
+flush_seconds = metrics.Histogram('dsts_history_flush_seconds', 'Time to insert a batch of run history')
+dropped = metrics.Counter('dsts_history_dropped_total', 'Run history documents dropped on a full buffer')
+
+_buffer = deque()
+_cond = threading.Condition()
+
+metrics.Gauge('dsts_history_buffered', 'Run history documents waiting to be written', lambda: len(_buffer))
+
+def document(kind, user_id, started_at, ended_at, ok=True, stages=None, **fields):
+    """Build a run document; fields are site_username, captcha, outcome, run_id."""
+    doc = {'run_id': fields.pop('run_id', None), 'user_id': str(user_id), 'kind': kind,
+           'started_at': started_at, 'ended_at': ended_at,
+           'duration_ms': round((ended_at - started_at) * 1000, 1),
+           'stages': stages or {}, 'ok': ok}
+    doc.update(fields)
+    doc.setdefault('outcome', 'success' if ok else 'error')
+    return doc
+
+def record(doc):
+    """Queue a run document for the next batch insert."""
+    with _cond:
+        if len(_buffer) >= HISTORY_BUFFER_MAX:
+            _buffer.popleft()
+            dropped.inc()
+        _buffer.append(doc)
+        if len(_buffer) >= HISTORY_BATCH_SIZE:
+            _cond.notify()
+
+def _record_run(run):
+    if run['kind'] in RECORDED_KINDS:
+        record(document(**run))
+
+def flush():
+    """Insert everything buffered now; False if an insert failed."""
+    while True:
+        with _cond:
+            batch = [_buffer.popleft() for _ in range(min(len(_buffer), HISTORY_BATCH_SIZE))]
+        if not batch:
+            return True
+        try:
+            with flush_seconds.time():
+                db.insert_runs(batch)
+        except Exception as e:
+            db_logger.warning("Writing %s runs to history failed: %s", len(batch), e)
+            # Put the batch back in front; runs recorded meanwhile win over older ones
+            with _cond:
+                room = HISTORY_BUFFER_MAX - len(_buffer)
+                keep = batch[-room:] if room > 0 else []
+                _buffer.extendleft(reversed(keep))
+            if len(keep) < len(batch):
+                dropped.inc(len(batch) - len(keep))
+            return False
+
+def _flush_loop():
+    while True:
+        with _cond:
+            _cond.wait_for(lambda: len(_buffer) >= HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL)
+        if not flush():
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+
+def format_recent(runs):
+    """A user's runs from db.get_recent_runs as chat lines."""
+    if not runs:
+        return "ℹ️ No runs recorded yet."
+    lines = ["🕘 Your recent runs:"]
+    for run in runs:
+        when = datetime.fromtimestamp(run['started_at']).strftime('%d %b %H:%M')
+        mark = '✅' if run.get('outcome') == 'success' else '❌'
+        detail = run['kind']
+        if run.get('site_username'):
+            detail += f" as {run['site_username']}"
+        extra = f", {run['captcha']} CAPTCHA" if run.get('captcha') else ''
+        outcome = '' if run.get('outcome') == 'success' else f", {run.get('outcome')}"
+        lines.append(f"{mark} {when} {detail}: {run['duration_ms'] / 1000:.1f}s{extra}{outcome}")
+    return "\n".join(lines)
+
+def format_stats(rows, hours):
+    """db.aggregate_runs rows as a fixed-width table."""
+    if not rows:
+        return f"No runs in the last {hours} h."
+    lines = [f"Runs, last {hours} h",
+             f"{'kind':<12}{'runs':>6}{'success':>9}{'median':>9}{'OCR hit':>9}"]
+    for row in rows:
+        ocr = f"{row['ocr_hits'] / row['captcha_runs']:.0%}" if row['captcha_runs'] else '-'
+        median = f"{row['median_ms'] / 1000:.1f}s" if row.get('median_ms') is not None else '-'
+        lines.append(f"{row['_id']:<12}{row['runs']:>6}{row['successes'] / row['runs']:>9.0%}"
+                     f"{median:>9}{ocr:>9}")
+    return "\n".join(lines)
+
+tracing.add_run_listener(_record_run)
+threading.Thread(target=_flush_loop, name='history-flush', daemon=True).start()
+atexit.register(flush)
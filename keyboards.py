@@ -0,0 +1,94 @@
+"""Inline keyboards shared by the threaded (bot.py) and asyncio (async_bot.py) runtimes.
+
+Buttons for one credential carry "<action>:<username>" (login:, remove:,
+value:); no fixed menu action contains a colon. Keyboards built from a
+user's credentials are kept in the user's context until db reports a
+change to those credentials, so menu taps do not read MongoDB. Callers
+must not modify the returned markup.
+"""
+import functools
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from db import get_user_credentials, get_user_usernames, on_credentials_changed
+from user_state import user_store
+
+# Per-user {builder name: markup}, dropped when the user's credentials change
+_keyboards = user_store.field('keyboards')
+
+def _memoized(build):
+    @functools.wraps(build)
+    def wrapper(user_id):
+        cache = _keyboards.get(user_id)
+        if cache is None:
+            cache = _keyboards[user_id] = {}
+        keyboard = cache.get(build.__name__)
+        if keyboard is None:
+            keyboard = build(user_id)
+            # Keep it only if no credential change dropped the cache meanwhile
+            if _keyboards.get(user_id) is cache:
+                cache[build.__name__] = keyboard
+        return keyboard
+    return wrapper
+
+def _forget(user_id):
+    _keyboards.pop(int(user_id), None)
+
+on_credentials_changed(_forget)
+
+@_memoized
+def create_credentials_keyboard(user_id):
+    """Create inline keyboard with user's credentials."""
+    keyboard = InlineKeyboardMarkup()
+    usernames = get_user_usernames(str(user_id))
+    if not usernames:
+        return keyboard
+    for username in usernames:
+        keyboard.add(InlineKeyboardButton(username, callback_data=f"login:{username}"))
+    keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
+    return keyboard
+
+@_memoized
+def create_remove_credentials_keyboard(user_id):
+    """Create inline keyboard for removing credentials."""
+    keyboard = InlineKeyboardMarkup()
+    usernames = get_user_usernames(str(user_id))
+    for username in usernames:
+        keyboard.add(InlineKeyboardButton(f"Remove {username}", callback_data=f"remove:{username}"))
+    keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
+    return keyboard
+
+@_memoized
+def create_form_value_keyboard(user_id):
+    """Create inline keyboard for picking the credential whose form value to set."""
+    keyboard = InlineKeyboardMarkup()
+    for cred in get_user_credentials(str(user_id)):
+        label = f"{cred['username']}: {cred['form_value']}" if cred.get('form_value') else f"{cred['username']} (ask)"
+        keyboard.add(InlineKeyboardButton(label, callback_data=f"value:{cred['username']}"))
+    keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
+    return keyboard
+
+@functools.lru_cache(maxsize=None)
+def create_settings_keyboard():
+    """Create inline keyboard for settings (the same for every user)."""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(
+        InlineKeyboardButton("View Credentials", callback_data="view_creds"),
+        InlineKeyboardButton("Add Credential", callback_data="add_cred")
+    )
+    keyboard.row(
+        InlineKeyboardButton("Remove Credential", callback_data="remove_cred"),
+        InlineKeyboardButton("Remove All", callback_data="remove_all")
+    )
+    keyboard.row(InlineKeyboardButton("Form Values", callback_data="value_cred"))
+    keyboard.row(
+        InlineKeyboardButton("Import", callback_data="import_creds"),
+        InlineKeyboardButton("Export", callback_data="export_creds")
+    )
+    keyboard.row(InlineKeyboardButton("❌ Cancel", callback_data="cancel"))
+    return keyboard
+
+@functools.lru_cache(maxsize=None)
+def create_cancel_keyboard(label="❌ Cancel"):
+    """Create inline keyboard with a single cancel button."""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton(label, callback_data="cancel"))
+    return keyboard
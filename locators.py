@@ -0,0 +1,95 @@
+"""Registry of page elements with fallback locators.
+
+Each logical element has an ordered list of candidate locators (id, name,
+XPath or CSS). All candidates for one or more elements are resolved in a
+single in-page script, and the candidate that matched is remembered per
+page version (path and title) so it is tried first next time.
+"""
+import threading
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.support.ui import WebDriverWait
+from logger import bot_logger
+import metrics
+
+KINDS = ('id', 'name', 'xpath', 'css')
+MAX_VERSIONS = 20  # Page versions remembered per element
+
+RESOLVE_JS = """
+var specs = arguments[0];
+var version = location.pathname + '|' + document.title;
+function resolve(kind, value) {
+    if (kind === 'id') return document.getElementById(value);
+    if (kind === 'name') return document.getElementsByName(value)[0] || null;
+    if (kind === 'css') return document.querySelector(value);
+    return document.evaluate(value, document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+var found = {};
+for (var i = 0; i < specs.length; i++) {
+    var name = specs[i][0], candidates = specs[i][1], hint = specs[i][2][version];
+    var order = hint === undefined ? [] : [hint];
+    for (var j = 0; j < candidates.length; j++) {
+        if (j !== hint) order.push(j);
+    }
+    found[name] = [null, -1];
+    for (var k = 0; k < order.length; k++) {
+        var element = null;
+        try { element = resolve(candidates[order[k]][0], candidates[order[k]][1]); } catch (e) {}
+        if (element) { found[name] = [element, order[k]]; break; }
+    }
+}
+return [version, found];
+"""
+
+lookups = metrics.Counter('dsts_locator_lookups_total', 'Element lookups by winning candidate',
+                          ['element', 'candidate'])
+
+_registry = {}
+_winners = {}  # name -> {page version: index of the candidate that matched}
+_lock = threading.Lock()
+
+def register(name, *candidates):
+    """Register a logical element with its candidate locators, best first."""
+    for kind, _ in candidates:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown locator kind: {kind}")
+    _registry[name] = list(candidates)
+
+def candidates(name):
+    return list(_registry[name])
+
+def locate(driver, *names):
+    """Resolve elements in one round trip; returns {name: WebElement or None}."""
+    specs = [[name, _registry[name], _winners.get(name, {})] for name in names]
+    version, found = driver.execute_script(RESOLVE_JS, specs)
+    result = {}
+    for name in names:
+        element, index = found[name]
+        result[name] = element
+        if element is None:
+            lookups.labels(name, 'none').inc()
+            continue
+        kind, value = _registry[name][index]
+        lookups.labels(name, f"{index}:{kind}").inc()
+        with _lock:
+            versions = _winners.setdefault(name, {})
+            if versions.get(version) != index:
+                if index > 0:
+                    bot_logger.debug("Element %s on %s matched fallback locator %s=%s",
+                                     name, version, kind, value)
+                if len(versions) >= MAX_VERSIONS:
+                    versions.pop(next(iter(versions)))
+                versions[version] = index
+    return result
+
+def find(driver, name):
+    """Like driver.find_element, for a registered element."""
+    element = locate(driver, name)[name]
+    if element is None:
+        raise NoSuchElementException(f"No candidate locator matched {name}")
+    return element
+
+def wait_for(driver, name, timeout):
+    """Wait until a registered element is on the page and return it."""
+    return WebDriverWait(driver, timeout, ignored_exceptions=(Exception,)).until(
+        lambda d: locate(d, name)[name])
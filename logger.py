@@ -1,37 +1,251 @@
+import atexit
+import glob
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler
 from collections import deque
 
 # Bot owner ID for logs access
 BOT_OWNER_ID = int(os.getenv('BOT_OWNER_ID'))
 MAX_LOG_LINES = 6000
 
-def trim_log_file(file_path, max_lines):
-    """Keep only the latest max_lines in the log file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = deque(f, max_lines)
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
-    except Exception as e:
-        print(f"Error trimming log file: {e}")
+# Async logging pipeline configuration
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Max pending records
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '256'))  # Records per flush
+
+# Log retention: a fixed number of fixed-size segments, rotated by the writer
+LOG_SEGMENT_BYTES = int(os.getenv('LOG_SEGMENT_BYTES', str(1024 * 1024)))  # 1MB per segment
+LOG_SEGMENTS = max(int(os.getenv('LOG_SEGMENTS', '2')), 2)  # Current file plus backups; rotation needs one
+LOG_INDEX_SIZE = int(os.getenv('LOG_INDEX_SIZE', '50000'))  # Records kept in the offset index
+
+class BatchFlushMixin:
+    """Defer stream flushes until the writer thread finishes a batch."""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+def _record_user_id(record):
+    """User id of a record, passed by the call site as extra={'user_id': ...}."""
+    user_id = getattr(record, 'user_id', None)
+    return str(user_id) if user_id is not None else None
+
+class LogIndex:
+    """Bounded in-memory index of record offsets in the log segments.
+
+    Entries are staged by the writer thread and committed after each batch
+    flush, so readers only ever see offsets that are already on disk.
+    """
+
+    def __init__(self, max_entries):
+        self.entries = deque(maxlen=max_entries)
+        self.generation = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, generation, offset, size, record):
+        self._pending.append((generation, offset, size, record.created,
+                              record.levelno, record.name, _record_user_id(record)))
+
+    def commit(self):
+        if not self._pending:
+            return
+        with self._lock:
+            self.entries.extend(self._pending)
+        self._pending = []
+
+    def rolled_over(self, generation, keep):
+        with self._lock:
+            self.generation = generation
+            while self.entries and self.entries[0][0] <= generation - keep:
+                self.entries.popleft()
+        self._pending = [e for e in self._pending if e[0] > generation - keep]
+
+    def search(self, user_id=None, logger_name=None, level=None, since=None, limit=None):
+        """Return matching entries (oldest first), newest limit entries only."""
+        matches = []
+        with self._lock:
+            generation = self.generation
+            for entry in reversed(self.entries):
+                if since is not None and entry[3] < since:
+                    break
+                if level is not None and entry[4] < level:
+                    continue
+                if logger_name is not None and entry[5] != logger_name:
+                    continue
+                if user_id is not None and entry[6] != user_id:
+                    continue
+                matches.append(entry)
+                if limit is not None and len(matches) >= limit:
+                    break
+        matches.reverse()
+        return generation, matches
+
+class SegmentedLogHandler(BatchFlushMixin, RotatingFileHandler):
+    """Rotating file handler that tracks its own write offset.
+
+    Avoids the seek/tell and double formatting RotatingFileHandler does on
+    every record, and feeds each record's offset into the log index.
+    """
+
+    def __init__(self, filename, index, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.index = index
+        self.generation = 0
+        self.offset = os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+
+    def shouldRollover(self, record):
+        return self.maxBytes > 0 and self.offset >= self.maxBytes
+
+    def doRollover(self):
+        super().doRollover()
+        self.generation += 1
+        self.offset = 0
+        self.index.rolled_over(self.generation, self.backupCount + 1)
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            msg = self.format(record) + self.terminator
+            self.stream.write(msg)
+            size = len(msg.encode(self.encoding or 'utf-8'))
+            self.index.add(self.generation, self.offset, size, record)
+            self.offset += size
+        except Exception:
+            self.handleError(record)
+
+    def flush_batch(self):
+        super().flush_batch()
+        self.index.commit()
+
+class BatchedRotatingFileHandler(BatchFlushMixin, RotatingFileHandler):
+    pass
+
+class BatchedStreamHandler(BatchFlushMixin, logging.StreamHandler):
+    pass
+
+class JsonLinesFormatter(logging.Formatter):
+    """Serialize the record's `data` extra as one JSON object per line."""
+
+    def format(self, record):
+        return json.dumps(getattr(record, 'data', None) or {'message': record.getMessage()},
+                          ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """Enqueue records without formatting them and never block the caller.
+
+    Formatting happens on the writer thread. When the queue is full the
+    record is dropped and counted instead of stalling a request thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingQueueListener:
+    """Single background writer that drains the log queue in batches."""
+
+    def __init__(self, log_queue, queue_handler, handlers, batch_size):
+        self.queue = log_queue
+        self.queue_handler = queue_handler  # Counts records dropped on a full queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.written = 0
+        self.batches = 0
+        self._reported_drops = 0
+        self._stop = object()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.queue.put(self._stop)
+        self._thread.join()
+        self._thread = None
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        self.written += 1
+
+    def _report_drops(self):
+        dropped = self.queue_handler.dropped
+        if dropped > self._reported_drops:
+            record = logging.LogRecord(
+                'logger', logging.WARNING, __file__, 0,
+                f"Dropped {dropped - self._reported_drops} log records (queue full)", None, None)
+            self._reported_drops = dropped
+            self._handle(record)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            record = self.queue.get()
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._stop:
+                    stopping = True
+                    continue
+                try:
+                    self._handle(record)
+                except Exception:
+                    pass
+            self._report_drops()
+
+            for handler in self.handlers:
+                try:
+                    handler.flush_batch()
+                except Exception:
+                    pass
+            self.batches += 1
 
 # Create logs directory if it doesn't exist
-if not os.path.exists('logs'):
-    os.makedirs('logs')
+LOG_DIR = os.getenv('LOG_DIR', 'logs')  # Separate per process in sharded mode
+if not os.path.exists(LOG_DIR):
+    os.makedirs(LOG_DIR)
 
-# Remove old log file if it exists
-log_file = 'logs/debug.txt'
-if os.path.exists(log_file):
-    os.remove(log_file)
+# Remove old log segments if they exist
+log_file = os.path.join(LOG_DIR, 'debug.txt')
+for path in [log_file] + glob.glob(log_file + '.*'):
+    if os.path.exists(path):
+        os.remove(path)
 
-# Configure rotating file handler for debug logs
-file_handler = RotatingFileHandler(
+# Configure segmented file handler for debug logs
+log_index = LogIndex(LOG_INDEX_SIZE)
+file_handler = SegmentedLogHandler(
     log_file,
-    maxBytes=1024 * 1024,  # 1MB per file
-    backupCount=1,  # Keep only one backup file
+    log_index,
+    maxBytes=LOG_SEGMENT_BYTES,
+    backupCount=LOG_SEGMENTS - 1,
     encoding='utf-8'
 )
 file_handler.setLevel(logging.DEBUG)
@@ -39,37 +253,174 @@ file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(m
 file_handler.setFormatter(file_formatter)
 
 # Configure console handler for user interaction logs only
-console_handler = logging.StreamHandler()
+console_handler = BatchedStreamHandler()
 console_handler.setLevel(logging.INFO)
 console_formatter = logging.Formatter('%(message)s')
 console_handler.setFormatter(console_formatter)
 
+# Only user interaction records go to the console
+class _ConsoleFilter(logging.Filter):
+    def filter(self, record):
+        return record.name == 'user_interaction'
+
+console_handler.addFilter(_ConsoleFilter())
+
+# Structured stage timings go to their own JSON lines file, not the debug log
+trace_file = os.path.join(LOG_DIR, 'trace.jsonl')
+for path in [trace_file] + glob.glob(trace_file + '.*'):
+    if os.path.exists(path):
+        os.remove(path)
+trace_handler = BatchedRotatingFileHandler(
+    trace_file,
+    maxBytes=LOG_SEGMENT_BYTES,
+    backupCount=1,
+    encoding='utf-8'
+)
+trace_handler.setLevel(logging.DEBUG)
+trace_handler.setFormatter(JsonLinesFormatter())
+trace_handler.addFilter(lambda record: record.name == 'trace')
+file_handler.addFilter(lambda record: record.name != 'trace')
+
+# All loggers enqueue records; a single writer thread formats and writes them
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+log_listener = BatchingQueueListener(log_queue, queue_handler, [file_handler, console_handler, trace_handler], LOG_BATCH_SIZE)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+def get_log_stats():
+    """Return counters for the async logging pipeline."""
+    return {
+        'queued': log_queue.qsize(),
+        'dropped': queue_handler.dropped,
+        'written': log_listener.written,
+        'batches': log_listener.batches,
+        'indexed': len(log_index.entries),
+    }
+
+def _segment_path(age):
+    return log_file if age == 0 else f"{log_file}.{age}"
+
+def tail_log(max_lines, block_size=64 * 1024):
+    """Return the last max_lines lines across log segments, reading backwards."""
+    chunks = []
+    lines_found = 0
+    for age in range(LOG_SEGMENTS):
+        path = _segment_path(age)
+        if not os.path.exists(path):
+            break
+        with open(path, 'rb') as f:
+            position = f.seek(0, os.SEEK_END)
+            while position > 0 and lines_found <= max_lines:
+                read_size = min(block_size, position)
+                position -= read_size
+                f.seek(position)
+                block = f.read(read_size)
+                chunks.append(block)
+                lines_found += block.count(b'\n')
+        if lines_found > max_lines:
+            break
+    data = b''.join(reversed(chunks))
+    lines = data.splitlines(keepends=True)[-max_lines:]
+    return b''.join(lines).decode('utf-8', errors='replace')
+
+def query_logs(user_id=None, logger_name=None, level=None, since=None, limit=MAX_LOG_LINES):
+    """Return the newest records matching the filters, using the offset index.
+
+    Cost depends on the index size and limit, never on the log file size.
+    Holds the writer's handler lock so no rollover moves the segments
+    between reading the index and reading the files.
+    """
+    out = []
+    handles = {}
+    file_handler.acquire()
+    try:
+        generation, entries = log_index.search(
+            user_id=str(user_id) if user_id is not None else None,
+            logger_name=logger_name, level=level, since=since, limit=limit)
+        for entry_generation, offset, size, *_ in entries:
+            path = _segment_path(generation - entry_generation)
+            f = handles.get(path)
+            if f is None:
+                try:
+                    f = handles[path] = open(path, 'rb')
+                except OSError:
+                    continue
+            f.seek(offset)
+            out.append(f.read(size))
+    finally:
+        file_handler.release()
+        for f in handles.values():
+            f.close()
+    return b''.join(out).decode('utf-8', errors='replace')
+
+_durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_log_filters(text):
+    """Parse `/logs key=value ...` arguments into query_logs keyword args.
+
+    Supported keys: user, logger, level, since (e.g. 30m, 2h, 1d), lines.
+    Raises ValueError on unknown keys or malformed values.
+    """
+    filters = {}
+    for token in text.split()[1:]:
+        key, sep, value = token.partition('=')
+        if not sep or not value:
+            raise ValueError(f"Invalid filter: {token}")
+        key = key.lower()
+        if key == 'user':
+            filters['user_id'] = value
+        elif key == 'logger':
+            filters['logger_name'] = value
+        elif key == 'level':
+            level = logging.getLevelName(value.upper())
+            if not isinstance(level, int):
+                raise ValueError(f"Unknown level: {value}")
+            filters['level'] = level
+        elif key == 'since':
+            unit = value[-1].lower()
+            if unit not in _durations or not value[:-1].isdigit():
+                raise ValueError(f"Invalid time window: {value}")
+            filters['since'] = time.time() - int(value[:-1]) * _durations[unit]
+        elif key == 'lines':
+            if not value.isdigit():
+                raise ValueError(f"Invalid line count: {value}")
+            filters['limit'] = int(value)
+        else:
+            raise ValueError(f"Unknown filter: {key}")
+    return filters
+
 # Configure different loggers
 bot_logger = logging.getLogger('bot')
 bot_logger.setLevel(logging.DEBUG)
-bot_logger.addHandler(file_handler)
+bot_logger.addHandler(queue_handler)
 
 login_logger = logging.getLogger('login')
 login_logger.setLevel(logging.DEBUG)
-login_logger.addHandler(file_handler)
+login_logger.addHandler(queue_handler)
 
 session_logger = logging.getLogger('session')
 session_logger.setLevel(logging.DEBUG)
-session_logger.addHandler(file_handler)
+session_logger.addHandler(queue_handler)
 
 db_logger = logging.getLogger('db')
 db_logger.setLevel(logging.DEBUG)
-db_logger.addHandler(file_handler)
+db_logger.addHandler(queue_handler)
 
 # User interaction logger - both file and console
 user_interaction_logger = logging.getLogger('user_interaction')
 user_interaction_logger.setLevel(logging.INFO)
-user_interaction_logger.addHandler(file_handler)
-user_interaction_logger.addHandler(console_handler)
+user_interaction_logger.addHandler(queue_handler)
+
+# Stage timing records written by tracing.py
+trace_logger = logging.getLogger('trace')
+trace_logger.setLevel(logging.INFO)
+trace_logger.addHandler(queue_handler)
 
 # Prevent loggers from propagating to root logger
 bot_logger.propagate = False
 login_logger.propagate = False
 session_logger.propagate = False
 db_logger.propagate = False
-user_interaction_logger.propagate = False
\ No newline at end of file
+user_interaction_logger.propagate = False
+trace_logger.propagate = False
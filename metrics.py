@@ -0,0 +1,271 @@
+import bisect
+import os
+import threading
+import time
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+class _Metric:
+    """Base for labelled metrics. Each label combination is a child series."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _ShardedValue:
+    """Counter value sharded per thread: increments never take a lock.
+
+    Each thread only ever writes its own cell; readers sum all cells. The
+    cells of threads that have exited are folded into a base total, so
+    short-lived threads do not grow the list.
+    """
+
+    __slots__ = ('_local', '_cells', '_base', '_lock')
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []  # (thread, cell)
+        self._base = 0
+        self._lock = threading.Lock()
+
+    def _fold_locked(self):
+        live = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                live.append((thread, cell))
+            else:
+                self._base += cell[0]
+        self._cells = live
+
+    def _cell(self):
+        cell = [0]
+        with self._lock:
+            self._fold_locked()
+            self._cells.append((threading.current_thread(), cell))
+        self._local.cell = cell
+        return cell
+
+    def inc(self, amount=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+        cell[0] += amount
+
+    def get(self):
+        with self._lock:
+            self._fold_locked()
+            return self._base + sum(cell[0] for _, cell in self._cells)
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _ShardedValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.get()}"]
+
+class _ShardedHistogram:
+    """Histogram with one bucket array per thread, merged on collection.
+
+    As in _ShardedValue, arrays of exited threads are folded into a base.
+    """
+
+    __slots__ = ('buckets', '_local', '_cells', '_base', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._cells = []  # (thread, cell)
+        # Bucket counts, then sum and count
+        self._base = [0] * (len(buckets) + 1) + [0.0, 0]
+        self._lock = threading.Lock()
+
+    def _fold_locked(self):
+        live = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                live.append((thread, cell))
+            else:
+                for i, value in enumerate(cell):
+                    self._base[i] += value
+        self._cells = live
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            with self._lock:
+                self._fold_locked()
+                self._cells.append((threading.current_thread(), cell))
+            self._local.cell = cell
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._fold_locked()
+            merged = list(self._base)
+            for _, cell in self._cells:
+                for i, value in enumerate(cell):
+                    merged[i] += value
+        return merged
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _ShardedHistogram(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self, *label_values):
+        """Context manager observing the elapsed time of the block."""
+        return _Timer(self.labels(*label_values))
+
+    def _render_child(self, values, child):
+        merged = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), merged):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            labels = _format_labels(self.labelnames, values, ('le', le))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {merged[-2]}")
+        lines.append(f"{self.name}_count{labels} {merged[-1]}")
+        return lines
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, func):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def collect(self):
+        try:
+            value = self.func()
+        except Exception:
+            value = float('nan')
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} gauge",
+                f"{self.name} {value}"]
+
+def render():
+    """Render all registered metrics in the Prometheus text format."""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+def chrome_rss_bytes():
+    """Total resident memory of chrome and chromedriver processes, from /proc."""
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/status', 'rb') as f:
+                status = f.read()
+        except OSError:
+            continue
+        name = status.split(b'\n', 1)[0].split(b':', 1)[-1].strip()
+        if not name.startswith(b'chrome'):
+            continue
+        for line in status.split(b'\n'):
+            if line.startswith(b'VmRSS:'):
+                total += int(line.split()[1]) * 1024
+                break
+    return total
+
+# --------------------------
+# BOT METRICS
+# --------------------------
+login_attempts = Counter('dsts_login_attempts_total', 'Login runs started', ['mode'])
+login_outcomes = Counter('dsts_login_outcomes_total', 'Login runs by outcome', ['outcome'])
+ocr_latency = Histogram('dsts_ocr_request_seconds', 'OCR API request latency')
+ocr_results = Counter('dsts_ocr_results_total', 'OCR API results', ['result'])
+manual_captcha_fallbacks = Counter('dsts_manual_captcha_fallbacks_total',
+                                   'Logins that fell back to manual CAPTCHA entry')
+login_retry_latency = Histogram('dsts_login_retry_prepare_seconds',
+                                'Time to ready the login form for a retry', ['path'])
+click_results = Counter('dsts_click_attempts_total', 'Button clicks by strategy and result',
+                        ['strategy', 'result'])
+click_latency = Histogram('dsts_click_seconds', 'Button click latency by strategy', ['strategy'])
+form_saves = Counter('dsts_form_saves_total', 'Form save steps by result', ['result'])
+telegram_calls = Counter('dsts_telegram_api_calls_total', 'Telegram Bot API calls', ['method'])
+telegram_errors = Counter('dsts_telegram_api_errors_total', 'Failed Telegram Bot API calls', ['method'])
+telegram_latency = Histogram('dsts_telegram_api_seconds', 'Telegram Bot API call latency', ['method'])
+mongo_latency = Histogram('dsts_mongodb_command_seconds', 'MongoDB command latency', ['command'])
+mongo_failures = Counter('dsts_mongodb_command_failures_total', 'Failed MongoDB commands', ['command'])
+chrome_rss = Gauge('dsts_chrome_rss_bytes', 'Resident memory of Chrome processes', chrome_rss_bytes)
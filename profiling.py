@@ -0,0 +1,207 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from logger import bot_logger
+
+# Environment switch: profile the next PROFILE_RUNS runs (optionally one user only)
+PROFILE_RUNS = int(os.getenv('PROFILE_RUNS', '0'))
+PROFILE_USER = os.getenv('PROFILE_USER')
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'cpu')  # cpu (cProfile) or sample
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))
+
+MODES = ('cpu', 'sample')
+
+# Armed state; `armed` is the only thing checked when profiling is off
+armed = False
+_remaining = 0
+_user_id = None
+_mode = 'cpu'
+_lock = threading.Lock()
+_report_sink = None
+
+_active = threading.local()
+_active_count = 0
+_original_execute = None
+
+def set_report_sink(func):
+    """Register func(filename, text) to deliver finished profiles."""
+    global _report_sink
+    _report_sink = func
+
+def arm(runs, user_id=None, mode='cpu'):
+    """Profile the next `runs` runs, optionally only those of user_id."""
+    global armed, _remaining, _user_id, _mode
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode: {mode}")
+    with _lock:
+        _remaining = runs
+        _user_id = str(user_id) if user_id is not None else None
+        _mode = mode
+        armed = runs > 0
+
+def disarm():
+    arm(0)
+
+def status():
+    if not armed:
+        return "Profiling is off."
+    target = f"user {_user_id}" if _user_id else "any user"
+    return f"Profiling the next {_remaining} run(s) for {target} ({_mode} mode)."
+
+def _claim(user_id):
+    """Take one profiling slot for this run if it matches, returning the mode."""
+    global armed, _remaining
+    with _lock:
+        if not armed or (_user_id is not None and _user_id != str(user_id)):
+            return None
+        _remaining -= 1
+        armed = _remaining > 0
+        return _mode
+
+# --------------------------
+# WEBDRIVER TIMELINE
+# --------------------------
+def _timed_execute(self, driver_command, params=None):
+    timeline = getattr(_active, 'timeline', None)
+    if timeline is None:
+        return _original_execute(self, driver_command, params)
+    start = time.perf_counter()
+    ok = True
+    try:
+        return _original_execute(self, driver_command, params)
+    except Exception:
+        ok = False
+        raise
+    finally:
+        timeline.append((start, driver_command, (time.perf_counter() - start) * 1000, ok))
+
+def _install_webdriver_hook():
+    """Patch WebDriver.execute only while at least one profile is active."""
+    global _active_count, _original_execute
+    from selenium.webdriver.remote.webdriver import WebDriver
+    with _lock:
+        if _active_count == 0:
+            _original_execute = WebDriver.execute
+            WebDriver.execute = _timed_execute
+        _active_count += 1
+
+def _remove_webdriver_hook():
+    global _active_count
+    from selenium.webdriver.remote.webdriver import WebDriver
+    with _lock:
+        _active_count -= 1
+        if _active_count == 0:
+            WebDriver.execute = _original_execute
+
+# --------------------------
+# SAMPLING PROFILER
+# --------------------------
+class _StackSampler:
+    """Sample one thread's stack at a fixed interval into collapsed stacks."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self):
+        lines = [f"{count} {stack}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) or "(no samples)"
+
+# --------------------------
+# RUN HOOK
+# --------------------------
+def _format_timeline(timeline, run_start):
+    if not timeline:
+        return "(no WebDriver commands)"
+    total = sum(duration for _, _, duration, _ in timeline)
+    lines = [f"{len(timeline)} commands, {total:.0f} ms in WebDriver",
+             f"{'t+ms':>9} {'ms':>8}  command"]
+    for start, command, duration, ok in timeline:
+        flag = '' if ok else '  (error)'
+        lines.append(f"{(start - run_start) * 1000:>9.0f} {duration:>8.1f}  {command}{flag}")
+    return "\n".join(lines)
+
+@contextmanager
+def maybe_profile(kind, user_id):
+    """Profile this run if profiling is armed and the run matches."""
+    if not armed:
+        yield
+        return
+    mode = _claim(user_id)
+    if mode is None:
+        yield
+        return
+
+    bot_logger.info("Profiling %s run for user %s (%s mode)", kind, user_id, mode, extra={'user_id': user_id})
+    _active.timeline = []
+    try:
+        _install_webdriver_hook()
+        hooked = True
+    except ImportError:
+        hooked = False
+    profiler = sampler = None
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        sampler = _StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+        sampler.start()
+    run_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - run_start
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.stop()
+        if hooked:
+            _remove_webdriver_hook()
+        timeline = _active.timeline
+        _active.timeline = None
+
+        if profiler:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(60)
+            profile_text = out.getvalue()
+        else:
+            profile_text = sampler.report()
+        text = (f"{kind} run for user {user_id}, {elapsed:.2f}s wall, mode {mode}\n\n"
+                f"== WebDriver timeline ==\n{_format_timeline(timeline, run_start)}\n\n"
+                f"== Python profile ==\n{profile_text}")
+        filename = f"profile_{kind}_{user_id}_{int(time.time())}.txt"
+        if _report_sink:
+            try:
+                _report_sink(filename, text)
+            except Exception as e:
+                bot_logger.error("Failed to deliver profile: %s", e)
+
+if PROFILE_RUNS:
+    arm(PROFILE_RUNS, PROFILE_USER, PROFILE_MODE)
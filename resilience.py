@@ -0,0 +1,176 @@
+"""Retry, backoff and circuit breaker policies for calls to the target site.
+
+Each site operation (page load, login submit, post-login click, ...) has a
+RetryPolicy: a number of attempts, exponential backoff with full jitter
+and an overall deadline. Failed page loads and login submits also count
+towards one site-wide CircuitBreaker. While it is open, new runs are rejected at once
+instead of each user waiting on the site with a Chrome open.
+"""
+import os
+import random
+import threading
+import time
+from logger import bot_logger
+import metrics
+
+# Site-wide circuit breaker
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))  # Consecutive site failures before opening
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', '60'))  # Seconds open before a trial run
+
+retries = metrics.Counter('dsts_site_retries_total', 'Site operation retries', ['operation'])
+exhausted = metrics.Counter('dsts_site_failures_total', 'Site operations that failed after all retries',
+                            ['operation'])
+rejections = metrics.Counter('dsts_breaker_rejections_total', 'Runs rejected by the open circuit breaker')
+
+class CircuitOpenError(Exception):
+    """Raised when the site is considered down and calls are not attempted."""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"The site is not responding right now. "
+                         f"Please try again in about {max(int(retry_after), 1)} seconds.")
+
+class PageNotLoadedError(Exception):
+    """Raised when a page load returned without the elements expected on the page."""
+
+class CircuitBreaker:
+    """Closed -> open after `failures` consecutive failures -> half open after `cooldown`.
+
+    In half open state one trial call is let through; its success closes the
+    breaker, its failure opens it again for another cooldown.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def check(self, claim=True):
+        """Raise CircuitOpenError unless a call may go to the site now.
+
+        With claim=False the half open trial is not taken, for callers that
+        only want to turn a run away early before it reaches the site.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._trial_at = 0.0
+            if self.state == self.HALF_OPEN:
+                # One trial at a time; a trial that never reports back expires
+                if not self._trial_at or now - self._trial_at >= self.cooldown:
+                    if claim:
+                        self._trial_at = now
+                    return
+                retry_after = self._trial_at + self.cooldown - now
+            else:
+                retry_after = self._opened_at + self.cooldown - now
+        rejections.inc()
+        raise CircuitOpenError(retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                bot_logger.info("Circuit breaker %s closed, site is responding again", self.name)
+            self.state = self.CLOSED
+            self._consecutive = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self._consecutive >= self.failures):
+                bot_logger.warning("Circuit breaker %s opened after %s consecutive failures",
+                                   self.name, self._consecutive)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by attempts and a deadline."""
+
+    def __init__(self, name, attempts=3, base_delay=1.0, max_delay=10.0, deadline=60.0,
+                 attempt_timeout=30.0, breaker=None):
+        prefix = f"RETRY_{name.upper()}_"
+        self.name = name
+        self.attempts = int(os.getenv(prefix + 'ATTEMPTS', attempts))
+        self.base_delay = float(os.getenv(prefix + 'BASE_DELAY', base_delay))
+        self.max_delay = float(os.getenv(prefix + 'MAX_DELAY', max_delay))
+        self.deadline = float(os.getenv(prefix + 'DEADLINE', deadline))
+        self.attempt_timeout = float(os.getenv(prefix + 'ATTEMPT_TIMEOUT', attempt_timeout))
+        self.breaker = breaker
+
+    def backoff(self, retry):
+        """Delay before retry number `retry` (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def call(self, func, *args, retry_on=(Exception,), until=None, local_errors=(), **kwargs):
+        """Call func until it succeeds, attempts run out or the deadline passes.
+
+        A call fails when it raises one of `retry_on`, or when `until` is given
+        and returns False for its result. The last exception is re-raised; a
+        failing result is returned as is. Exceptions in `local_errors` are
+        retried like the others but are not the site's fault, so they do not
+        count towards the breaker.
+        """
+        if self.breaker:
+            self.breaker.check()
+        start = time.monotonic()
+        for attempt in range(self.attempts):
+            error = None
+            try:
+                result = func(*args, **kwargs)
+            except retry_on as e:
+                error = e
+            else:
+                if until is None or until(result):
+                    if self.breaker:
+                        self.breaker.record_success()
+                    return result
+            if self.breaker and not isinstance(error, local_errors):
+                self.breaker.record_failure()
+
+            delay = self.backoff(attempt)
+            last = attempt + 1 >= self.attempts
+            if last or time.monotonic() - start + delay >= self.deadline:
+                exhausted.labels(self.name).inc()
+                bot_logger.debug("%s failed after %s attempt(s): %s", self.name, attempt + 1, error)
+                if error is not None:
+                    raise error
+                return result
+            retries.labels(self.name).inc()
+            bot_logger.debug("%s attempt %s failed (%s), retrying in %.1fs",
+                             self.name, attempt + 1, error, delay)
+            time.sleep(delay)
+            if self.breaker:
+                self.breaker.check()
+
+site_breaker = CircuitBreaker('site')
+
+metrics.Gauge('dsts_site_breaker_open', 'Site circuit breaker open (1) or half open (0.5)',
+              lambda: {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 0.5,
+                       CircuitBreaker.OPEN: 1}[site_breaker.state])
+
+# Per-operation policies. Page loads and login submits count towards the site
+# breaker; clicks and CAPTCHA prompts fail for reasons of their own. Every
+# attribute can be overridden with
+# RETRY_<NAME>_<ATTEMPTS|BASE_DELAY|MAX_DELAY|DEADLINE|ATTEMPT_TIMEOUT>
+POLICIES = {
+    'page_load': RetryPolicy('page_load', attempts=3, deadline=90, attempt_timeout=30,
+                             breaker=site_breaker),
+    'submit_login': RetryPolicy('submit_login', attempts=2, deadline=30, breaker=site_breaker),
+    'click': RetryPolicy('click', attempts=3, base_delay=0.5, deadline=20),
+    'manual_captcha': RetryPolicy('manual_captcha', attempts=3, base_delay=1.0, max_delay=1.0,
+                                  deadline=200),
+}
+
+def policy(name):
+    return POLICIES[name]
@@ -1,20 +1,115 @@
+import json
+import os
+import signal
+import threading
+import time
+import requests
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.options import Options
 from logger import session_logger
+from browser_host import CHROME_ARGS, CHROME_BINARY
+from tracing import span
+from user_state import user_store
+import admission
+import metrics
+import health
+
+# Browser sessions this instance is sized for; used by the readiness probe
+MAX_BROWSER_SESSIONS = int(os.getenv('MAX_BROWSER_SESSIONS', '10'))
+CHROME_FAILURE_WINDOW = 300  # Seconds a failed Chrome start keeps the instance unready
+
+# Chrome watchdog
+WATCHDOG_INTERVAL = float(os.getenv('WATCHDOG_INTERVAL', '30'))  # Seconds between liveness rounds
+WATCHDOG_PROBE_TIMEOUT = float(os.getenv('WATCHDOG_PROBE_TIMEOUT', '10'))  # Deadline for one WebDriver probe
+
+chrome_crashes = metrics.Counter('dsts_chrome_crashes_total', 'Broken Chrome sessions found, by reason',
+                                 ['reason'])
+chrome_recovery = metrics.Histogram('dsts_chrome_recovery_seconds',
+                                    'Time to kill, reap and drop a broken Chrome session')
+# Browser host mode: Chrome is owned by browser_host.py and survives bot restarts
+BROWSER_HOST_URL = os.getenv('BROWSER_HOST_URL', '').rstrip('/')  # Empty: the bot starts Chrome itself
+SESSION_REGISTRY_FILE = os.getenv('SESSION_REGISTRY_FILE', 'sessions.json')  # Checkpoint of attached sessions
+BROWSER_HOST_TIMEOUT = 30  # Seconds for a browser host request (includes starting Chrome)
+
+# Session fields written to the registry; the driver itself is rebuilt on restore
+CHECKPOINT_FIELDS = ('address', 'username', 'landing_url', 'last_activity')
+
+zombies_reaped = metrics.Counter('dsts_zombie_processes_reaped_total', 'Zombie child processes reaped')
+
+def _process_table():
+    """pid -> (ppid, state, name) for every process, from /proc."""
+    table = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The name is in parentheses and may contain spaces
+        name = stat[stat.index(b'(') + 1:stat.rindex(b')')]
+        fields = stat[stat.rindex(b')') + 2:].split()
+        table[int(pid)] = (int(fields[1]), fields[0].decode(), name.decode(errors='replace'))
+    return table
+
+def _descendants(pid, table):
+    children = {}
+    for child, (ppid, _, _) in table.items():
+        children.setdefault(ppid, []).append(child)
+    found, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+def reap_zombies(table=None):
+    """waitpid() any of our own children that have exited but not been reaped."""
+    table = table or _process_table()
+    me = os.getpid()
+    for pid, (ppid, state, _) in table.items():
+        if ppid == me and state == 'Z':
+            try:
+                os.waitpid(pid, os.WNOHANG)
+                zombies_reaped.inc()
+            except ChildProcessError:
+                pass
+
+def _driver_process(driver):
+    service = getattr(driver, 'service', None)
+    return getattr(service, 'process', None)
+
+_chromedriver_path = None
+
+def _chromedriver():
+    global _chromedriver_path
+    if _chromedriver_path is None:
+        _chromedriver_path = ChromeDriverManager().install()
+    return _chromedriver_path
+
+def _host_request(method, path):
+    response = requests.request(method, BROWSER_HOST_URL + path, timeout=BROWSER_HOST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
 
 class SessionManager:
     def __init__(self):
         self.sessions = {}
         self.busy_users = set()
-        self.login_queue = {}
+        self.login_queue = user_store.field('last_login_attempt')
+        self.last_start_error = None
+        self.last_start_failed_at = None
+        self.crashes = 0
+        self._recover_lock = threading.Lock()
+        self._probes = {}  # user_id -> (driver, thread) of a probe that hung
 
     def is_user_busy(self, user_id):
         return user_id in self.busy_users
 
     def can_attempt_login(self, user_id):
-        import time
         current_time = time.time()
         if user_id in self.login_queue:
             last_attempt = self.login_queue[user_id]
@@ -23,6 +118,14 @@ class SessionManager:
         self.login_queue[user_id] = current_time
         return True
 
+    def finish_run(self, user_id):
+        """End a run: its slot stays with the user's Chrome, or is freed if there is none."""
+        if user_id in self.sessions:
+            admission.controller.idle(user_id)
+        else:
+            admission.controller.release(user_id)
+        self.set_user_busy(user_id, False)
+
     def set_user_busy(self, user_id, busy=True):
         if busy:
             self.busy_users.add(user_id)
@@ -32,46 +135,262 @@ class SessionManager:
                 del self.login_queue[user_id]
 
     def get_session(self, user_id):
-        session_logger.info(f"Getting session for user {user_id}")
+        session_logger.info("Getting session for user %s", user_id, extra={'user_id': user_id})
 
         if user_id in self.sessions and self.sessions[user_id]['driver']:
-            session_logger.debug(f"Existing session found for user {user_id}")
-            return self.sessions[user_id]
+            # Only the chromedriver exit status here; the watchdog scans /proc for the rest
+            process = _driver_process(self.sessions[user_id]['driver'])
+            reason = 'chromedriver_exited' if process is not None and process.poll() is not None else None
+            if reason is None:
+                session_logger.debug("Existing session found for user %s", user_id, extra={'user_id': user_id})
+                self.update_session(user_id)
+                return self.sessions[user_id]
+            # Dead browser: drop it and fall through to start a fresh one
+            self.recover(user_id, reason)
 
-        session_logger.info(f"Creating new Chrome session for user {user_id}")
+        session_logger.info("Creating new Chrome session for user %s", user_id, extra={'user_id': user_id})
         try:
-            chrome_options = Options()
-            chrome_options.add_argument('--no-sandbox')
-            chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--window-size=1920,1080')
-            chrome_options.add_argument('--headless=new')
-            chrome_options.add_argument('--disable-gpu')
-            chrome_options.add_argument('--disable-software-rasterizer')
-            chrome_options.add_argument('--single-process')
-            chrome_options.add_argument('--disable-extensions')
-            chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-            chrome_options.add_argument('--remote-debugging-port=9222')
-            chrome_options.binary_location = '/usr/bin/google-chrome'
-
-            driver = webdriver.Chrome(
-                service=Service(ChromeDriverManager().install()),
-                options=chrome_options
-            )
-            self.sessions[user_id] = {'driver': driver}
-            return self.sessions[user_id]
+            with span('chrome_start'):
+                if BROWSER_HOST_URL:
+                    address = _host_request('POST', f'/browsers/{user_id}')['address']
+                    session = {'driver': self._attach(address), 'address': address}
+                else:
+                    chrome_options = Options()
+                    for argument in CHROME_ARGS:
+                        chrome_options.add_argument(argument)
+                    chrome_options.binary_location = CHROME_BINARY
+                    driver = webdriver.Chrome(service=Service(_chromedriver()), options=chrome_options)
+                    session = {'driver': driver}
+            session['last_activity'] = time.time()
+            self.sessions[user_id] = session
+            self.last_start_error = None
+            self.checkpoint()
+            return session
         except Exception as e:
-            session_logger.error(f"Failed to create Chrome session: {str(e)}")
+            session_logger.error("Failed to create Chrome session: %s", e)
+            self.last_start_error = str(e)
+            self.last_start_failed_at = time.time()
             raise
 
-    def close_session(self, user_id):
-        if user_id in self.sessions:
+    def _attach(self, address):
+        """WebDriver for a browser host Chrome at address (host:port)."""
+        chrome_options = Options()
+        chrome_options.add_experimental_option('debuggerAddress', address)
+        return webdriver.Chrome(service=Service(_chromedriver()), options=chrome_options)
+
+    def update_session(self, user_id, **fields):
+        """Record session fields (site username, landing URL) and checkpoint them."""
+        session = self.sessions.get(user_id)
+        if session is None:
+            return
+        session.update(fields, last_activity=time.time())
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Write the session registry so a restarted bot can reattach."""
+        if not BROWSER_HOST_URL:
+            return
+        registry = {str(user_id): {field: session[field] for field in CHECKPOINT_FIELDS if field in session}
+                    for user_id, session in list(self.sessions.items()) if 'address' in session}
+        tmp_path = SESSION_REGISTRY_FILE + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(registry, f)
+            os.replace(tmp_path, SESSION_REGISTRY_FILE)
+        except OSError as e:
+            session_logger.error("Failed to checkpoint session registry: %s", e)
+
+    def restore(self):
+        """Reattach to the browser host Chromes listed in the registry."""
+        start = time.perf_counter()
+        try:
+            with open(SESSION_REGISTRY_FILE) as f:
+                registry = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            session_logger.error("Failed to read session registry: %s", e)
+            return
+        try:
+            running = _host_request('GET', '/browsers')
+        except Exception as e:
+            session_logger.error("Browser host unreachable, not restoring sessions: %s", e)
+            return
+
+        def reattach(user_id, saved):
             try:
-                self.sessions[user_id]['driver'].quit()
-            except:
+                session = dict(saved, driver=self._attach(saved['address']))
+            except Exception as e:
+                session_logger.warning("Failed to reattach session for user %s: %s", user_id, e, extra={'user_id': user_id})
+                return
+            self.sessions[user_id] = session
+
+        threads = [threading.Thread(target=reattach, args=(int(key), saved), name=f'reattach-{key}')
+                   for key, saved in registry.items()
+                   if key in running and running[key]['address'] == saved.get('address')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for user_id in self.sessions:
+            admission.controller.idle(user_id)
+        self.checkpoint()
+        session_logger.info("Reattached %s of %s saved Chrome sessions in %.0f ms",
+                            len(self.sessions), len(registry), (time.perf_counter() - start) * 1000)
+
+    def check_processes(self, user_id, table=None):
+        """Check without WebDriver; returns a failure reason or None.
+
+        table is a _process_table() to share between the sessions of one
+        watchdog round; read here if not given.
+        """
+        session = self.sessions.get(user_id)
+        if not session:
+            return None
+        process = _driver_process(session['driver'])
+        if process is None:
+            return None
+        if process.poll() is not None:
+            return 'chromedriver_exited'
+        table = table or _process_table()
+        browsers = [pid for pid in _descendants(process.pid, table) if table[pid][2].startswith('chrome')]
+        if browsers and all(table[pid][1] == 'Z' for pid in browsers):
+            return 'chrome_exited'
+        return None
+
+    def probe(self, user_id):
+        """Round trip to the browser with a deadline; returns a failure reason or None.
+
+        A driver gets at most one probe thread: while a hung one is still
+        blocked on it, later rounds report 'hung' without starting another.
+        """
+        session = self.sessions.get(user_id)
+        if not session:
+            return None
+        hung = self._probes.pop(user_id, None)
+        if hung and hung[0] is session['driver'] and hung[1].is_alive():
+            self._probes[user_id] = hung
+            return 'hung'
+        outcome = {}
+
+        def ping():
+            try:
+                session['driver'].execute_script('return 1')
+                outcome['ok'] = True
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=ping, name=f'chrome-probe-{user_id}', daemon=True)
+        thread.start()
+        thread.join(WATCHDOG_PROBE_TIMEOUT)
+        if thread.is_alive():
+            self._probes[user_id] = (session['driver'], thread)
+            return 'hung'
+        if 'error' in outcome:
+            session_logger.debug("Chrome probe for user %s failed: %s", user_id, outcome['error'], extra={'user_id': user_id})
+            return 'unresponsive'
+        return None
+
+    def validate(self, user_id):
+        """True if the user has a session whose browser processes are alive."""
+        if user_id not in self.sessions:
+            return False
+        reason = self.check_processes(user_id)
+        if reason:
+            self.recover(user_id, reason)
+            return False
+        return True
+
+    def recover(self, user_id, reason):
+        """Kill and reap a broken session's processes and drop the session.
+
+        A run blocked on the hung driver gets an error and ends; the next
+        get_session starts a new Chrome.
+        """
+        with self._recover_lock:
+            session = self.sessions.pop(user_id, None)
+        if session is None:
+            return
+        start = time.perf_counter()
+        process = _driver_process(session['driver'])
+        if process is not None:
+            table = _process_table()
+            for pid in _descendants(process.pid, table) + [process.pid]:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            try:
+                process.wait(timeout=5)
+            except Exception:
                 pass
-            del self.sessions[user_id]
+        reap_zombies()
+        if 'address' in session:
+            self._release_browser(user_id)
+        # A run keeps its slot for the Chrome get_session starts next; finish_run settles it
+        if not admission.controller.in_run(user_id):
+            admission.controller.release(user_id)
+        elapsed = time.perf_counter() - start
+        self.crashes += 1
+        chrome_crashes.labels(reason).inc()
+        chrome_recovery.observe(elapsed)
+        session_logger.warning("Chrome session for user %s was %s; killed and dropped in %.0f ms",
+                               user_id, reason.replace('_', ' '), elapsed * 1000, extra={'user_id': user_id})
+
+    def watchdog_round(self):
+        """Check every session; only idle ones get a WebDriver probe.
+
+        A session in use by a run or a speculative warmup may be in a long
+        page load that would look hung.
+        """
+        table = _process_table()
+        for user_id in list(self.sessions):
+            reason = self.check_processes(user_id, table)
+            if (reason is None and not self.is_user_busy(user_id)
+                    and not admission.controller.in_run(user_id)):
+                reason = self.probe(user_id)
+            if reason:
+                self.recover(user_id, reason)
+        reap_zombies()
+
+    def close_session(self, user_id):
+        session = self.sessions.pop(user_id, None)
+        if session:
+            self._quit(user_id, session)
+        admission.controller.release(user_id)
         self.set_user_busy(user_id, False)
 
+    def _quit(self, user_id, session):
+        try:
+            session['driver'].quit()
+        except:
+            pass
+        if 'address' in session:
+            self._release_browser(user_id)
+
+    def evict(self, user_id):
+        """Close an idle user's Chrome so a queued run can have its slot.
+
+        Called under the admission lock: the session is dropped here and
+        Chrome is quit on a thread of its own.
+        """
+        if self.is_user_busy(user_id):
+            return False
+        session = self.sessions.pop(user_id, None)
+        if session:
+            session_logger.info("Closing idle Chrome of user %s for a queued run", user_id, extra={'user_id': user_id})
+            threading.Thread(target=self._quit, args=(user_id, session), name=f'evict-{user_id}',
+                             daemon=True).start()
+        return True
+
+    def _release_browser(self, user_id):
+        """Stop the user's browser host Chrome and drop it from the registry."""
+        try:
+            _host_request('DELETE', f'/browsers/{user_id}')
+        except Exception as e:
+            session_logger.debug("Browser host did not stop Chrome for user %s: %s", user_id, e, extra={'user_id': user_id})
+        self.checkpoint()
+
     def close_all_sessions(self):
         for user_id in list(self.sessions.keys()):
             self.close_session(user_id)
@@ -80,3 +399,31 @@ class SessionManager:
 
 
 session_manager = SessionManager()
+admission.controller.evictor = session_manager.evict
+if BROWSER_HOST_URL:
+    session_manager.restore()
+user_store.add_pin(lambda user_id: user_id in session_manager.sessions or user_id in session_manager.busy_users)
+
+metrics.Gauge('dsts_active_sessions', 'Users with a Chrome session', lambda: len(session_manager.sessions))
+metrics.Gauge('dsts_busy_users', 'Users with a run in progress', lambda: len(session_manager.busy_users))
+
+def _browser_probe():
+    active = len(session_manager.sessions)
+    failing = (session_manager.last_start_error is not None and
+               time.time() - session_manager.last_start_failed_at < CHROME_FAILURE_WINDOW)
+    details = {'active': active, 'capacity': MAX_BROWSER_SESSIONS,
+               'last_start_error': session_manager.last_start_error,
+               'crashes': session_manager.crashes}
+    return active < MAX_BROWSER_SESSIONS and not failing, details
+
+health.register_probe('browser', _browser_probe)
+
+def _watchdog_loop():
+    while True:
+        time.sleep(WATCHDOG_INTERVAL)
+        try:
+            session_manager.watchdog_round()
+        except Exception as e:
+            session_logger.error("Chrome watchdog round failed: %s", e)
+
+threading.Thread(target=_watchdog_loop, name='chrome-watchdog', daemon=True).start()
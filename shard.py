@@ -0,0 +1,263 @@
+"""Sharded mode: one front process routing updates to N bot worker processes.
+
+The front polls Telegram (or receives webhook posts) and routes each update
+by consistent hashing of its chat id. Each worker is a separate process
+running bot.py (see shard_worker.py) with its own Chrome sessions, per-user
+state, log directory and health port. When a worker dies, its chats move to
+the next worker on the ring until it has restarted and reports ready.
+
+    SHARD_WORKERS=4 python shard.py
+"""
+import bisect
+import hashlib
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from telebot import apihelper
+from logger import bot_logger
+import health
+import metrics
+import webserver
+
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '2'))
+SHARD_REPLICAS = 64  # Virtual nodes per worker on the hash ring
+SHARD_QUEUE_SIZE = 10000  # Pending updates per worker before the front blocks
+WORKER_BASE_PORT = int(os.getenv('WORKER_BASE_PORT', '8001'))
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public URL of /webhook; polling when unset
+
+routed_updates = metrics.Counter('dsts_shard_routed_updates_total', 'Updates routed to workers', ['worker'])
+worker_restarts = metrics.Counter('dsts_shard_worker_restarts_total', 'Worker process restarts', ['worker'])
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, replicas=SHARD_REPLICAS):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def add(self, node):
+        with self._lock:
+            for replica in range(self.replicas):
+                point = _hash(f"{node}-{replica}")
+                if point not in self._owners:
+                    bisect.insort(self._points, point)
+                    self._owners[point] = node
+
+    def remove(self, node):
+        with self._lock:
+            for replica in range(self.replicas):
+                point = _hash(f"{node}-{replica}")
+                if self._owners.get(point) == node:
+                    del self._owners[point]
+                    self._points.remove(point)
+
+    def get(self, key):
+        with self._lock:
+            if not self._points:
+                return None
+            index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+            return self._owners[self._points[index]]
+
+    def nodes(self):
+        with self._lock:
+            return set(self._owners.values())
+
+def chat_key(update):
+    """The chat id an update belongs to, used as the routing key."""
+    for field in ('message', 'edited_message', 'channel_post'):
+        if field in update:
+            return update[field]['chat']['id']
+    if 'callback_query' in update:
+        callback = update['callback_query']
+        message = callback.get('message')
+        return message['chat']['id'] if message else callback['from']['id']
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return update.get('update_id')
+
+class Worker:
+    """One bot worker subprocess fed with JSON lines on stdin."""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.queue = queue.Queue(maxsize=SHARD_QUEUE_SIZE)
+        self.ready = False
+        self.restarts = 0
+
+    def start(self, on_ready):
+        env = dict(os.environ,
+                   BOT_WORKER_INDEX=str(self.index),
+                   LOG_DIR=os.path.join(os.getenv('LOG_DIR', 'logs'), f"worker-{self.index}"),
+                   PORT=str(WORKER_BASE_PORT + self.index),
+                   SESSION_REGISTRY_FILE=f"sessions-worker-{self.index}.json")
+        self.ready = False
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shard_worker.py')],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True, bufsize=1)
+        threading.Thread(target=self._read_output, args=(self.process, on_ready), daemon=True).start()
+        bot_logger.info("Started shard worker %s (pid %s)", self.index, self.process.pid)
+
+    def _read_output(self, process, on_ready):
+        for line in process.stdout:
+            if line.strip() == 'ready' and not self.ready:
+                self.ready = True
+                on_ready(self)
+            else:
+                sys.stdout.write(f"[worker {self.index}] {line}")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def send(self, batch):
+        """Write one batch of updates; returns False if the worker is gone."""
+        try:
+            self.process.stdin.write(json.dumps(batch) + '\n')
+            self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            return False
+
+class ShardFront:
+    def __init__(self, token, worker_count):
+        self.token = token
+        self.ring = HashRing()
+        self.workers = [Worker(index) for index in range(worker_count)]
+        self.pending = queue.Queue()  # Updates waiting for any worker to be ready
+        self.running = True
+
+    # ---- workers -----------------------------------------------------------
+    def _on_ready(self, worker):
+        self.ring.add(worker.index)
+        bot_logger.info("Shard worker %s ready, ring has %s workers", worker.index, len(self.ring.nodes()))
+        while not self.pending.empty():
+            self.route(self.pending.get_nowait())
+
+    def _sender(self, worker):
+        while self.running:
+            batch = [worker.queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(worker.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not (worker.alive() and worker.send(batch)):
+                # Worker is gone: hand its updates to whoever owns them now
+                self._worker_down(worker)
+                for update in batch:
+                    if update is not None:
+                        self.route(update)
+
+    def _worker_down(self, worker):
+        if worker.index in self.ring.nodes():
+            self.ring.remove(worker.index)
+            bot_logger.warning("Shard worker %s is down, its chats move to the next worker", worker.index)
+
+    def _supervise(self):
+        while self.running:
+            for worker in self.workers:
+                if worker.process is not None and not worker.alive():
+                    self._worker_down(worker)
+                    worker.restarts += 1
+                    worker_restarts.labels(worker.index).inc()
+                    worker.start(self._on_ready)
+            time.sleep(1)
+
+    def start_workers(self):
+        for worker in self.workers:
+            worker.start(self._on_ready)
+            threading.Thread(target=self._sender, args=(worker,), daemon=True).start()
+        threading.Thread(target=self._supervise, name='shard-supervisor', daemon=True).start()
+
+    # ---- routing -----------------------------------------------------------
+    def route(self, update):
+        index = self.ring.get(chat_key(update))
+        if index is None:
+            self.pending.put(update)
+            return
+        routed_updates.labels(index).inc()
+        self.workers[index].queue.put(update)
+
+    def heartbeat(self):
+        """Tell every ready worker that polling is alive (drives its health probe)."""
+        for index in self.ring.nodes():
+            worker = self.workers[index]
+            if worker.queue.empty():
+                worker.queue.put_nowait(None)
+
+    # ---- update sources ----------------------------------------------------
+    def poll(self):
+        offset = None
+        while self.running:
+            try:
+                updates = apihelper.get_updates(self.token, offset=offset, limit=100,
+                                                timeout=30, long_polling_timeout=20)
+            except Exception as e:
+                bot_logger.error("Front polling failed: %s", e)
+                time.sleep(3)
+                continue
+            for update in updates:
+                offset = update['update_id'] + 1
+                self.route(update)
+            self.heartbeat()
+
+    def webhook(self):
+        from flask import request
+
+        def receive():
+            self.route(request.get_json(force=True))
+            return ''
+
+        webserver.app.add_url_rule('/webhook', 'webhook', receive, methods=['POST'])
+        apihelper.set_webhook(self.token, url=WEBHOOK_URL)
+
+        def beat():
+            while self.running:
+                time.sleep(15)
+                self.heartbeat()
+
+        threading.Thread(target=beat, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers:
+            if worker.alive():
+                worker.process.terminate()
+
+def _shard_probe(front):
+    ready = sorted(front.ring.nodes())
+    return len(ready) == len(front.workers), {
+        'ready_workers': ready,
+        'restarts': {w.index: w.restarts for w in front.workers}}
+
+def run_front(token=None, worker_count=SHARD_WORKERS):
+    token = token or os.getenv('TELEGRAM_BOT_TOKEN')
+    if os.getenv('TELEGRAM_API_URL'):
+        apihelper.API_URL = os.getenv('TELEGRAM_API_URL')
+    front = ShardFront(token, worker_count)
+    health.register_probe('shard', lambda: _shard_probe(front))
+    front.start_workers()
+    if WEBHOOK_URL:
+        front.webhook()
+        webserver.keep_alive()
+    else:
+        webserver.keep_alive()
+        threading.Thread(target=front.poll, name='shard-poll', daemon=True).start()
+    return front
+
+if __name__ == '__main__':
+    front = run_front()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        front.stop()
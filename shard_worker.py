@@ -0,0 +1,24 @@
+"""Bot worker process for sharded mode (started by shard.py).
+
+Imports bot.py as usual but, instead of polling, reads JSON lines of update
+batches from stdin and hands them to telebot. An empty batch or null entry
+is a heartbeat from the front.
+"""
+import json
+import sys
+import time
+
+def main():
+    import bot
+    from telebot import types
+
+    print('ready', flush=True)
+    for line in sys.stdin:
+        batch = [update for update in json.loads(line) if update is not None]
+        bot.last_poll_at = time.time()
+        if batch:
+            bot.last_update_at = bot.last_poll_at
+            bot.bot.process_new_updates([types.Update.de_json(update) for update in batch])
+
+if __name__ == '__main__':
+    main()
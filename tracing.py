@@ -0,0 +1,135 @@
+import functools
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from logger import trace_logger
+
+# Spans kept in memory for the /traces percentile view
+TRACE_WINDOW_SPANS = int(os.getenv('TRACE_WINDOW_SPANS', '20000'))
+
+recent_spans = deque(maxlen=TRACE_WINDOW_SPANS)  # (end_time, stage, duration_ms)
+_current = threading.local()
+_run_listeners = []
+
+def current_run():
+    """Return (run_id, user_id, kind) for the run on this thread, or None."""
+    return getattr(_current, 'run', None)
+
+def _record(stage, start, ok, extra=None):
+    end = time.time()
+    duration_ms = (time.perf_counter() - start) * 1000
+    recent_spans.append((end, stage, duration_ms))
+    run_id, user_id, kind = current_run() or (None, None, None)
+    data = {
+        'ts': round(end, 3),
+        'run_id': run_id,
+        'user_id': user_id,
+        'kind': kind,
+        'stage': stage,
+        'duration_ms': round(duration_ms, 2),
+        'ok': ok,
+    }
+    if extra:
+        data.update(extra)
+    trace_logger.info(stage, extra={'data': data})
+    stages = getattr(_current, 'stages', None)
+    if run_id is not None and stages is not None and not stage.startswith('run.'):
+        stages[stage] = round(stages.get(stage, 0) + duration_ms, 2)
+
+def add_run_listener(func):
+    """Call func(run) when a run ends.
+
+    run is a dict: run_id, user_id, kind, started_at, ended_at, ok, stages
+    ({stage: total ms}) plus whatever annotate() attached.
+    """
+    _run_listeners.append(func)
+
+def annotate(**fields):
+    """Attach fields (outcome, site username, ...) to the run on this thread."""
+    annotations = getattr(_current, 'annotations', None)
+    if annotations is not None:
+        annotations.update(fields)
+
+@contextmanager
+def run(kind, user_id):
+    """Start a traced run; every span on this thread is tagged with its id."""
+    previous = (current_run(), getattr(_current, 'stages', None), getattr(_current, 'annotations', None))
+    run_id = uuid.uuid4().hex[:12]
+    _current.run = (run_id, user_id, kind)
+    _current.stages = stages = {}
+    _current.annotations = annotations = {}
+    started_at = time.time()
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield run_id
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        _record(f"run.{kind}", start, ok)
+        _current.run, _current.stages, _current.annotations = previous
+        finished = dict(annotations, run_id=run_id, user_id=user_id, kind=kind, ok=ok,
+                        started_at=started_at, ended_at=time.time(), stages=stages)
+        for listener in _run_listeners:
+            try:
+                listener(finished)
+            except Exception as e:
+                trace_logger.debug("Run listener failed: %s", e)
+
+@contextmanager
+def span(stage, **extra):
+    """Time one stage of the current run."""
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        _record(stage, start, ok, extra)
+
+def traced(stage):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _percentile(sorted_values, pct):
+    index = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+def stage_percentiles(window_seconds):
+    """Return {stage: (count, p50, p95, p99)} in ms over the recent window."""
+    cutoff = time.time() - window_seconds
+    by_stage = {}
+    for end, stage, duration_ms in list(recent_spans):
+        if end >= cutoff:
+            by_stage.setdefault(stage, []).append(duration_ms)
+    stats = {}
+    for stage, values in by_stage.items():
+        values.sort()
+        stats[stage] = (len(values), _percentile(values, 50),
+                        _percentile(values, 95), _percentile(values, 99))
+    return stats
+
+def format_percentiles(window_seconds):
+    """Render stage_percentiles() as a fixed-width table."""
+    stats = stage_percentiles(window_seconds)
+    if not stats:
+        return f"No traced stages in the last {window_seconds // 60} min."
+    lines = [f"Stage latency, last {window_seconds // 60} min (ms)",
+             f"{'stage':<22}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    for stage in sorted(stats):
+        count, p50, p95, p99 = stats[stage]
+        lines.append(f"{stage:<22}{count:>6}{p50:>9.0f}{p95:>9.0f}{p99:>9.0f}")
+    return "\n".join(lines)
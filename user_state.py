@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from logger import bot_logger
+
+# Per-user state retention
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', '3600'))  # Seconds idle before eviction
+USER_STATE_MAX = int(os.getenv('USER_STATE_MAX', '10000'))  # Max users kept in memory
+
+_UNSET = object()
+
+class UserContext:
+    """Everything the bot keeps in memory for one Telegram user."""
+
+    __slots__ = ('user_id', 'last_seen', 'bot', 'chat_id', 'pending_input',
+                 'last_message_id', 'state', 'last_login_attempt', 'keyboards')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.last_seen = time.monotonic()
+        self.bot = _UNSET
+        self.chat_id = _UNSET
+        self.pending_input = _UNSET  # None while waiting for the user's reply
+        self.last_message_id = _UNSET
+        self.state = _UNSET
+        self.last_login_attempt = _UNSET
+        self.keyboards = _UNSET  # Inline keyboards built from the user's credentials
+
+    def in_use(self):
+        return self.pending_input is None
+
+class UserStore:
+    """Thread-safe LRU store of UserContext objects with TTL and size bounds.
+
+    Users that are pinned (an active browser session, a run in progress or a
+    pending prompt) are never evicted.
+    """
+
+    def __init__(self, ttl=USER_STATE_TTL, max_size=USER_STATE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.evictions = 0
+        self._contexts = OrderedDict()
+        self._lock = threading.RLock()
+        self._pins = []
+
+    def add_pin(self, func):
+        """Register func(user_id) -> bool; True keeps the user from eviction."""
+        self._pins.append(func)
+
+    def _pinned(self, context):
+        return context.in_use() or any(pin(context.user_id) for pin in self._pins)
+
+    def get(self, user_id, create=True):
+        """Return the user's context, touching it; create it if asked."""
+        with self._lock:
+            context = self._contexts.get(user_id)
+            if context is None:
+                if not create:
+                    return None
+                context = self._contexts[user_id] = UserContext(user_id)
+                self._evict(keep=user_id)
+            else:
+                self._contexts.move_to_end(user_id)
+            context.last_seen = time.monotonic()
+            return context
+
+    def discard(self, user_id):
+        with self._lock:
+            self._contexts.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def _evict(self, keep=None):
+        """Drop expired users from the LRU end, then enforce max_size."""
+        now = time.monotonic()
+        skipped = []
+        while self._contexts:
+            user_id, context = next(iter(self._contexts.items()))
+            over_size = len(self._contexts) > self.max_size
+            if not over_size and now - context.last_seen < self.ttl:
+                break
+            if user_id == keep or self._pinned(context):
+                # Move pinned users out of the way without refreshing last_seen
+                self._contexts.move_to_end(user_id)
+                skipped.append(user_id)
+                if len(skipped) >= len(self._contexts):
+                    break
+                continue
+            del self._contexts[user_id]
+            self.evictions += 1
+
+    def sweep(self):
+        with self._lock:
+            before = self.evictions
+            self._evict()
+            evicted = self.evictions - before
+        if evicted:
+            bot_logger.debug("Evicted idle state for %s users, %s kept", evicted, len(self._contexts))
+
+    def field(self, name):
+        """A dict-like view of one context attribute across all users."""
+        return FieldView(self, name)
+
+class FieldView(MutableMapping):
+    """Mapping of user_id -> one UserContext attribute, for existing call sites."""
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def __getitem__(self, user_id):
+        context = self._store.get(user_id, create=False)
+        value = getattr(context, self._name) if context else _UNSET
+        if value is _UNSET:
+            raise KeyError(user_id)
+        return value
+
+    def __setitem__(self, user_id, value):
+        setattr(self._store.get(user_id), self._name, value)
+
+    def __delitem__(self, user_id):
+        context = self._store.get(user_id, create=False)
+        if context is None or getattr(context, self._name) is _UNSET:
+            raise KeyError(user_id)
+        setattr(context, self._name, _UNSET)
+
+    def __contains__(self, user_id):
+        context = self._store._contexts.get(user_id)
+        return context is not None and getattr(context, self._name) is not _UNSET
+
+    def __iter__(self):
+        with self._store._lock:
+            contexts = list(self._store._contexts.values())
+        return iter([c.user_id for c in contexts if getattr(c, self._name) is not _UNSET])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def clear(self):
+        with self._store._lock:
+            for context in self._store._contexts.values():
+                setattr(context, self._name, _UNSET)
+
+user_store = UserStore()
+
+def _sweep_periodically():
+    while True:
+        time.sleep(60)
+        user_store.sweep()
+
+threading.Thread(target=_sweep_periodically, name='user-state-sweep', daemon=True).start()
@@ -0,0 +1,128 @@
+"""Speculative login preparation while the credential keyboard is shown.
+
+handle_login calls start() right after sending "Select a username". A
+background thread starts Chrome, loads the login page and solves the CAPTCHA
+with OCR. When the user taps a username, claim() hands that work to the
+login run, which then only types the credentials and submits. Prepared work
+is released on cancel, /logout or after WARMUP_TIMEOUT without a tap.
+Preparation only starts on a free browser slot, which the login run keeps.
+"""
+import os
+import threading
+import time
+from logger import login_logger
+from session_manager_headless import session_manager
+import admission
+import ds
+import metrics
+import resilience
+
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') == '1'
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '120'))  # Seconds prepared work waits for a tap
+
+results = metrics.Counter('dsts_warmup_results_total', 'Speculative login preparations by result',
+                          ['result'])
+saved_seconds = metrics.Histogram('dsts_warmup_saved_seconds',
+                                  'Login latency saved by speculative preparation')
+
+class Warmup:
+    """One speculative preparation for one user."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        self.page_loaded = False
+        self.captcha_text = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f'warmup-{user_id}', daemon=True)
+        self.timer = threading.Timer(WARMUP_TIMEOUT, cancel, (user_id, 'expired'))
+        self.timer.daemon = True
+
+    def _run(self):
+        try:
+            session = session_manager.get_session(self.user_id)
+            if self.cancelled.is_set():
+                return
+            driver = session['driver']
+            ds.load_page(driver, ds.website_url)
+            self.page_loaded = True
+            if self.cancelled.is_set():
+                return
+            # No user_id: OCR status goes to the debug log, not the chat
+            self.captcha_text = ds.process_captcha(driver, None)
+        except Exception as e:
+            self.error = e
+            login_logger.debug("Speculative login preparation for %s failed: %s", self.user_id, e, extra={'user_id': self.user_id})
+        finally:
+            self.ready_at = time.monotonic()
+            if self.cancelled.is_set():
+                _release(self.user_id)
+
+_warmups = {}
+_lock = threading.Lock()
+
+def _release(user_id):
+    """Close a speculative Chrome (freeing its slot) unless a real run has taken the user over."""
+    if not session_manager.is_user_busy(user_id):
+        session_manager.close_session(user_id)
+
+def start(user_id):
+    """Begin preparing a login for user_id in the background."""
+    if not WARMUP_ENABLED:
+        return
+    with _lock:
+        if user_id in _warmups or user_id in session_manager.sessions:
+            return
+        try:
+            resilience.site_breaker.check(claim=False)
+        except resilience.CircuitOpenError:
+            return
+        # Only on a free browser slot: speculative work never queues
+        if not admission.controller.try_acquire(user_id, 'warmup'):
+            return
+        warmup = _warmups[user_id] = Warmup(user_id)
+    warmup.thread.start()
+    warmup.timer.start()
+
+def active(user_id):
+    """True while a speculative preparation owns the user's browser session."""
+    return user_id in _warmups
+
+def claim(user_id):
+    """Take over the user's prepared work for a login run, or None.
+
+    Waits for a preparation that is still running, since what it has done
+    so far is still ahead of starting from scratch.
+    """
+    with _lock:
+        warmup = _warmups.pop(user_id, None)
+    if warmup is None:
+        results.labels('miss').inc()
+        return None
+    warmup.timer.cancel()
+    claimed_at = time.monotonic()
+    warmup.thread.join()
+    if not warmup.page_loaded:
+        results.labels('failed').inc()
+        return None
+    saved = min(claimed_at, warmup.ready_at) - warmup.started_at
+    results.labels('hit' if warmup.captcha_text else 'partial').inc()
+    saved_seconds.observe(saved)
+    login_logger.info("Using speculative login preparation for %s, %.1fs saved (CAPTCHA %s)",
+                      user_id, saved, 'solved' if warmup.captcha_text else 'not solved', extra={'user_id': user_id})
+    return warmup
+
+def cancel(user_id, reason='cancelled'):
+    """Drop prepared work for user_id and release its Chrome."""
+    with _lock:
+        warmup = _warmups.pop(user_id, None)
+    if warmup is None:
+        return
+    warmup.timer.cancel()
+    warmup.cancelled.set()
+    results.labels(reason).inc()
+    if warmup.ready_at is not None:
+        _release(user_id)
+    # Otherwise the thread releases the session itself when it finishes
@@ -1,5 +1,8 @@
-from flask import Flask
+import os
+from flask import Flask, Response, jsonify
 from threading import Thread
+import metrics
+import health
 
 app = Flask(__name__)
 
@@ -7,9 +10,24 @@ app = Flask(__name__)
 def home():
     return "I'm alive"
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    ok, report = health.liveness()
+    return jsonify(report), 200 if ok else 503
+
+@app.route('/readyz')
+def readyz():
+    ok, report = health.readiness()
+    return jsonify(report), 200 if ok else 503
+
 def run():
-    app.run(host='0.0.0.0', port=8000)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '8000')))
 
 def keep_alive():
+    health.start()
     t = Thread(target=run)
     t.start()